@@ -14,6 +14,7 @@ import { API_ENDPOINTS } from './config';
 import { ThemeContext, UserContext } from './contexts/AppContext';
 import { VideoProvider } from './contexts/VideoContext';
 import VideoList from './screen/VideoList';
+import { parseAlert } from './utils/alerts';
 
 const Stack = createStackNavigator();
 
@@ -29,8 +30,9 @@ export default function App() {
     if (!userId) return;
     const ws = new WebSocket(`${API_ENDPOINTS.WS_ALERT}/${userId}`);
     ws.onmessage = (e) => {
-      if (e.data === "Fall detected!") {
-        Alert.alert("Alert", "Fall detected from camera!");
+      const alert = parseAlert(e.data);
+      if (alert.type === 'fall') {
+        Alert.alert("Alert", alert.message || "Fall detected from camera!");
       }
     };
     ws.onerror = (error) => {
@@ -0,0 +1,641 @@
+# benchmark.py - Load test the monitoring pipeline, MJPEG streaming, recording and /predict
+# with synthetic cameras. Every run prints (or writes) a JSON report that `compare` can diff.
+#
+#   python benchmark.py run --cameras 1,4,16 --viewers 0,2 --duration 30 --output base.json
+#   python benchmark.py predict --concurrency 1,8,32 --batch-sizes 0,8
+#   python benchmark.py compare base.json new.json
+#
+# The app is imported in-process from a scratch working directory so the real database,
+# footage and clip folders are never touched. Synthetic cameras show a walking person who
+# falls over and lies on the floor, drawn white, which the person tracker scores; with
+# --model stub (the default) a tiny TorchScript model also reports "fall" on white pixels,
+# so fall-to-alert latency is measured either way. --model real loads MODEL_PATH as the
+# server does.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+import torch
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ========== Stub Model ==========
+class StubFallModel(torch.nn.Module):
+    """Deterministic stand-in model: 'fall' when the frame has white pixels, 'normal' otherwise"""
+
+    def forward(self, x):
+        whitest = x.amin(dim=1).amax(dim=(1, 2)) - 1.0  # normalized white is above 2 in every channel
+        return torch.stack([-whitest, whitest], dim=1) * 4.0
+
+def export_stub_model(path):
+    torch.jit.script(StubFallModel()).save(path)
+    return path
+
+# ========== Synthetic Sources ==========
+class SourceStats:
+    """Frames produced by one synthetic camera and the times its scripted falls began"""
+
+    def __init__(self):
+        self.produced = 0
+        self.fall_onsets = []
+        self._lock = threading.Lock()
+
+    def record(self, falling, was_falling):
+        with self._lock:
+            self.produced += 1
+            if falling and not was_falling:
+                self.fall_onsets.append(time.time())
+
+sources = {}  # {camera_name: SourceStats}
+
+FALL_TIP_SECONDS = 0.4  # standing to lying
+
+def render_frame(position, size, fall_progress=None):
+    """Gray scene with a person walking along the floor (so motion gating keeps inferring)
+
+    fall_progress goes from 0 to 1 while they tip over; from then on they lie
+    on the floor, drawn white.
+    """
+    width, height = size
+    frame = np.full((height, width, 3), 90, dtype=np.uint8)
+    floor = height * 5 // 6
+    tall = height * 3 // 8
+    wide = tall // 3
+    span = max(1, width - 2 * tall - wide)
+    x = wide + abs((position + span) % (2 * span) - span)  # back and forth, people do not teleport
+    k = 0.0 if fall_progress is None else min(1.0, fall_progress)
+    w = int(wide + (tall - wide) * k)
+    h = int(tall - (tall - wide) * k)
+    cv2.rectangle(frame, (x, floor - h), (x + w, floor), (255, 255, 255) if k >= 1.0 else (40, 160, 220), -1)
+    # Some texture for optical flow
+    cv2.line(frame, (x + w // 4, floor - h + h // 5), (x + 3 * w // 4, floor - h + h // 5), (30, 30, 30), 2)
+    return frame
+
+class FrameScript:
+    """Frame generator shared by the in-process and HTTP sources"""
+
+    def __init__(self, name, fps, size, fall_every, fall_seconds):
+        self.name = name
+        self.fps = fps
+        self.size = size
+        self.fall_every = fall_every
+        self.fall_seconds = fall_seconds
+        self.stats = sources.setdefault(name, SourceStats())
+        self.started = time.time()
+        self.index = 0
+        self.position = 0
+        self.falling = False
+        self.fall_started = 0.0
+
+    def next_frame(self):
+        """Sleep until the next frame is due at fps, then return it"""
+        due = self.started + self.index / self.fps
+        delay = due - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        elapsed = time.time() - self.started
+        falling = bool(self.fall_every) and elapsed % self.fall_every >= self.fall_every - self.fall_seconds
+        self.stats.record(falling, self.falling)
+        if falling and not self.falling:
+            self.fall_started = elapsed
+        self.falling = falling
+        if falling:
+            frame = render_frame(self.position, self.size, (elapsed - self.fall_started) / FALL_TIP_SECONDS)
+        else:
+            self.position += max(1, int(120 / self.fps))  # about 120 px/s
+            frame = render_frame(self.position, self.size)
+        self.index += 1
+        return frame
+
+def parse_source_url(url):
+    """synthetic://<name>?fps=&size=WxH&fall_every=&fall_seconds= -> FrameScript arguments"""
+    parsed = urlparse(url)
+    query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+    width, height = (int(v) for v in query.get('size', '640x480').split('x'))
+    return dict(
+        name=parsed.netloc or parsed.path.strip('/'),
+        fps=float(query.get('fps', '25')),
+        size=(width, height),
+        fall_every=float(query.get('fall_every', '0')),
+        fall_seconds=float(query.get('fall_seconds', '4'))
+    )
+
+class SyntheticCapture:
+    """cv2.VideoCapture stand-in for synthetic:// cameras and loop:// video files, paced to fps"""
+
+    def __init__(self, url):
+        self.url = url
+        self._video = None
+        if url.startswith('loop://'):
+            parsed = urlparse(url)
+            self._path = parsed.path if parsed.netloc == '' else parsed.netloc + parsed.path
+            self._video = cv2.VideoCapture(self._path)
+            fps = float(parse_qs(parsed.query).get('fps', ['0'])[0]) or self._video.get(cv2.CAP_PROP_FPS) or 25.0
+            self.script = FrameScript(os.path.basename(self._path), fps, None, 0, 0)
+        else:
+            self.script = FrameScript(**parse_source_url(url))
+
+    def isOpened(self):
+        return self._video is None or self._video.isOpened()
+
+    def set(self, prop, value):
+        return True
+
+    def read(self):
+        if self._video is None:
+            return True, self.script.next_frame()
+        # Looping file: same pacing, frames come from the file
+        due = self.script.started + self.script.index / self.script.fps
+        delay = due - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        ok, frame = self._video.read()
+        if not ok:
+            self._video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self._video.read()
+        if ok:
+            self.script.index += 1
+            self.script.stats.record(False, False)
+        return ok, frame
+
+    def release(self):
+        if self._video is not None:
+            self._video.release()
+
+class MjpegSourceServer:
+    """Local HTTP MJPEG server standing in for network cameras
+
+    Cameras use http://127.0.0.1:<port>/<name>?fps=..., which goes through the
+    server's real open_video_capture and the OpenCV FFmpeg network decoder.
+    """
+
+    def __init__(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                script = FrameScript(**parse_source_url('synthetic:/' + self.path))
+                self.send_response(200)
+                self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+                self.end_headers()
+                try:
+                    while not server.closed:
+                        jpeg = cv2.imencode('.jpg', script.next_frame(), [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+                        self.wfile.write(b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: '
+                                         + str(len(jpeg)).encode() + b'\r\n\r\n' + jpeg + b'\r\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        self.closed = False
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.closed = True
+        self.httpd.shutdown()
+
+def camera_url(source, name, args, http_server=None):
+    query = f'fps={args.fps}&size={args.size}&fall_every={args.fall_every}&fall_seconds={args.fall_seconds}'
+    if source == 'synthetic':
+        return f'synthetic://{name}?{query}'
+    if source == 'http':
+        return f'http://127.0.0.1:{http_server.port}/{name}?{query}'
+    # file:<path>, looped; every camera gets its own stats entry
+    return f'loop://{os.path.abspath(source[len("file:"):])}?fps={args.fps}'
+
+# ========== App Setup ==========
+def load_app(args):
+    """Import main_api in a scratch working directory with synthetic sources patched in"""
+    workdir = args.workdir or tempfile.mkdtemp(prefix='dooyoo-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    if args.model == 'stub':
+        os.environ['MODEL_PATH'] = export_stub_model(os.path.join(workdir, 'stub_model.torchscript'))
+    elif os.environ.get('MODEL_PATH'):
+        os.environ['MODEL_PATH'] = os.path.abspath(os.environ['MODEL_PATH'])
+    else:
+        os.environ['MODEL_PATH'] = os.path.join(REPO_DIR, 'yolov5m.pt')
+    os.environ['DETECTOR_BACKEND'] = args.backend
+    os.environ.setdefault('MEDIA_TRANSCODE_ON_WRITE', '0')  # measure the pipeline, not ffmpeg
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import main_api
+
+    open_video_capture = main_api.open_video_capture
+
+    def open_source(url):
+        if url.startswith(('synthetic://', 'loop://')):
+            return SyntheticCapture(url)
+        return open_video_capture(url)
+
+    main_api.open_video_capture = open_source
+    if isinstance(main_api.detector, main_api.ProcessDetector):
+        main_api.detector.pool
+    deadline = time.time() + args.model_timeout
+    while not main_api.model_ready():
+        if time.time() > deadline:
+            raise RuntimeError(f"Model did not load within {args.model_timeout:.0f}s: {main_api.model_status()}")
+        time.sleep(0.2)
+    return main_api, workdir
+
+class Probe:
+    """Wrap detector.detect and alert_hub.publish to time inference and catch alerts"""
+
+    def __init__(self, app):
+        self.inference_ms = []
+        self.alerts = []  # [(time, camera_name)]
+        self._lock = threading.Lock()
+        detect = app.detector.detect
+        publish = app.alert_hub.publish
+
+        def timed_detect(frame, camera=None):
+            start = time.perf_counter()
+            try:
+                return detect(frame, camera)
+            finally:
+                with self._lock:
+                    self.inference_ms.append((time.perf_counter() - start) * 1000.0)
+
+        def recorded_publish(user_id, alert):
+            if alert.get('type') == 'fall':
+                with self._lock:
+                    self.alerts.append((time.time(), alert.get('camera_name')))
+            return publish(user_id, alert)
+
+        app.detector.detect = timed_detect
+        app.alert_hub.publish = recorded_publish
+
+    def reset(self):
+        with self._lock:
+            self.inference_ms = []
+            self.alerts = []
+
+def process_usage():
+    """(cpu_seconds, rss_mb) of this process"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = usage.ru_utime + usage.ru_stime
+    try:
+        with open('/proc/self/status') as f:
+            rss_kb = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+    except (OSError, StopIteration):
+        rss_kb = usage.ru_maxrss if sys.platform != 'darwin' else usage.ru_maxrss / 1024
+    return cpu, rss_kb / 1024.0
+
+def percentiles(values):
+    if not values:
+        return None
+    return {
+        'p50': round(float(np.percentile(values, 50)), 2),
+        'p99': round(float(np.percentile(values, 99)), 2),
+        'max': round(float(max(values)), 2),
+        'count': len(values)
+    }
+
+# ========== Pipeline Runs ==========
+async def watch_stream(app, url, user_id, camera_id, gaps, counts, slot):
+    last = None
+    async for _ in app.mjpeg_stream(url, user_id, camera_id):
+        now = time.perf_counter()
+        if last is not None:
+            gaps.append((now - last) * 1000.0)
+        last = now
+        counts[slot] += 1
+
+async def run_pipeline(app, probe, args, cameras, viewers, http_server):
+    """One sweep point: `cameras` monitored (and recorded) cameras with `viewers` MJPEG viewers each"""
+    user_id = f'bench-{cameras}x{viewers}-{int(time.time())}'
+    names = [f'{user_id}-cam{i}' for i in range(cameras)]
+    camera_infos = []
+    for name in names:
+        url = camera_url(args.source, name, args, http_server)
+        camera_infos.append(app.store.add_camera(user_id, {'name': name, 'rtsp_url': url, 'relay': False}))
+    base_cpu, base_rss = process_usage()
+    if args.monitor:
+        for info in camera_infos:
+            app.monitor_supervisor.start(user_id, info)
+    if args.record:
+        for info in camera_infos:
+            app.recording_manager.start(user_id, info)
+    gaps, counts, tasks = [], [0] * (cameras * viewers), []
+    for index, info in enumerate(camera_infos):
+        for v in range(viewers):
+            tasks.append(asyncio.create_task(watch_stream(app, info['rtsp_url'], user_id, info['id'],
+                                                          gaps, counts, index * viewers + v)))
+
+    def snapshot():
+        captures = {c['camera_id']: c['frames'] for c in app.capture_hub.stats() if c['user_id'] == user_id}
+        monitors = {w['camera_id']: w['frames'] for w in app.monitor_supervisor.stats(user_id)}
+        produced = {name: sources[name].produced if name in sources else 0 for name in names}
+        if args.source.startswith('file:'):
+            produced = {name: sum(s.produced for s in sources.values()) / max(1, cameras) for name in names}
+        return captures, monitors, produced, list(counts)
+
+    await asyncio.sleep(args.warmup)
+    probe.reset()
+    gaps.clear()
+    start_captures, start_monitors, start_produced, start_counts = snapshot()
+    start_cpu, _ = process_usage()
+    start = time.time()
+    await asyncio.sleep(args.duration)
+    elapsed = time.time() - start
+    end_captures, end_monitors, end_produced, end_counts = snapshot()
+    end_cpu, end_rss = process_usage()
+    recorders = app.recording_manager.stats(user_id) if args.record else []
+    onsets = {name: [t for t in sources[name].fall_onsets if start <= t < start + elapsed]
+              for name in names if name in sources}
+    alerts = list(probe.alerts)
+    inference_ms = list(probe.inference_ms)
+
+    # Tear down and wait until every capture of this run is closed
+    app.monitor_supervisor.stop(user_id)
+    app.recording_manager.stop(user_id)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    deadline = time.time() + 15
+    while time.time() < deadline and any(c['user_id'] == user_id for c in app.capture_hub.stats()):
+        await asyncio.sleep(0.2)
+    for info in camera_infos:
+        app.store.remove_camera(user_id, info['id'])
+
+    produced = sum(end_produced[n] - start_produced.get(n, 0) for n in names)
+    captured = sum(end_captures.get(i['id'], 0) - start_captures.get(i['id'], 0) for i in camera_infos)
+    monitored = sum(end_monitors.get(i['id'], 0) - start_monitors.get(i['id'], 0) for i in camera_infos)
+    delivered = sum(e - s for s, e in zip(start_counts, end_counts))
+    stream_target = min(args.fps, app.STREAM_MAX_FPS)
+    latencies, events = [], 0
+    for name, times in onsets.items():
+        for onset in times:
+            events += 1
+            matched = [t for t, camera in alerts if camera == name and onset <= t <= onset + args.fall_seconds + 5]
+            if matched:
+                latencies.append((min(matched) - onset) * 1000.0)
+    cpu_percent = (end_cpu - start_cpu) / elapsed * 100.0
+    return {
+        'kind': 'pipeline',
+        'cameras': cameras,
+        'viewers_per_camera': viewers,
+        'seconds': round(elapsed, 2),
+        'source': {
+            'fps_per_camera': round(produced / elapsed / cameras, 2),
+            'frames': produced
+        },
+        'capture': {
+            'fps_per_camera': round(captured / elapsed / cameras, 2),
+            'dropped_frames': max(0, produced - captured)
+        },
+        'monitor': {
+            'target_fps': app.MONITOR_FPS if args.monitor else 0,
+            'fps_per_camera': round(monitored / elapsed / cameras, 2),
+            'fps_deficit': round(max(0.0, app.MONITOR_FPS - monitored / elapsed / cameras), 2) if args.monitor else 0
+        },
+        'inference': {
+            'per_second': round(len(inference_ms) / elapsed, 2),
+            'latency_ms': percentiles(inference_ms)
+        },
+        'fall_to_alert': {
+            'events': events,
+            'alerts': len(latencies),
+            'missed': events - len(latencies),
+            'latency_ms': percentiles(latencies)
+        },
+        'stream': {
+            'viewers': cameras * viewers,
+            'fps_per_viewer': round(delivered / elapsed / max(1, cameras * viewers), 2) if viewers else 0,
+            'dropped_frames': max(0, int(stream_target * elapsed * cameras * viewers) - delivered),
+            'frame_gap_ms': percentiles(gaps)
+        },
+        'record': {
+            'frames_written': sum(r['frames_written'] for r in recorders),
+            'frames_dropped': sum(r['frames_dropped'] for r in recorders),
+            'max_encoder_lag_seconds': max((r['encoder_lag_seconds'] for r in recorders), default=0)
+        },
+        'resources': {
+            'cpu_percent': round(cpu_percent, 1),
+            'cpu_percent_per_camera': round(cpu_percent / cameras, 2),
+            'rss_mb': round(end_rss, 1),
+            'rss_mb_per_camera': round(max(0.0, end_rss - base_rss) / cameras, 2)
+        }
+    }
+
+async def run_sweep(app, args):
+    probe = Probe(app)
+    app.alert_hub.bind(asyncio.get_running_loop())
+    http_server = MjpegSourceServer() if args.source == 'http' else None
+    runs = []
+    try:
+        for cameras in args.cameras:
+            for viewers in args.viewers:
+                print(f"⏱️ {cameras} camera(s), {viewers} viewer(s) per camera...", file=sys.stderr)
+                runs.append(await run_pipeline(app, probe, args, cameras, viewers, http_server))
+    finally:
+        if http_server is not None:
+            http_server.close()
+    return runs
+
+# ========== /predict Runs ==========
+async def run_predict_sweep(app, args):
+    import httpx
+
+    rng = np.random.default_rng(0)
+    width, height = (int(v) for v in args.size.split('x'))
+    images = [cv2.imencode('.jpg', rng.integers(0, 255, (height, width, 3), dtype=np.uint8))[1].tobytes()
+              for _ in range(8)]
+    runs = []
+    transport = httpx.ASGITransport(app=app.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://benchmark', timeout=60) as client:
+        for batch_size in args.batch_sizes:
+            for concurrency in args.concurrency:
+                print(f"⏱️ /predict batch={batch_size or 'single'}, concurrency={concurrency}...", file=sys.stderr)
+                latencies, statuses = [], {}
+                deadline = time.time() + args.duration
+
+                async def worker(n):
+                    while time.time() < deadline:
+                        if batch_size:
+                            files = [('files', (f'{i}.jpg', images[(n + i) % len(images)], 'image/jpeg'))
+                                     for i in range(batch_size)]
+                            url = '/predict/batch'
+                        else:
+                            files = {'file': ('frame.jpg', images[n % len(images)], 'image/jpeg')}
+                            url = '/predict'
+                        start = time.perf_counter()
+                        response = await client.post(url, files=files)
+                        latencies.append((time.perf_counter() - start) * 1000.0)
+                        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                        if response.status_code == 429:
+                            await asyncio.sleep(0.05)
+
+                start_cpu, _ = process_usage()
+                start = time.time()
+                await asyncio.gather(*(worker(n) for n in range(concurrency)))
+                elapsed = time.time() - start
+                end_cpu, rss = process_usage()
+                ok = statuses.get(200, 0)
+                runs.append({
+                    'kind': 'predict',
+                    'batch_size': batch_size,
+                    'concurrency': concurrency,
+                    'seconds': round(elapsed, 2),
+                    'requests_per_second': round(sum(statuses.values()) / elapsed, 2),
+                    'images_per_second': round(ok * max(1, batch_size) / elapsed, 2),
+                    'rejected': statuses.get(429, 0),
+                    'statuses': {str(k): v for k, v in sorted(statuses.items())},
+                    'latency_ms': percentiles(latencies),
+                    'resources': {'cpu_percent': round((end_cpu - start_cpu) / elapsed * 100.0, 1),
+                                  'rss_mb': round(rss, 1)}
+                })
+    return runs
+
+# ========== Reports ==========
+def report_meta(app, args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'opencv': cv2.__version__,
+        'model': app.model_status(),
+        'config': {
+            'detector_backend': app.DETECTOR_BACKEND,
+            'monitor_fps': app.MONITOR_FPS,
+            'record_fps': app.RECORD_FPS,
+            'stream_max_fps': app.STREAM_MAX_FPS,
+            'infer_max_batch_size': app.INFER_MAX_BATCH_SIZE
+        },
+        'args': {k: v for k, v in vars(args).items() if k != 'func'}
+    }
+
+LOWER_IS_BETTER = ('latency', '_ms', 'cpu', 'rss', 'dropped', 'missed', 'lag', 'rejected', 'deficit')
+
+def flatten(run, prefix=''):
+    values = {}
+    for key, value in run.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            values.update(flatten(value, f'{name}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = value
+    return values
+
+def run_key(run):
+    if run.get('kind') == 'predict':
+        return f"predict batch={run['batch_size']} concurrency={run['concurrency']}"
+    return f"pipeline cameras={run['cameras']} viewers={run['viewers_per_camera']}"
+
+def compare_reports(base, new, threshold=0.1):
+    """Per sweep point and metric: base, new, relative change and whether it regressed"""
+    skip = ('cameras', 'viewers_per_camera', 'batch_size', 'concurrency', 'seconds')
+    base_runs = {run_key(r): flatten(r) for r in base['runs']}
+    comparison, regressions = {}, []
+    for run in new['runs']:
+        key = run_key(run)
+        if key not in base_runs:
+            continue
+        metrics = {}
+        for name, value in flatten(run).items():
+            old = base_runs[key].get(name)
+            if old is None or name.split('.')[-1] in skip or name.endswith('.count'):
+                continue
+            change = (value - old) / abs(old) if old else (0.0 if value == old else None)
+            lower_better = any(marker in name for marker in LOWER_IS_BETTER)
+            regressed = change is not None and (change > threshold if lower_better else change < -threshold)
+            metrics[name] = {'base': old, 'new': value,
+                             'change': round(change, 4) if change is not None else None, 'regressed': regressed}
+            if regressed:
+                regressions.append(f'{key}: {name}')
+        comparison[key] = metrics
+    return {'base_commit': base['meta'].get('commit'), 'new_commit': new['meta'].get('commit'),
+            'threshold': threshold, 'regressions': regressions, 'runs': comparison}
+
+def int_list(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+def write_report(report, output):
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text)
+        print(f"✅ Report written to {output}", file=sys.stderr)
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DooYoo load tests with synthetic cameras')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_app_args(command):
+        command.add_argument('--model', choices=('stub', 'real'), default='stub')
+        command.add_argument('--backend', choices=('local', 'process'), default='local')
+        command.add_argument('--model-timeout', type=float, default=120)
+        command.add_argument('--workdir', help='scratch folder for the database and footage (default: a temp dir)')
+        command.add_argument('--duration', type=float, default=20, help='measured seconds per sweep point')
+        command.add_argument('--size', default='640x480')
+        command.add_argument('--output', help='write the JSON report here instead of stdout')
+
+    run = commands.add_parser('run', help='monitoring, recording and MJPEG viewers over a camera/viewer sweep')
+    add_app_args(run)
+    run.add_argument('--cameras', type=int_list, default=[1, 4, 8])
+    run.add_argument('--viewers', type=int_list, default=[0, 2], help='MJPEG viewers per camera')
+    run.add_argument('--source', default='synthetic', help="synthetic, http (local MJPEG server) or file:<video>")
+    run.add_argument('--fps', type=float, default=25)
+    run.add_argument('--fall-every', type=float, default=12, help='seconds between scripted falls, 0 for none')
+    run.add_argument('--fall-seconds', type=float, default=4,
+                     help='how long the person lies on the floor, the tracker confirms after FALL_CONFIRM_SECONDS')
+    run.add_argument('--warmup', type=float, default=3)
+    run.add_argument('--no-monitor', dest='monitor', action='store_false')
+    run.add_argument('--record', action='store_true', help='also record every camera')
+    predict = commands.add_parser('predict', help='/predict and /predict/batch throughput over a concurrency sweep')
+    add_app_args(predict)
+    predict.add_argument('--concurrency', type=int_list, default=[1, 8, 32])
+    predict.add_argument('--batch-sizes', type=int_list, default=[0], help='0 posts single images to /predict')
+    compare = commands.add_parser('compare', help='diff two reports, exits 1 on regressions')
+    compare.add_argument('base')
+    compare.add_argument('new')
+    compare.add_argument('--threshold', type=float, default=0.1, help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        result = compare_reports(base, new, args.threshold)
+        print(json.dumps(result, indent=2))
+        sys.exit(1 if result['regressions'] else 0)
+
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    app, workdir = load_app(args)
+    if args.command == 'run':
+        runs = asyncio.run(run_sweep(app, args))
+    else:
+        runs = asyncio.run(run_predict_sweep(app, args))
+    report = {'meta': report_meta(app, args), 'runs': runs}
+    report['meta']['workdir'] = workdir
+    write_report(report, args.output)
+    os._exit(0)  # camera, writer and worker threads are daemons; don't wait on them
@@ -13,6 +13,7 @@ export const API_ENDPOINTS = {
   STATUS: `${BASE_URL}/status`,
   TEST_MODEL: `${BASE_URL}/test-model`,
   PREDICT: `${BASE_URL}/predict`,
+  PREDICT_BATCH: `${BASE_URL}/predict/batch`,
   WS_ALERT: `${BASE_URL.replace('http', 'ws')}/ws/alert`, // auto convert to ws://
 
   // CCTV API Endpoints
@@ -20,6 +21,8 @@ export const API_ENDPOINTS = {
   CCTV_GET_CAMERAS: `${BASE_URL}/cctv/cameras`,
   CCTV_REMOVE_CAMERA: `${BASE_URL}/cctv/remove-camera`,
   CCTV_START_RECORDING: `${BASE_URL}/cctv/start-recording`,
+  CCTV_STOP_RECORDING: `${BASE_URL}/cctv/stop-recording`,
+  CCTV_RECORDING_STATUS: `${BASE_URL}/cctv/recording-status`,
   CCTV_STATUS: `${BASE_URL}/cctv/status`,
   EDIT_CAMERA: `${BASE_URL}/cctv/edit-camera`,
 
@@ -28,7 +31,7 @@ export const API_ENDPOINTS = {
   CCTV_STREAM_CAMERA: `${BASE_URL}/cctv/stream`,
   GET_CAMERAS: `${BASE_URL}/cctv/cameras`,
   ADD_CAMERA: `${BASE_URL}/cctv/add-camera`,
-  STREAM_CAMERA: `${BASE_URL}/cctv/stream/:userId/:cameraIndex`,
+  STREAM_CAMERA: `${BASE_URL}/cctv/stream/:userId/:cameraId`,
   ONVIF_DISCOVER: BASE_URL + '/onvif/discover',
 
   // Video API Endpoints
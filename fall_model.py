@@ -0,0 +1,750 @@
+# fall_model.py - Fall detection model loading, pre/post-processing and inference worker processes
+# Kept separate from main_api.py so worker processes can import it without starting the API
+import importlib.util
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+from structured_log import log, setup_logging
+
+MODEL_PATH = os.environ.get('MODEL_PATH', 'yolov5m.pt')
+# Set MODEL_ALLOW_HUB=0 to never fetch from GitHub; MODEL_HUB_REPO may point at a local yolov5 checkout
+MODEL_ALLOW_HUB = os.environ.get('MODEL_ALLOW_HUB', '1') == '1'
+MODEL_HUB_REPO = os.environ.get('MODEL_HUB_REPO', 'ultralytics/yolov5')
+MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', '5'))  # seconds, 0 disables hot-swap
+MODEL_RUNTIME = os.environ.get('MODEL_RUNTIME', 'eager')  # see MODEL_RUNTIMES
+PERSON_CONFIDENCE = float(os.environ.get('PERSON_CONFIDENCE', '0.4'))  # detection models only
+PERSON_NMS_IOU = 0.45
+CLASSIFIER_INPUT_SIZE = 224
+DETECTOR_INPUT_SIZE = int(os.environ.get('DETECTOR_INPUT_SIZE', '640'))  # letterbox side, a multiple of 32
+MODEL_INFO_FILE = 'model_info.json'  # kind and input shape, stored in TorchScript exports
+
+def _load_model(path=MODEL_PATH, allow_hub=MODEL_ALLOW_HUB, hub_repo=MODEL_HUB_REPO):
+    """Load the model, returns (model, source) or raises
+
+    A TorchScript export at `path` loads without torch.hub. Other checkpoints
+    go through torch.hub, from a local checkout if hub_repo is a directory.
+    """
+    hub_source = 'local' if os.path.isdir(hub_repo) else 'github'
+    if os.path.exists(path):
+        extra_files = {MODEL_INFO_FILE: ''}
+        try:
+            model = torch.jit.load(path, map_location='cpu', _extra_files=extra_files)
+        except RuntimeError:
+            model = None  # not a TorchScript archive, e.g. a YOLOv5 checkpoint
+        if model is not None:
+            if extra_files[MODEL_INFO_FILE]:
+                info = json.loads(extra_files[MODEL_INFO_FILE])
+                if list(input_shape(info['kind'])[1:]) != info['input_shape'][1:]:
+                    raise RuntimeError(f"{path} was exported for {info['kind']} input {info['input_shape'][1:]}, "
+                                       f"re-export it or set DETECTOR_INPUT_SIZE={info['input_shape'][-1]}")
+                model.model_kind = info['kind']
+            log.info('model_loaded', "✅ TorchScript model loaded", path=path, source='torchscript')
+            return model.eval(), 'torchscript'
+        if hub_source == 'github' and not allow_hub:
+            raise RuntimeError(f"{path} is not a TorchScript export and MODEL_ALLOW_HUB=0")
+        # Try to load custom YOLOv5 model first
+        model = torch.hub.load(hub_repo, 'custom', path=path, source=hub_source, force_reload=False)
+        log.info('model_loaded', "✅ Custom YOLOv5 model loaded successfully", path=path, source='hub-custom')
+        return model.eval(), 'hub-custom'
+    if hub_source == 'github' and not allow_hub:
+        raise FileNotFoundError(f"Model file {path} not found and MODEL_ALLOW_HUB=0")
+    # Load pre-trained YOLOv5m from hub
+    model = torch.hub.load(hub_repo, 'yolov5m', pretrained=True, source=hub_source)
+    log.info('model_loaded', "✅ Pre-trained YOLOv5m model loaded successfully", source='hub-pretrained')
+    return model.eval(), 'hub-pretrained'
+
+def load_model(path=MODEL_PATH):
+    """Load the YOLOv5 model, returns None if it cannot be loaded"""
+    try:
+        return _load_model(path)[0]
+    except Exception as e:
+        log.error('model_load_failed', "❌ Cannot load YOLOv5 model, fall detection disabled", path=path, error=str(e))
+        return None
+
+MODEL_RUNTIMES = ('eager', 'torchscript', 'compile', 'int8', 'channels_last', 'onnx')
+
+def model_kind(model):
+    """'detector' for a YOLOv5-style (N, A, 5 + classes) output, 'classifier' for (N, C) logits
+
+    Exports carry their kind (see export_torchscript). Other models are
+    probed at the detector input size first, a traced YOLOv5 only runs at
+    the size it was traced at, then at the classifier size.
+    """
+    kind = getattr(model, 'model_kind', None)
+    if kind is not None:
+        return kind
+    for probe in ('detector', 'classifier'):
+        try:
+            with torch.no_grad():
+                output = primary_output(model(torch.zeros(input_shape(probe))))
+        except Exception:
+            if probe == 'classifier':
+                raise
+            continue
+        return 'detector' if output.dim() == 3 else 'classifier'
+
+def export_torchscript(path=MODEL_PATH, output='fall_model.torchscript'):
+    """Trace the model at its input shape and save it with its kind, returns (source, kind)"""
+    model, source = _load_model(path)
+    kind = model_kind(model)
+    shape = input_shape(kind)
+    with torch.no_grad():
+        scripted = torch.jit.trace(model, torch.zeros(shape), strict=False)
+    scripted.save(output, _extra_files={MODEL_INFO_FILE: json.dumps({'kind': kind, 'input_shape': list(shape)})})
+    return source, kind
+
+def input_shape(kind, batch_size=1):
+    """Model input shape for a model kind: 224 center crops for classifiers, letterboxed frames for detectors"""
+    size = DETECTOR_INPUT_SIZE if kind == 'detector' else CLASSIFIER_INPUT_SIZE
+    return (batch_size, 3, size, size)
+
+class ChannelsLastModel:
+    """Run a channels_last model on NCHW inputs, converting the input layout per call"""
+
+    def __init__(self, model):
+        self.model = model.to(memory_format=torch.channels_last)
+
+    def __call__(self, inputs):
+        return self.model(inputs.contiguous(memory_format=torch.channels_last))
+
+class OnnxRuntimeModel:
+    """Run an ONNX export through onnxruntime, taking and returning torch tensors"""
+
+    def __init__(self, onnx_path, threads=None):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, inputs):
+        outputs = self.session.run(None, {self.input_name: inputs.numpy()})
+        return torch.from_numpy(outputs[0])
+
+def _export_onnx(model, path, shape):
+    """Export to <model>.onnx next to the model file, reusing an export newer than the model"""
+    onnx_path = os.path.splitext(path)[0] + '.onnx'
+    if os.path.exists(onnx_path) and (not os.path.exists(path) or
+                                      os.path.getmtime(onnx_path) >= os.path.getmtime(path)):
+        return onnx_path
+    torch.onnx.export(model, torch.zeros(shape), onnx_path, input_names=['images'],
+                      output_names=['output'], dynamic_axes={'images': {0: 'batch'}, 'output': {0: 'batch'}})
+    log.info('onnx_exported', "✅ Exported ONNX model", path=onnx_path)
+    return onnx_path
+
+def prepare_runtime(model, runtime=MODEL_RUNTIME, path=MODEL_PATH, kind='classifier'):
+    """Wrap a loaded eval-mode model for an execution runtime
+
+    Every runtime is called with a float tensor of input_shape(kind) and
+    returns the output that prediction_from_output expects. Tracing and
+    export use that shape, YOLOv5 bakes its grid size in.
+    """
+    if runtime == 'eager':
+        return model
+    if runtime == 'torchscript':
+        if not isinstance(model, torch.jit.ScriptModule):
+            with torch.no_grad():
+                model = torch.jit.trace(model, torch.zeros(input_shape(kind)), strict=False)
+        return torch.jit.optimize_for_inference(torch.jit.freeze(model.eval()))
+    if runtime == 'compile':
+        return torch.compile(model)
+    if runtime == 'int8':
+        # Dynamic quantization covers Linear layers only, convolutions stay fp32
+        if isinstance(model, torch.jit.ScriptModule):
+            raise RuntimeError("int8 runtime needs an eager model, not a TorchScript export")
+        if not any(isinstance(m, torch.nn.Linear) for m in model.modules()):
+            # YOLOv5 is all convolutions, it would keep serving fp32 under the int8 name
+            raise RuntimeError("int8 runtime quantizes Linear layers only and this model has none")
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if runtime == 'channels_last':
+        return ChannelsLastModel(model)
+    if runtime == 'onnx':
+        if importlib.util.find_spec('onnxruntime') is None:
+            raise RuntimeError("onnx runtime needs the onnxruntime package")
+        return OnnxRuntimeModel(_export_onnx(model, path, input_shape(kind)), torch.get_num_threads())
+    raise ValueError(f"Unknown MODEL_RUNTIME '{runtime}', expected one of {', '.join(MODEL_RUNTIMES)}")
+
+class ModelManager:
+    """Own the loaded model: background loading, warmup and hot-swap
+
+    state goes idle -> loading -> ready or failed. When the model file
+    changes the new model is loaded and warmed up next to the current one,
+    which keeps serving until the swap; a failed reload keeps the old model.
+    A runtime that cannot be prepared or warmed up falls back to eager.
+    Loads are serialized, so the watcher and an explicit reload never race.
+    """
+
+    def __init__(self, path=MODEL_PATH, warmup_batch_sizes=(1,), watch_interval=MODEL_WATCH_INTERVAL,
+                 runtime=MODEL_RUNTIME):
+        self.path = path
+        self.runtime = runtime
+        self.active_runtime = None
+        self.warmup_batch_sizes = sorted(set(warmup_batch_sizes))
+        self.watch_interval = watch_interval
+        self.model = None
+        self.kind = None  # see model_kind(), picks the preprocessing
+        self.state = 'idle'
+        self.source = None
+        self.error = None
+        self.loaded_at = None
+        self.load_seconds = None
+        self.warmup_ms = {}  # {batch_size: ms}
+        self.reloads = 0
+        self._mtime = None
+        self._started = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()  # held for a whole load-and-swap
+
+    def start(self):
+        """Load in a daemon thread and then watch the file, safe to call more than once"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        self.load()
+        while self.watch_interval > 0:
+            time.sleep(self.watch_interval)
+            if self.changed():
+                self.load()
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def changed(self):
+        """Whether the model file appeared or was replaced since the last load attempt"""
+        mtime = self._file_mtime()
+        return mtime is not None and mtime != self._mtime
+
+    def warmup(self, model, kind='classifier'):
+        """Run one dummy batch per configured size, returns {batch_size: ms}"""
+        timings = {}
+        with torch.no_grad():
+            for batch_size in self.warmup_batch_sizes:
+                start = time.perf_counter()
+                model(torch.zeros(input_shape(kind, batch_size)))
+                timings[batch_size] = round((time.perf_counter() - start) * 1000.0, 2)
+        return timings
+
+    def load(self):
+        """Load (or reload) and warm up the model synchronously, returns True on success
+
+        A call made while another load runs waits for it, then loads again.
+        """
+        with self._load_lock:
+            return self._load()
+
+    def _load(self):
+        with self._lock:
+            self._started = True
+            if self.model is None:
+                self.state = 'loading'
+            # Remember the attempt so a broken file is retried only once it changes again
+            self._mtime = self._file_mtime()
+        start = time.perf_counter()
+        try:
+            model, source = _load_model(self.path)
+            kind = model_kind(model)
+            runtime = self.runtime
+            try:
+                prepared = prepare_runtime(model, runtime, self.path, kind)
+                warmup_ms = self.warmup(prepared, kind)
+            except Exception as e:
+                if runtime == 'eager':
+                    raise
+                log.warning('model_runtime_fallback', "⚠️ Model runtime failed, falling back to eager",
+                            runtime=runtime, error=str(e))
+                runtime = 'eager'
+                prepared = model
+                warmup_ms = self.warmup(prepared, kind)
+        except Exception as e:
+            self.error = str(e)
+            if self.model is None:
+                self.state = 'failed'
+                log.error('model_load_failed', "❌ Cannot load YOLOv5 model, fall detection disabled",
+                          path=self.path, error=str(e))
+            else:
+                log.error('model_reload_failed', "❌ Model reload failed, keeping the current model",
+                          path=self.path, error=str(e))
+            return False
+        reloaded = self.model is not None
+        self.kind = kind
+        self.model = prepared
+        self.source = source
+        self.active_runtime = runtime
+        self.warmup_ms = warmup_ms
+        self.load_seconds = round(time.perf_counter() - start, 3)
+        self.loaded_at = time.time()
+        self.error = None
+        self.state = 'ready'
+        if reloaded:
+            self.reloads += 1
+            log.info('model_reloaded', "🔄 Model reloaded", path=self.path, runtime=runtime)
+        return True
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'path': self.path,
+            'source': self.source,
+            'kind': self.kind,
+            'runtime': self.active_runtime,
+            'requested_runtime': self.runtime,
+            'error': self.error,
+            'loaded_at': self.loaded_at,
+            'load_seconds': self.load_seconds,
+            'warmup_ms': self.warmup_ms,
+            'reloads': self.reloads
+        }
+
+_val_transforms = None
+
+def __getattr__(name):
+    # val_transforms is built on first use: importing torchvision costs over a
+    # second at startup and the serving path uses FramePreprocessor instead
+    global _val_transforms
+    if name == 'val_transforms':
+        if _val_transforms is None:
+            from torchvision import transforms
+            _val_transforms = transforms.Compose([
+                transforms.Resize(256),
+                transforms.CenterCrop(224),
+                transforms.ToTensor(),
+                transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+            ])
+        return _val_transforms
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def transform_image(image):
+    return __getattr__('val_transforms')(image)
+
+def frame_to_tensor(frame):
+    """BGR camera frame to a normalized CHW model input through PIL and val_transforms"""
+    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    return transform_image(Image.fromarray(frame_rgb))
+
+def crop_geometry(height, width, resize=256, crop=224):
+    """((resized_h, resized_w), top, left) of the model input inside a resized frame"""
+    # Same rounding as torchvision Resize(int) and CenterCrop
+    if width <= height:
+        size = (int(resize * height / width), resize)
+    else:
+        size = (resize, int(resize * width / height))
+    top = int(round((size[0] - crop) / 2.0))
+    left = int(round((size[1] - crop) / 2.0))
+    return size, top, left
+
+class FramePreprocessor:
+    """Batched torch-native equivalent of val_transforms for uint8 BGR frames
+
+    Resizes the shorter side to 256 with antialiased bilinear interpolation on
+    uint8 (the same filter PIL uses), center-crops 224 and fuses the BGR->RGB
+    swap, ToTensor scaling and Normalize into one pass per channel, writing
+    into a preallocated (max_batch, 3, 224, 224) tensor. The returned tensor
+    is a view of that buffer and is overwritten by the next call, so an
+    instance must not be shared between threads.
+    """
+
+    def __init__(self, max_batch_size=8, resize=256, crop=224,
+                 mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)):
+        self.resize = resize
+        self.crop = crop
+        self.max_batch_size = max_batch_size
+        std = torch.tensor(std, dtype=torch.float32)
+        self._scale = (1.0 / (255.0 * std)).view(1, 3, 1, 1)
+        self._bias = (-torch.tensor(mean, dtype=torch.float32) / std).view(1, 3, 1, 1)
+        self._output = torch.empty((max_batch_size, 3, crop, crop), dtype=torch.float32)
+
+    def _geometry(self, height, width):
+        return crop_geometry(height, width, self.resize, self.crop)
+
+    def _write(self, frames, start):
+        """Resize, crop and normalize an (N, H, W, 3) uint8 array into the output buffer"""
+        size, top, left = self._geometry(*frames.shape[1:3])
+        images = torch.from_numpy(frames).permute(0, 3, 1, 2)  # channels_last view, no copy
+        resized = torch.nn.functional.interpolate(images, size=size, mode='bilinear',
+                                                  antialias=True, align_corners=False)
+        cropped = resized[:, :, top:top + self.crop, left:left + self.crop]
+        output = self._output[start:start + len(frames)]
+        for channel in range(3):
+            output[:, channel].copy_(cropped[:, 2 - channel])  # BGR -> RGB
+        output.mul_(self._scale).add_(self._bias)
+
+    def __call__(self, frames):
+        """Preprocess one (H, W, 3) frame, an (N, H, W, 3) array or a list of frames
+
+        Returns an (N, 3, 224, 224) view of the reusable output buffer.
+        """
+        if isinstance(frames, np.ndarray):
+            frames = frames[None] if frames.ndim == 3 else frames
+        count = len(frames)
+        if count > self.max_batch_size:
+            raise ValueError(f"Batch of {count} exceeds max_batch_size {self.max_batch_size}")
+        if isinstance(frames, np.ndarray):
+            self._write(np.ascontiguousarray(frames), 0)
+        else:
+            # Frames of the same size are resized together
+            start = 0
+            while start < count:
+                end = start + 1
+                while end < count and frames[end].shape == frames[start].shape:
+                    end += 1
+                self._write(np.stack(frames[start:end]), start)
+                start = end
+        return self._output[:count]
+
+def letterbox_geometry(height, width, size=DETECTOR_INPUT_SIZE):
+    """((resized_h, resized_w), top, left) of a frame letterboxed into size x size, as YOLOv5 does"""
+    scale = min(size / height, size / width)
+    resized_h, resized_w = int(round(height * scale)), int(round(width * scale))
+    return (resized_h, resized_w), (size - resized_h) // 2, (size - resized_w) // 2
+
+class LetterboxPreprocessor(FramePreprocessor):
+    """Batched YOLOv5 input for uint8 BGR frames
+
+    Scales the whole frame to fit size x size keeping its aspect ratio, pads
+    the rest with gray 114 and writes RGB scaled to [0, 1], without mean/std
+    normalization. Same output buffer rules as FramePreprocessor.
+    """
+
+    def __init__(self, max_batch_size=8, size=DETECTOR_INPUT_SIZE):
+        self.size = size
+        self.max_batch_size = max_batch_size
+        self._output = torch.empty((max_batch_size, 3, size, size), dtype=torch.float32)
+
+    def _write(self, frames, start):
+        (resized_h, resized_w), top, left = letterbox_geometry(*frames.shape[1:3], self.size)
+        images = torch.from_numpy(frames).permute(0, 3, 1, 2)
+        if (resized_h, resized_w) != frames.shape[1:3]:
+            images = torch.nn.functional.interpolate(images, size=(resized_h, resized_w), mode='bilinear',
+                                                     antialias=True, align_corners=False)
+        output = self._output[start:start + len(frames)]
+        output.fill_(114.0 / 255.0)
+        inner = output[:, :, top:top + resized_h, left:left + resized_w]
+        for channel in range(3):
+            inner[:, channel].copy_(images[:, 2 - channel])  # BGR -> RGB
+        inner.mul_(1.0 / 255.0)
+
+def make_preprocessor(kind, max_batch_size=8):
+    """Input pipeline for a model kind (see model_kind), classifier by default"""
+    if kind == 'detector':
+        return LetterboxPreprocessor(max_batch_size)
+    return FramePreprocessor(max_batch_size)
+
+def primary_output(outputs):
+    """Models that return (predictions, extras), such as YOLOv5 in eval mode, keep the predictions"""
+    while isinstance(outputs, (list, tuple)):
+        outputs = outputs[0]
+    return outputs
+
+def person_boxes(output, frame_shape=None, confidence=PERSON_CONFIDENCE, iou=PERSON_NMS_IOU):
+    """Person boxes from a (1, A, 5 + classes) YOLOv5 output
+
+    Boxes are [x1, y1, x2, y2, score] as fractions of the frame. Model
+    coordinates are in the LetterboxPreprocessor input, so with frame_shape
+    they are mapped back through the padding and scale; without it they are
+    fractions of the letterboxed input.
+    """
+    predictions = output[0].float()
+    scores = predictions[:, 4] * predictions[:, 5]  # objectness * COCO class 0 (person)
+    keep = scores >= confidence
+    predictions, scores = predictions[keep], scores[keep]
+    if not len(scores):
+        return []
+    cx, cy, w, h = predictions[:, 0], predictions[:, 1], predictions[:, 2], predictions[:, 3]
+    boxes = torch.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], dim=1)
+    order = scores.argsort(descending=True)
+    selected = []
+    while len(order) and len(selected) < 50:
+        best = order[0]
+        selected.append(int(best))
+        rest = order[1:]
+        top_left = torch.maximum(boxes[best, :2], boxes[rest, :2])
+        bottom_right = torch.minimum(boxes[best, 2:], boxes[rest, 2:])
+        overlap = (bottom_right - top_left).clamp(min=0).prod(dim=1)
+        areas = (boxes[rest, 2:] - boxes[rest, :2]).prod(dim=1)
+        union = areas + (boxes[best, 2:] - boxes[best, :2]).prod() - overlap
+        order = rest[overlap / union.clamp(min=1e-6) < iou]
+    if frame_shape is not None:
+        (resized_h, resized_w), top, left = letterbox_geometry(*frame_shape[:2])
+        offset = torch.tensor([left, top, left, top], dtype=torch.float32)
+        scale = torch.tensor([resized_w, resized_h, resized_w, resized_h], dtype=torch.float32)
+    else:
+        offset = torch.zeros(4)
+        scale = torch.full((4,), float(DETECTOR_INPUT_SIZE))
+    result = []
+    for index in selected:
+        x1, y1, x2, y2 = ((boxes[index] - offset) / scale).clamp(0.0, 1.0).tolist()
+        if x2 > x1 and y2 > y1:
+            result.append([round(x1, 4), round(y1, 4), round(x2, 4), round(y2, 4), round(scores[index].item(), 3)])
+    return result
+
+def prediction_from_output(output, frame_shape=None):
+    """Turn a model output into the /predict response fields
+
+    A (1, C) output is a fall classifier. A (1, A, 5 + classes) output is
+    a YOLOv5 detector: it cannot tell a fall by itself, so it reports the
+    people it found under "persons" for the tracker to score.
+    """
+    output = primary_output(output)
+    if output.dim() == 3:
+        persons = person_boxes(output, frame_shape)
+        return {
+            "fall_detected": False,
+            "confidence": max((p[4] for p in persons), default=0.0),
+            "fall_confidence": 0.0,
+            "prediction": "normal",
+            "persons": persons
+        }
+    probs = torch.softmax(output, dim=1)[0]
+    pred = int(probs.argmax().item())
+    is_fall = pred == 1
+    return {
+        "fall_detected": is_fall,
+        "confidence": round(probs.max().item(), 3),
+        "fall_confidence": round(probs[1].item(), 3) if probs.numel() > 1 else 0.0,
+        "prediction": "fall" if is_fall else "normal"
+    }
+
+def inference_process_main(worker_id, shm_name, slot_bytes, requests, results, num_threads, max_batch_size):
+    """Entry point of an inference worker process
+
+    Frames arrive in shared memory slots; `requests` carries
+    (request_id, slot, shape) and `results` gets
+    (worker_id, request_id, prediction, error) back. Model status updates
+    are sent with request_id None as (worker_id, None, state, error).
+    """
+    from multiprocessing import shared_memory
+
+    setup_logging()
+    torch.set_num_threads(num_threads)
+    manager = ModelManager(warmup_batch_sizes=(1, max_batch_size), watch_interval=0)
+    manager.load()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    preprocessors = {}  # {model kind: preprocessor}, the kind can change on reload
+    results.put((worker_id, None, manager.state, manager.error))
+    next_check = time.monotonic() + MODEL_WATCH_INTERVAL
+    try:
+        while True:
+            if MODEL_WATCH_INTERVAL > 0 and time.monotonic() >= next_check:
+                next_check = time.monotonic() + MODEL_WATCH_INTERVAL
+                if manager.changed():
+                    manager.load()
+                    results.put((worker_id, None, manager.state, manager.error))
+            try:
+                item = requests.get(timeout=MODEL_WATCH_INTERVAL if MODEL_WATCH_INTERVAL > 0 else None)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < max_batch_size:
+                try:
+                    item = requests.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    requests.put(None)
+                    break
+                batch.append(item)
+            try:
+                model, kind = manager.model, manager.kind
+                if model is None:
+                    raise RuntimeError("Model is not ready")
+                frames = [np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=slot * slot_bytes)
+                          for _, slot, shape in batch]
+                if kind not in preprocessors:
+                    preprocessors[kind] = make_preprocessor(kind, max_batch_size)
+                inputs = preprocessors[kind](frames)
+                with torch.no_grad():
+                    outputs = primary_output(model(inputs))
+                for i, (request_id, _, shape) in enumerate(batch):
+                    results.put((worker_id, request_id, prediction_from_output(outputs[i:i + 1], shape), None))
+            except Exception as e:
+                for request_id, _, _ in batch:
+                    results.put((worker_id, request_id, None, str(e)))
+    finally:
+        shm.close()
+
+def check_preprocessing(batch_size=8, iterations=20, width=640, height=480, tolerance=0.05):
+    """Compare FramePreprocessor against frame_to_tensor for parity and speed"""
+    rng = np.random.default_rng(0)
+    noise = rng.integers(0, 256, (batch_size, height, width, 3), dtype=np.uint8)
+    frames = np.stack([cv2.GaussianBlur(frame, (7, 7), 0) for frame in noise])
+    preprocess = FramePreprocessor(batch_size)
+
+    reference = torch.stack([frame_to_tensor(frame) for frame in frames])
+    max_diff = (preprocess(frames) - reference).abs().max().item()
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        torch.stack([frame_to_tensor(frame) for frame in frames])
+    pil_ms = (time.perf_counter() - start) * 1000.0 / iterations
+    start = time.perf_counter()
+    for _ in range(iterations):
+        preprocess(frames)
+    fused_ms = (time.perf_counter() - start) * 1000.0 / iterations
+
+    return {
+        'batch_size': batch_size,
+        'frame_size': f"{width}x{height}",
+        'max_abs_diff': round(max_diff, 5),
+        'tolerance': tolerance,
+        'parity': max_diff <= tolerance,
+        'pil_ms_per_batch': round(pil_ms, 2),
+        'fused_ms_per_batch': round(fused_ms, 2),
+        'speedup': round(pil_ms / fused_ms, 2) if fused_ms else None
+    }
+
+def load_labeled_frames(frames_dir):
+    """Read <frames_dir>/<label>/*.jpg|png, returns ([frame], [label])"""
+    frames, labels = [], []
+    for label in sorted(os.listdir(frames_dir)):
+        label_dir = os.path.join(frames_dir, label)
+        if not os.path.isdir(label_dir):
+            continue
+        for name in sorted(os.listdir(label_dir)):
+            if not name.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp')):
+                continue
+            frame = cv2.imread(os.path.join(label_dir, name))
+            if frame is not None:
+                frames.append(frame)
+                labels.append(label)
+    return frames, labels
+
+def _box_iou(a, b):
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    overlap = width * height
+    return overlap / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - overlap)
+
+def _boxes_agree(boxes, reference, iou=0.5):
+    """Same number of person boxes and each reference box overlapped by one of them"""
+    return len(boxes) == len(reference) and all(
+        any(_box_iou(box, ref) >= iou for box in boxes) for ref in reference)
+
+def compare_runtimes(frames_dir, runtimes=MODEL_RUNTIMES, path=MODEL_PATH, batch_size=8):
+    """Run labeled frames through each runtime, returns accuracy and latency per runtime
+
+    Classifiers: labels are the sub-folder names and are compared with the
+    "prediction" field (fall / normal); agreement and max probability
+    difference are measured against the eager runtime. Detectors have no
+    fall label to score, so accuracy is None and agreement is the share of
+    frames whose person boxes match the eager ones. Exports go to a
+    temporary directory, never next to the served model.
+    """
+    frames, labels = load_labeled_frames(frames_dir)
+    if not frames:
+        raise ValueError(f"No labeled frames found under {frames_dir}")
+    kind = model_kind(_load_model(path)[0])
+    preprocess = make_preprocessor(kind, batch_size)
+    batches = [preprocess(frames[i:i + batch_size]).clone() for i in range(0, len(frames), batch_size)]
+    reports = []
+    reference = None
+    with tempfile.TemporaryDirectory() as export_dir:
+        export_path = os.path.join(export_dir, os.path.basename(path))
+        for runtime in runtimes:
+            try:
+                model, source = _load_model(path)
+                start = time.perf_counter()
+                prepared = prepare_runtime(model, runtime, export_path, kind)
+                with torch.no_grad():
+                    prepared(batches[0])  # warmup, and compilation for compile
+                prepare_seconds = time.perf_counter() - start
+                batch_ms, outputs = [], []
+                with torch.no_grad():
+                    for inputs in batches:
+                        start = time.perf_counter()
+                        output = primary_output(prepared(inputs))
+                        batch_ms.append((time.perf_counter() - start) * 1000.0)
+                        outputs.append(output.float())
+            except Exception as e:
+                reports.append({'runtime': runtime, 'error': str(e)})
+                continue
+            outputs = torch.cat(outputs)
+            report = {
+                'runtime': runtime,
+                'source': source,
+                'kind': kind,
+                'frames': len(frames),
+                'prepare_seconds': round(prepare_seconds, 3),
+                'ms_per_frame': round(sum(batch_ms) / len(frames), 3),
+                'p50_batch_ms': round(float(np.percentile(batch_ms, 50)), 3),
+                'p95_batch_ms': round(float(np.percentile(batch_ms, 95)), 3),
+                'fps': round(len(frames) * 1000.0 / sum(batch_ms), 1)
+            }
+            if kind == 'detector':
+                persons = [person_boxes(outputs[i:i + 1], frame.shape) for i, frame in enumerate(frames)]
+                report['accuracy'] = None
+                report['persons_per_frame'] = round(sum(len(p) for p in persons) / len(frames), 3)
+                if runtime == 'eager':
+                    reference = persons
+                elif reference is not None:
+                    report['agreement_with_eager'] = round(
+                        sum(_boxes_agree(p, r) for p, r in zip(persons, reference)) / len(frames), 4)
+            else:
+                probs = torch.softmax(outputs, dim=1)
+                predictions = ['fall' if p == 1 else 'normal' for p in probs.argmax(dim=1).tolist()]
+                report['accuracy'] = round(sum(p == l for p, l in zip(predictions, labels)) / len(frames), 4)
+                if runtime == 'eager':
+                    reference = (probs, predictions)
+                elif reference is not None:
+                    report['agreement_with_eager'] = round(
+                        sum(a == b for a, b in zip(predictions, reference[1])) / len(frames), 4)
+                    report['max_prob_diff_vs_eager'] = round((probs - reference[0]).abs().max().item(), 5)
+            reports.append(report)
+    return reports
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Fall detection model tools')
+    commands = parser.add_subparsers(dest='command', required=True)
+    check = commands.add_parser('check-preprocess', help='parity check and microbenchmark of FramePreprocessor against val_transforms')
+    check.add_argument('--batch-size', type=int, default=8)
+    check.add_argument('--iterations', type=int, default=20)
+    check.add_argument('--width', type=int, default=640)
+    check.add_argument('--height', type=int, default=480)
+    check.add_argument('--tolerance', type=float, default=0.05)
+    export = commands.add_parser('export', help='export the model as TorchScript so it loads without torch.hub')
+    export.add_argument('--model', default=MODEL_PATH)
+    export.add_argument('--output', default='fall_model.torchscript')
+    compare = commands.add_parser('compare', help='accuracy vs latency of each runtime over a folder of labeled frames')
+    compare.add_argument('frames_dir', help='folder with one sub-folder of frames per label (fall, normal)')
+    compare.add_argument('--runtimes', default=','.join(MODEL_RUNTIMES))
+    compare.add_argument('--model', default=MODEL_PATH)
+    compare.add_argument('--batch-size', type=int, default=8)
+    args = parser.parse_args()
+
+    if args.command == 'check-preprocess':
+        report = check_preprocessing(args.batch_size, args.iterations, args.width, args.height, args.tolerance)
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report['parity'] else 1)
+    elif args.command == 'export':
+        source, kind = export_torchscript(args.model, args.output)
+        print(f"✅ Exported {source} {kind} model to {args.output}, set MODEL_PATH={args.output}")
+    elif args.command == 'compare':
+        runtimes = [r.strip() for r in args.runtimes.split(',') if r.strip()]
+        if 'eager' in runtimes:
+            runtimes.remove('eager')
+            runtimes.insert(0, 'eager')  # reference for agreement
+        print(json.dumps(compare_runtimes(args.frames_dir, runtimes, args.model, args.batch_size), indent=2))
@@ -0,0 +1,541 @@
+# fall_tracking.py - Person tracking between detector frames and fall scoring from track geometry
+# Kept free of the API and the model so labeled clips can be replayed offline with the same code
+import os
+from collections import deque
+
+import cv2
+import numpy as np
+
+TRACK_DETECT_INTERVAL = float(os.environ.get('TRACK_DETECT_INTERVAL', '1.0'))  # seconds between detector frames while tracking
+TRACK_CONFIRM_INTERVAL = float(os.environ.get('TRACK_CONFIRM_INTERVAL', '0.25'))  # while a track looks like it is falling
+TRACK_MATCH_THRESHOLD = float(os.environ.get('TRACK_MATCH_THRESHOLD', '0.15'))
+TRACK_MAX_COAST_SECONDS = float(os.environ.get('TRACK_MAX_COAST_SECONDS', '3'))
+TRACK_MIN_HITS = int(os.environ.get('TRACK_MIN_HITS', '2'))
+TRACK_WINDOW_SECONDS = float(os.environ.get('TRACK_WINDOW_SECONDS', '2'))
+TRACK_MIN_AREA = float(os.environ.get('TRACK_MIN_AREA', '0.004'))  # foreground proposals, fraction of the frame
+FALL_SCORE_THRESHOLD = float(os.environ.get('FALL_SCORE_THRESHOLD', '0.6'))
+FALL_CONFIRM_SECONDS = float(os.environ.get('FALL_CONFIRM_SECONDS', '1'))  # lying down this long after a fall
+FALL_MODEL_WEIGHT = float(os.environ.get('FALL_MODEL_WEIGHT', '0.25'))  # share of a fall classifier's confidence
+UPRIGHT_ASPECT = 1.2  # box height / width of a standing person
+LYING_ASPECT = 0.8
+SUSPECT_DESCENT = 0.3  # box heights per second of downward flow that asks for an early detection
+FLOW_NOISE = 0.15  # flow corrections are trusted less than detections
+
+class ForegroundModel:
+    """Running-average backgrounds of downscaled, blurred grayscale frames
+
+    apply() returns the boolean motion mask against a fast background, or
+    None for a frame that only seeds the backgrounds (the first one and
+    after a resolution change). A moving person leaves a ghost in the fast
+    background, so person proposals use `presence`, the mask against a
+    background that adapts ten times slower; someone lying still stays in
+    it for a good while. When that person gets up and leaves, the slow
+    background still holds them; such ghosts are told apart by their outline,
+    which has edges in the background but not in the frame, and are absorbed
+    at once. The downscaled frame stays in `gray` for optical flow.
+    """
+
+    def __init__(self, width=160, pixel_threshold=25, learning_rate=0.05, presence_rate=0.005):
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.learning_rate = learning_rate
+        self.presence_rate = presence_rate
+        self.gray = None
+        self.presence = None
+        self._background = None
+        self._slow_background = None
+
+    def apply(self, frame):
+        h, w = frame.shape[:2]
+        small = cv2.resize(frame, (self.width, max(1, h * self.width // w)), interpolation=cv2.INTER_AREA)
+        self.gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        if self._background is None or self._background.shape != self.gray.shape:
+            self._background = self.gray.astype(np.float32)
+            self._slow_background = self._background.copy()
+            self.presence = None
+            return None
+        mask = cv2.absdiff(self.gray, cv2.convertScaleAbs(self._background)) > self.pixel_threshold
+        slow = cv2.convertScaleAbs(self._slow_background)
+        self.presence = self._drop_ghosts(cv2.absdiff(self.gray, slow) > self.pixel_threshold, slow)
+        cv2.accumulateWeighted(self.gray, self._background, self.learning_rate)
+        cv2.accumulateWeighted(self.gray, self._slow_background, self.presence_rate)
+        return mask
+
+    def _drop_ghosts(self, presence, slow):
+        count, labels = cv2.connectedComponents(presence.astype(np.uint8), connectivity=8)
+        if count <= 1:
+            return presence
+        # Inner outline of every blob, with its edge strength in the frame and in the background
+        outline = presence & ~cv2.erode(presence.astype(np.uint8), _CLOSE_KERNEL).astype(bool)
+        ids = labels[outline]
+        frame_edges = np.bincount(ids, weights=_edges(self.gray)[outline], minlength=count)
+        background_edges = np.bincount(ids, weights=_edges(slow)[outline], minlength=count)
+        ghosts = np.flatnonzero(frame_edges < 0.5 * background_edges)
+        ghosts = ghosts[ghosts > 0]
+        if not len(ghosts):
+            return presence
+        ghost = np.isin(labels, ghosts)
+        self._slow_background[ghost] = self.gray[ghost]
+        return presence & ~ghost
+
+def _edges(gray):
+    return cv2.magnitude(cv2.Sobel(gray, cv2.CV_32F, 1, 0), cv2.Sobel(gray, cv2.CV_32F, 0, 1))
+
+_CLOSE_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+
+def boxes_from_mask(mask, min_area=TRACK_MIN_AREA):
+    """Person proposals from a foreground mask as [x1, y1, x2, y2, score] fractions of the frame
+
+    Used when the model only classifies frames and has no boxes of its own.
+    The score is how much of the box the blob fills.
+    """
+    if mask is None:
+        return []
+    h, w = mask.shape
+    blobs = cv2.morphologyEx(mask.astype(np.uint8) * 255, cv2.MORPH_CLOSE, _CLOSE_KERNEL)
+    blobs = cv2.dilate(blobs, _CLOSE_KERNEL)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(blobs, connectivity=8)
+    boxes = []
+    for x, y, bw, bh, area in stats[1:]:
+        if area < min_area * h * w:
+            continue
+        fill = np.count_nonzero(mask[y:y + bh, x:x + bw]) / float(bw * bh)
+        boxes.append([x / w, y / h, (x + bw) / w, (y + bh) / h, round(min(1.0, fill), 3)])
+    return boxes
+
+def match_score(a, b):
+    """IoU, or half the overlap over the smaller box when that is higher
+
+    Someone who falls between detector frames keeps their footprint but
+    turns from a tall box into a wide one, an IoU of about 0.2; containment
+    keeps them on the same track.
+    """
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    overlap = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    union = area_a + area_b - overlap
+    if union <= 0:
+        return 0.0
+    return max(overlap / union, 0.5 * overlap / max(min(area_a, area_b), 1e-6))
+
+class KalmanBox:
+    """Constant-velocity Kalman filter over a box center and size (cx, cy, w, h) in pixels"""
+    _H = np.hstack([np.eye(4), np.zeros((4, 4))])
+
+    def __init__(self, box, t):
+        x1, y1, x2, y2 = box[:4]
+        w, h = x2 - x1, y2 - y1
+        self.x = np.array([x1 + w / 2, y1 + h / 2, w, h, 0, 0, 0, 0], dtype=np.float64)
+        size = max(w, h, 1.0)
+        self.P = np.diag([0.1, 0.1, 0.1, 0.1, 1, 1, 1, 1]) * size ** 2
+        self.t = t
+
+    def predict(self, t):
+        dt = t - self.t
+        if dt <= 0:
+            return
+        self.t = t
+        F = np.eye(8)
+        F[:4, 4:] = np.eye(4) * dt
+        # Process noise grows with the box, people move about their own size per second
+        q = (0.5 * max(self.x[3], 1.0)) ** 2 * dt
+        Q = np.diag([0.05 * q] * 4 + [q] * 4)
+        self.x = F @ self.x
+        self.P = F @ self.P @ F.T + Q
+        self.x[2] = max(self.x[2], 1.0)
+        self.x[3] = max(self.x[3], 1.0)
+
+    def update(self, box, noise=0.05):
+        x1, y1, x2, y2 = box[:4]
+        z = np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1])
+        R = np.eye(4) * (noise * max(self.x[3], 1.0)) ** 2
+        S = self._H @ self.P @ self._H.T + R
+        K = self.P @ self._H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ (z - self._H @ self.x)
+        self.P = (np.eye(8) - K @ self._H) @ self.P
+
+    @property
+    def box(self):
+        cx, cy, w, h = self.x[:4]
+        return [cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2]
+
+class Track:
+    """One person followed across frames, with the fall state machine
+
+    tracking -> falling when the geometry score crosses FALL_SCORE_THRESHOLD,
+    falling -> fallen once the box stays lying for FALL_CONFIRM_SECONDS
+    (back to tracking if it does not), fallen -> tracking when the person is
+    upright again.
+    """
+
+    def __init__(self, track_id, box, t):
+        self.track_id = track_id
+        self.kalman = KalmanBox(box, t)
+        self.first_seen = t
+        self.last_hit = t
+        self.hits = 1
+        self.history = deque()  # (t, cx, cy, w, h) after every detection and flow update
+        self.state = 'tracking'
+        self.score = 0.0
+        self.lying = 0.0
+        self.fall_started = None
+        self.fallen_at = None
+        self.flow_descent = 0.0  # box heights per second, from the last flow update
+        self._record(t)
+
+    def _record(self, t):
+        self.history.append((t, *self.kalman.x[:4]))
+        while self.history and self.history[0][0] < t - 2 * TRACK_WINDOW_SECONDS:
+            self.history.popleft()
+
+    def hit(self, box, t):
+        self.kalman.update(box)
+        self.last_hit = t
+        self.hits += 1
+        self._record(t)
+
+    def flow(self, box, t, descent):
+        self.kalman.update(box, FLOW_NOISE)
+        self.flow_descent = descent
+        self._record(t)
+
+    @property
+    def suspicious(self):
+        return self.state == 'falling' or self.flow_descent >= SUSPECT_DESCENT
+
+    def geometry(self, t):
+        """(score, lying) from the box over the sliding window, both in [0, 1]
+
+        lying: the box is wider than tall. collapse: it was upright within
+        the window and its aspect has since dropped. descent: its top edge
+        came down by a good part of the standing height.
+        """
+        window = [entry for entry in self.history if entry[0] >= t - TRACK_WINDOW_SECONDS]
+        cx, cy, w, h = self.kalman.x[:4]
+        aspect = h / max(w, 1.0)
+        lying = float(np.clip((UPRIGHT_ASPECT - aspect) / (UPRIGHT_ASPECT - LYING_ASPECT), 0.0, 1.0))
+        if len(window) < 2:
+            return 0.0, lying
+        upright = max(eh / max(ew, 1.0) for _, _, _, ew, eh in window)
+        collapse = 0.0
+        if upright >= UPRIGHT_ASPECT:
+            collapse = float(np.clip((upright - aspect) / upright / 0.5, 0.0, 1.0))
+        standing_height = max(eh for _, _, _, _, eh in window)
+        highest_top = min(ecy - eh / 2 for _, _, ecy, _, eh in window)
+        descent = float(np.clip(((cy - h / 2) - highest_top) / standing_height / 0.5, 0.0, 1.0))
+        return 0.3 * lying + 0.35 * collapse + 0.35 * descent, lying
+
+    def step(self, t, model_confidence=None):
+        """Advance the fall state machine, returns True when a fall is confirmed"""
+        score, self.lying = self.geometry(t)
+        if model_confidence is not None:
+            score = (1 - FALL_MODEL_WEIGHT) * score + FALL_MODEL_WEIGHT * model_confidence
+        self.score = score
+        if self.state == 'tracking':
+            if self.hits >= TRACK_MIN_HITS and score >= FALL_SCORE_THRESHOLD:
+                self.state = 'falling'
+                self.fall_started = t
+        elif self.state == 'falling':
+            if self.lying < 0.5:
+                self.state = 'tracking'
+                self.fall_started = None
+            elif t - self.fall_started >= FALL_CONFIRM_SECONDS:
+                self.state = 'fallen'
+                self.fallen_at = t
+                return True
+        elif self.state == 'fallen' and self.lying == 0.0:
+            self.state = 'tracking'
+            self.fall_started = self.fallen_at = None
+        return False
+
+    def state_dict(self, t, frame_size):
+        width, height = frame_size
+        x1, y1, x2, y2 = self.kalman.box
+        vx, vy = self.kalman.x[4:6]
+        return {
+            'track_id': self.track_id,
+            'state': self.state,
+            'score': round(self.score, 3),
+            'box': [round(min(max(x1 / width, 0.0), 1.0), 4), round(min(max(y1 / height, 0.0), 1.0), 4),
+                    round(min(max(x2 / width, 0.0), 1.0), 4), round(min(max(y2 / height, 0.0), 1.0), 4)],
+            'aspect': round((y2 - y1) / max(x2 - x1, 1.0), 3),
+            'velocity': [round(vx / height, 3), round(vy / height, 3)],  # frame heights per second
+            'hits': self.hits,
+            'age_seconds': round(t - self.first_seen, 2),
+            'down_seconds': round(t - self.fall_started, 2) if self.fall_started is not None else None
+        }
+
+class FallTracker:
+    """Per-camera person tracks between detector frames, with a fall state per track
+
+    update() takes every monitored frame. Detector frames bring person boxes
+    (from the model, or foreground proposals when the model only classifies
+    frames) that are matched to the tracks by overlap. In between, tracks are
+    carried by their Kalman prediction, corrected with sparse optical flow
+    on the downscaled frame, so the detector only has to run every
+    TRACK_DETECT_INTERVAL, or every TRACK_CONFIRM_INTERVAL while someone
+    looks like they are falling.
+    """
+
+    def __init__(self):
+        self.tracks = []
+        self.frame_size = None  # (width, height)
+        self.last_detection = None
+        self.frames = 0
+        self.detections = 0
+        self.falls = 0
+        self._next_id = 1
+        self._prev_gray = None
+        self._model_confidence = None  # (t, fall_confidence) of the last classifier result
+
+    def needs_detection(self, frame_time):
+        if self.last_detection is None or not self.tracks:
+            return True
+        interval = TRACK_CONFIRM_INTERVAL if any(t.suspicious for t in self.tracks) else TRACK_DETECT_INTERVAL
+        return frame_time - self.last_detection >= interval
+
+    def update(self, frame_time, frame_shape, gray=None, detections=None, model_confidence=None):
+        """Advance all tracks to frame_time, returns the tracks whose fall was confirmed on this frame
+
+        detections are [x1, y1, x2, y2, score] fractions of the frame, None
+        on frames the detector did not see. gray is the downscaled grayscale
+        frame used for optical flow.
+        """
+        self.frames += 1
+        height, width = frame_shape[:2]
+        self.frame_size = (width, height)
+        if model_confidence is not None:
+            self._model_confidence = (frame_time, model_confidence)
+        # Flow is measured from where each track was on the previous frame
+        previous = [(track, track.kalman.box, track.kalman.t) for track in self.tracks]
+        shifts = self._flow(gray, [box for _, box, _ in previous]) if gray is not None else {}
+        for i, (track, box, t) in enumerate(previous):
+            track.kalman.predict(frame_time)
+            if i in shifts:
+                dx, dy = shifts[i]
+                track.flow([box[0] + dx, box[1] + dy, box[2] + dx, box[3] + dy], frame_time,
+                           dy / max(frame_time - t, 1e-3) / max(box[3] - box[1], 1.0))
+        if detections is not None:
+            self.detections += 1
+            self.last_detection = frame_time
+            self._match([[d[0] * width, d[1] * height, d[2] * width, d[3] * height] for d in detections], frame_time)
+        self.tracks = [t for t in self.tracks if frame_time - t.last_hit <= TRACK_MAX_COAST_SECONDS]
+        confidence = None
+        if self._model_confidence is not None and frame_time - self._model_confidence[0] <= TRACK_WINDOW_SECONDS:
+            confidence = self._model_confidence[1]
+        fallen = [t for t in self.tracks if t.step(frame_time, confidence)]
+        self.falls += len(fallen)
+        return fallen
+
+    def _flow(self, gray, boxes):
+        """{index: (dx, dy)} median sparse optical flow inside each box since the previous frame, in pixels"""
+        prev, self._prev_gray = self._prev_gray, gray
+        if prev is None or prev.shape != gray.shape or not boxes:
+            return {}
+        scale = gray.shape[1] / float(self.frame_size[0])
+        gh, gw = gray.shape
+        shifts = {}
+        for i, box in enumerate(boxes):
+            x1, y1 = max(0, int(box[0] * scale)), max(0, int(box[1] * scale))
+            x2, y2 = min(gw, int(box[2] * scale) + 1), min(gh, int(box[3] * scale) + 1)
+            if x2 - x1 < 4 or y2 - y1 < 4:
+                continue
+            points = cv2.goodFeaturesToTrack(prev[y1:y2, x1:x2], maxCorners=20, qualityLevel=0.01, minDistance=2)
+            if points is None:
+                continue
+            points = (points + np.array([x1, y1], dtype=np.float32)).astype(np.float32)
+            moved, status, _ = cv2.calcOpticalFlowPyrLK(prev, gray, points, None, winSize=(9, 9), maxLevel=2)
+            ok = status.ravel() == 1
+            if np.count_nonzero(ok) < 3:
+                continue
+            dx, dy = np.median((moved[ok] - points[ok]).reshape(-1, 2), axis=0) / scale
+            shifts[i] = (float(dx), float(dy))
+        return shifts
+
+    def _match(self, boxes, t):
+        """Greedy matching of detector boxes to predicted tracks, best match_score first"""
+        pairs = sorted(((match_score(track.kalman.box, box), i, j) for i, track in enumerate(self.tracks)
+                        for j, box in enumerate(boxes)), reverse=True)
+        matched_tracks, matched_boxes = set(), set()
+        for overlap, i, j in pairs:
+            if overlap < TRACK_MATCH_THRESHOLD:
+                break
+            if i in matched_tracks or j in matched_boxes:
+                continue
+            matched_tracks.add(i)
+            matched_boxes.add(j)
+            self.tracks[i].hit(boxes[j], t)
+        for j, box in enumerate(boxes):
+            if j not in matched_boxes:
+                self.tracks.append(Track(self._next_id, box, t))
+                self._next_id += 1
+
+    def states(self, t=None):
+        if self.frame_size is None:
+            return []
+        t = t if t is not None else max((track.kalman.t for track in self.tracks), default=0.0)
+        return [track.state_dict(t, self.frame_size) for track in self.tracks if track.hits >= TRACK_MIN_HITS]
+
+    def stats(self):
+        return {
+            'tracks': len(self.tracks),
+            'frames': self.frames,
+            'detector_frames': self.detections,
+            'detector_ratio': round(self.detections / self.frames, 3) if self.frames else 0.0,
+            'falls': self.falls,
+            'states': self.states()
+        }
+
+# ========== Labeled clip replay ==========
+CLIP_EXTENSIONS = ('.avi', '.mp4', '.mkv', '.mov')
+
+def load_labeled_clips(clips_dir):
+    """<clips_dir>/<label>/<clip> with an optional <clip>.json {"fall_start": s, "fall_end": s}"""
+    clips = []
+    for label in sorted(os.listdir(clips_dir)):
+        label_dir = os.path.join(clips_dir, label)
+        if not os.path.isdir(label_dir):
+            continue
+        for name in sorted(os.listdir(label_dir)):
+            if not name.lower().endswith(CLIP_EXTENSIONS):
+                continue
+            path = os.path.join(label_dir, name)
+            window = {}
+            sidecar = os.path.splitext(path)[0] + '.json'
+            if os.path.isfile(sidecar):
+                import json
+                with open(sidecar) as f:
+                    window = json.load(f)
+            clips.append({'path': path, 'label': label, 'fall_start': window.get('fall_start'),
+                          'fall_end': window.get('fall_end')})
+    return clips
+
+def replay_clip(path, predict=None, fps=10.0, sample_interval=0.5, baseline_threshold=0.7):
+    """Replay a clip through the frame-level rule and the tracker, in clip time
+
+    Frames are paced to `fps` like the monitor. predict(frame) is the
+    detector (a prediction dict), None runs the tracker on foreground
+    proposals only and skips the frame-level rule, which needs a model.
+    """
+    video = cv2.VideoCapture(path)
+    clip_fps = video.get(cv2.CAP_PROP_FPS) or 25.0
+    foreground = ForegroundModel()
+    tracker = FallTracker()
+    baseline = {'alert_at': None, 'model_calls': 0} if predict is not None else None
+    tracked = {'alert_at': None, 'model_calls': 0, 'detector_frames': 0, 'track': None}
+    last_baseline = last_tracked = -1e9
+    index, next_time, frame_time = 0, 0.0, 0.0
+    try:
+        while True:
+            ret, frame = video.read()
+            if not ret:
+                break
+            frame_time = index / clip_fps
+            index += 1
+            if frame_time + 1e-6 < next_time:
+                continue
+            next_time += 1.0 / fps
+            foreground.apply(frame)
+            if baseline is not None and frame_time - last_baseline >= sample_interval:
+                last_baseline = frame_time
+                baseline['model_calls'] += 1
+                result = predict(frame)
+                if (baseline['alert_at'] is None and result.get('fall_detected')
+                        and result.get('fall_confidence', 0) > baseline_threshold):
+                    baseline['alert_at'] = round(frame_time, 2)
+            detections = confidence = None
+            if frame_time - last_tracked >= sample_interval and tracker.needs_detection(frame_time):
+                last_tracked = frame_time
+                tracked['detector_frames'] += 1
+                result = {}
+                if predict is not None:
+                    tracked['model_calls'] += 1
+                    result = predict(frame)
+                detections = result.get('persons')
+                if detections is None:
+                    detections = boxes_from_mask(foreground.presence)
+                    confidence = result.get('fall_confidence')
+            fallen = tracker.update(frame_time, frame.shape, foreground.gray, detections, confidence)
+            if fallen and tracked['alert_at'] is None:
+                tracked['alert_at'] = round(frame_time, 2)
+                tracked['track'] = fallen[0].state_dict(frame_time, tracker.frame_size)
+    finally:
+        video.release()
+    return {'frames': index, 'duration': round(frame_time, 2), 'baseline': baseline, 'tracked': tracked}
+
+def _summary(results, pipeline, duration):
+    runs = [(r['label'] == 'fall', r, r[pipeline]) for r in results if r[pipeline] is not None]
+    if not runs:
+        return None
+    tp = sum(1 for positive, _, run in runs if positive and run['alert_at'] is not None)
+    fn = sum(1 for positive, _, run in runs if positive and run['alert_at'] is None)
+    fp = sum(1 for positive, _, run in runs
+             if (not positive and run['alert_at'] is not None) or run.get('false_alarm_at') is not None)
+    delays = [run['alert_at'] - clip['fall_start'] for positive, clip, run in runs
+              if positive and run['alert_at'] is not None and clip['fall_start'] is not None]
+    calls = sum(run['model_calls'] for _, _, run in runs)
+    return {
+        'true_positives': tp,
+        'false_positives': fp,
+        'missed': fn,
+        'precision': round(tp / (tp + fp), 3) if tp + fp else None,
+        'recall': round(tp / (tp + fn), 3) if tp + fn else None,
+        'mean_alert_delay_seconds': round(sum(delays) / len(delays), 2) if delays else None,
+        'model_calls': calls,
+        'model_calls_per_minute': round(calls * 60.0 / duration, 1) if duration else None
+    }
+
+def evaluate(clips_dir, predict=None, fps=10.0, sample_interval=0.5, baseline_threshold=0.7):
+    """Replay every labeled clip, returns per-clip results and precision/recall/model calls per pipeline
+
+    Clips labeled 'fall' are positives. With a fall_start in the sidecar an
+    alert before it is a false alarm and the fall counts as missed.
+    """
+    clips = load_labeled_clips(clips_dir)
+    if not clips:
+        raise ValueError(f"No labeled clips found under {clips_dir}")
+    results = []
+    for clip in clips:
+        result = dict(clip, **replay_clip(clip['path'], predict, fps, sample_interval, baseline_threshold))
+        for pipeline in ('baseline', 'tracked'):
+            run = result[pipeline]
+            if (run is not None and run['alert_at'] is not None and clip['fall_start'] is not None
+                    and run['alert_at'] < clip['fall_start']):
+                run['false_alarm_at'], run['alert_at'] = run['alert_at'], None
+        results.append(result)
+    duration = sum(r['duration'] for r in results)
+    return {
+        'clips': results,
+        'summary': {pipeline: _summary(results, pipeline, duration) for pipeline in ('baseline', 'tracked')}
+    }
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Fall tracking tools')
+    commands = parser.add_subparsers(dest='command', required=True)
+    replay = commands.add_parser('evaluate', help='replay labeled clips through the frame-level rule and the tracker')
+    replay.add_argument('clips_dir', help='folder with one sub-folder of clips per label (fall, normal)')
+    replay.add_argument('--model', help='model to run on detector frames, default foreground proposals only')
+    replay.add_argument('--fps', type=float, default=10.0, help='frames per second examined, like MONITOR_FPS')
+    replay.add_argument('--sample-interval', type=float, default=0.5,
+                        help='seconds between detector frames of the frame-level rule, like SAMPLING_ACTIVE_INTERVAL')
+    replay.add_argument('--baseline-threshold', type=float, default=0.7)
+    args = parser.parse_args()
+
+    if args.command == 'evaluate':
+        predict = None
+        if args.model:
+            import torch
+            from fall_model import _load_model, make_preprocessor, model_kind, prediction_from_output
+            model, _ = _load_model(args.model)
+            preprocess = make_preprocessor(model_kind(model), 1)
+
+            def predict(frame):
+                with torch.no_grad():
+                    return prediction_from_output(model(preprocess(frame)), frame.shape)
+        report = evaluate(args.clips_dir, predict, args.fps, args.sample_interval, args.baseline_threshold)
+        print(json.dumps(report, indent=2))
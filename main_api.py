@@ -1,13 +1,12 @@
 # main_api.py - All-in-one FastAPI for AI, CCTV, Notification
 from fastapi import FastAPI, File, UploadFile, WebSocket, HTTPException, Request, BackgroundTasks
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import StreamingResponse, JSONResponse, RedirectResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional, Union
 import torch
 from PIL import Image
 import io
-from torchvision import models, transforms
 import cv2
 import asyncio
 import threading
@@ -15,12 +14,27 @@ import time
 import numpy as np
 import uuid
 import json
+import re
+import sqlite3
 import os
 import subprocess
+import shutil
+import hashlib
+import bisect
+import sys
+from email.utils import formatdate, parsedate_to_datetime
 from datetime import datetime
 import base64
 import requests
+from requests.adapters import HTTPAdapter
 import socket
+import urllib.parse
+import queue
+import concurrent.futures
+from collections import OrderedDict, deque
+from multiprocessing import shared_memory
+import multiprocessing
+import atexit
 
 try:
     from dotenv import load_dotenv
@@ -28,6 +42,21 @@ try:
 except ImportError:
     pass
 
+# Imported after .env is loaded, these modules read their settings on import
+from fall_model import (ModelManager, make_preprocessor, prediction_from_output,
+                        inference_process_main, primary_output)
+from fall_tracking import ForegroundModel, FallTracker, boxes_from_mask
+from structured_log import LOG_FORMAT, LOG_LEVEL, log, setup_logging
+
+# ========== Main ===========
+if __name__ == "__main__":
+    # Serve through uvicorn's entry point. Inference worker processes are
+    # spawned, and spawn re-runs a __main__ script in every child: this file
+    # would open the stores and start every background thread again in each
+    # worker. uvicorn's __main__ is skipped, so workers only import fall_model.
+    os.execv(sys.executable, [sys.executable, '-m', 'uvicorn', 'main_api:app', '--host', '0.0.0.0', '--port', '8000',
+                              '--app-dir', os.path.dirname(os.path.abspath(__file__))])
+
 app = FastAPI()
 
 app.add_middleware(
@@ -38,81 +67,1071 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ========== Logging & Metrics ==========
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+setup_logging()
+
+def camera_label(camera):
+    """Metrics/log label of a (user_id, camera_id) key"""
+    return f'{camera[0]}/{camera[1]}' if camera else ''
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+class StageTimer:
+    """Context manager that observes the time spent in its block"""
+    __slots__ = ('registry', 'stage', 'camera', 'start')
+
+    def __init__(self, registry, stage, camera):
+        self.registry = registry
+        self.stage = stage
+        self.camera = camera
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.stage, time.perf_counter() - self.start, self.camera)
+        return False
+
+class MetricsRegistry:
+    """Per-stage latency histograms and counters labeled by camera, rendered for Prometheus
+
+    observe() is a bisect plus three additions under a lock, so it can sit
+    on every frame. Stages: capture_read, motion, decode, preprocess,
+    inference, detect, jpeg_encode, record_write, clip_write, alert_send.
+    """
+
+    def __init__(self, buckets=STAGE_BUCKETS, enabled=METRICS_ENABLED):
+        self.buckets = buckets
+        self.enabled = enabled
+        self._histograms = {}  # {(stage, camera): Histogram}
+        self._counters = {}  # {(name, camera): value}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, camera=''):
+        if not self.enabled:
+            return
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get((stage, camera))
+            if histogram is None:
+                histogram = self._histograms[(stage, camera)] = Histogram(len(self.buckets) + 1)
+            histogram.counts[index] += 1
+            histogram.sum += seconds
+            histogram.count += 1
+
+    def time(self, stage, camera=''):
+        return StageTimer(self, stage, camera)
+
+    def inc(self, name, camera='', amount=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[(name, camera)] = self._counters.get((name, camera), 0) + amount
+
+    def forget(self, camera):
+        """Drop the series of a camera that was removed"""
+        with self._lock:
+            for series in (self._histograms, self._counters):
+                for key in [k for k in series if k[1] == camera]:
+                    del series[key]
+
+    def render(self):
+        with self._lock:
+            histograms = [(key, list(h.counts), h.sum, h.count) for key, h in sorted(self._histograms.items())]
+            counters = sorted(self._counters.items())
+        lines = ['# HELP dooyoo_stage_seconds Time spent in each video pipeline stage',
+                 '# TYPE dooyoo_stage_seconds histogram']
+        for (stage, camera), counts, total, count in histograms:
+            labels = f'stage="{stage}",camera="{camera}"'
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'dooyoo_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'dooyoo_stage_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'dooyoo_stage_seconds_sum{{{labels}}} {total:.6f}')
+            lines.append(f'dooyoo_stage_seconds_count{{{labels}}} {count}')
+        names = sorted({name for (name, _), _ in counters})
+        for name in names:
+            lines.append(f'# TYPE dooyoo_{name}_total counter')
+            lines += [f'dooyoo_{name}_total{{camera="{camera}"}} {value}'
+                      for (n, camera), value in counters if n == name]
+        return lines
+
+metrics = MetricsRegistry()
+
 # ========== AI Model Section ==========
-try:
-    # Try to load custom YOLOv5 model first
-    if os.path.exists('yolov5m.pt'):
-        model = torch.hub.load('ultralytics/yolov5', 'custom', path='yolov5m.pt', force_reload=False)
-        print("✅ Custom YOLOv5 model loaded successfully")
-    else:
-        # Load pre-trained YOLOv5m from hub
-        model = torch.hub.load('ultralytics/yolov5', 'yolov5m', pretrained=True)
-        print("✅ Pre-trained YOLOv5m model loaded successfully")
-    
-    model.eval()
-except Exception as e:
-    print(f"❌ Cannot load YOLOv5 model: {e}")
-    print("⚠️ Running without AI model - fall detection disabled")
-    model = None
-
-val_transforms = transforms.Compose([
-    transforms.Resize(256),
-    transforms.CenterCrop(224),
-    transforms.ToTensor(),
-    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-])
-
-def transform_image(image):
-    return val_transforms(image)
+# Loaded and warmed up in the background so the server binds right away, see /status.
+# With DETECTOR_BACKEND=process the model only lives in the inference worker processes
+MODEL_WARMUP_BATCH_SIZES = [int(s) for s in os.environ.get('MODEL_WARMUP_BATCH_SIZES', '1,8').split(',') if s.strip()]
+model_manager = ModelManager(warmup_batch_sizes=MODEL_WARMUP_BATCH_SIZES)
+if os.environ.get('DETECTOR_BACKEND', 'local') != 'process':
+    model_manager.start()
+
+# ========== Inference Scheduler ==========
+INFER_MAX_BATCH_SIZE = int(os.environ.get('INFER_MAX_BATCH_SIZE', '8'))
+INFER_MAX_WAIT_MS = float(os.environ.get('INFER_MAX_WAIT_MS', '10'))
+
+class InferenceScheduler:
+    """Collect frames from all camera threads and /predict calls into micro-batches
+
+    Frames are preprocessed together on the scheduler thread straight into a
+    reusable input tensor, so callers hand over raw BGR frames.
+    """
+
+    def __init__(self, max_batch_size=INFER_MAX_BATCH_SIZE, max_wait_ms=INFER_MAX_WAIT_MS):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._pending = deque()  # [(frame, future)]
+        self._preprocessors = {}  # {model kind: preprocessor}, the kind can change on reload
+        self._cond = threading.Condition()
+        self.batch_histogram = {}  # {batch_size: count}
+        self.queue_depth_histogram = {}  # {queue_depth_at_dispatch: count}
+        self.total_requests = 0
+        self.total_batches = 0
+        self.max_queue_depth = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, frame):
+        """Queue one uint8 BGR frame, returns a Future resolving to its (1, C) output"""
+        future = concurrent.futures.Future()
+        with self._cond:
+            self._pending.append((frame, future))
+            self.total_requests += 1
+            self.max_queue_depth = max(self.max_queue_depth, len(self._pending))
+            self._cond.notify()
+        return future
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            # Wait up to max_wait for more frames to fill the batch
+            deadline = time.monotonic() + self.max_wait
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            depth = len(self._pending)
+            self.queue_depth_histogram[depth] = self.queue_depth_histogram.get(depth, 0) + 1
+            size = min(depth, self.max_batch_size)
+            return [self._pending.popleft() for _ in range(size)]
+
+    def _run(self):
+        while True:
+            batch = [(frame, f) for frame, f in self._next_batch() if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            self.total_batches += 1
+            self.batch_histogram[len(batch)] = self.batch_histogram.get(len(batch), 0) + 1
+            try:
+                model, kind = model_manager.model, model_manager.kind
+                if model is None:
+                    raise RuntimeError("Model is not ready")
+                if kind not in self._preprocessors:
+                    self._preprocessors[kind] = make_preprocessor(kind, self.max_batch_size)
+                with metrics.time('preprocess'):
+                    inputs = self._preprocessors[kind]([frame for frame, _ in batch])
+                with metrics.time('inference'), torch.no_grad():
+                    outputs = primary_output(model(inputs))
+                for i, (_, future) in enumerate(batch):
+                    future.set_result(outputs[i:i + 1])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+    def stats(self):
+        with self._cond:
+            queue_depth = len(self._pending)
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'queue_depth': queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'total_requests': self.total_requests,
+            'total_batches': self.total_batches,
+            'batch_size_histogram': dict(sorted(self.batch_histogram.items())),
+            'queue_depth_histogram': dict(sorted(self.queue_depth_histogram.items())),
+        }
+
+inference_scheduler = InferenceScheduler()
+
+# ========== Detector Backends ==========
+DETECTOR_BACKEND = os.environ.get('DETECTOR_BACKEND', 'local')  # local | remote | process
+AI_API_URL = os.environ.get('AI_API_URL', 'http://localhost:8000')
+REMOTE_DETECTOR_TIMEOUT = float(os.environ.get('REMOTE_DETECTOR_TIMEOUT', '5'))
+
+class Detector:
+    """Base class for fall detectors, tracks per-call latency"""
+    name = 'base'
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+        self._lock = threading.Lock()
+
+    def detect(self, frame, camera=None):
+        """Run fall detection on a BGR frame, returns the /predict response dict
+
+        camera is the (user_id, camera_id) the frame came from, if any.
+        """
+        start = time.perf_counter()
+        try:
+            return self._detect(frame, camera)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+            metrics.observe('detect', elapsed_ms / 1000.0, camera_label(camera))
+            with self._lock:
+                self.calls += 1
+                self.total_ms += elapsed_ms
+                self.last_ms = elapsed_ms
+                self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def ready(self):
+        return True
+
+    def _detect(self, frame, camera):
+        raise NotImplementedError
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': self.name,
+                'calls': self.calls,
+                'errors': self.errors,
+                'avg_ms': round(self.total_ms / self.calls, 2) if self.calls else 0.0,
+                'last_ms': round(self.last_ms, 2),
+                'max_ms': round(self.max_ms, 2)
+            }
+
+class LocalDetector(Detector):
+    """Run the model in-process on the raw frame through the inference scheduler"""
+    name = 'local'
+
+    def ready(self):
+        return model_manager.model is not None
+
+    def _detect(self, frame, camera):
+        if model_manager.model is None:
+            raise RuntimeError("Model is not ready")
+        output = inference_scheduler.submit(frame).result()
+        return prediction_from_output(output, frame.shape)
+
+class RemoteDetector(Detector):
+    """POST JPEG frames to {AI_API_URL}/predict over a pooled HTTP session"""
+    name = 'remote'
+
+    def __init__(self, base_url=AI_API_URL, timeout=REMOTE_DETECTOR_TIMEOUT):
+        super().__init__()
+        self.url = f"{base_url.rstrip('/')}/predict"
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _detect(self, frame, camera):
+        _, buffer = cv2.imencode('.jpg', frame)
+        files = {'file': ('frame.jpg', buffer.tobytes(), 'image/jpeg')}
+        response = self.session.post(self.url, files=files, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+# ========== Inference Worker Processes ==========
+INFERENCE_PROCESSES = int(os.environ.get('INFERENCE_PROCESSES', '2'))
+INFERENCE_PROCESS_THREADS = int(os.environ.get('INFERENCE_PROCESS_THREADS', '0'))  # 0 = cpu_count / processes
+INFERENCE_PROCESS_SLOTS = int(os.environ.get('INFERENCE_PROCESS_SLOTS', '4'))
+INFERENCE_MAX_FRAME_BYTES = int(os.environ.get('INFERENCE_MAX_FRAME_BYTES', str(1920 * 1080 * 3)))
+INFERENCE_CAMERA_PINS = os.environ.get('INFERENCE_CAMERA_PINS', '')  # JSON {"<user_id>/<camera_id>": worker_id}
+
+class InferenceProcess:
+    """Parent-side handle of one worker process and its shared-memory frame slots"""
+
+    def __init__(self, worker_id, slots, slot_bytes):
+        self.worker_id = worker_id
+        self.slot_bytes = slot_bytes
+        self.slots = slots
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self.free_slots = queue.Queue()
+        for slot in range(slots):
+            self.free_slots.put(slot)
+        self.process = None
+        self.requests = None
+        self.ready = False
+        self.model_state = 'idle'
+        self.model_error = None
+        self.restarts = 0
+        self.completed = 0
+
+    def slot_view(self, slot, shape):
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+
+class ProcessInferencePool:
+    """Run preprocessing and inference in N worker processes, each with its own model
+
+    Frames are copied into per-worker shared-memory slots instead of being
+    pickled. Cameras stick to one worker (pinned via INFERENCE_CAMERA_PINS or
+    balanced by camera count) and are rebalanced when a worker dies.
+    """
+
+    def __init__(self, processes=INFERENCE_PROCESSES, threads=INFERENCE_PROCESS_THREADS,
+                 slots=INFERENCE_PROCESS_SLOTS, slot_bytes=INFERENCE_MAX_FRAME_BYTES, pins=INFERENCE_CAMERA_PINS):
+        self._ctx = multiprocessing.get_context('spawn')
+        self.threads = threads or max(1, (os.cpu_count() or 1) // max(1, processes))
+        self.pins = {}  # {(user_id, camera_id): worker_id}
+        for key, worker_id in (json.loads(pins) if pins else {}).items():
+            user_id, camera_id = key.rsplit('/', 1)
+            self.pins[(user_id, camera_id)] = worker_id
+        self.assignments = {}  # {(user_id, camera_id): worker_id}
+        self._pending = {}  # {request_id: (worker_id, slot, future)}
+        self._next_request = 0
+        self._round_robin = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self._results = self._ctx.Queue()
+        self.workers = [InferenceProcess(i, slots, slot_bytes) for i in range(max(1, processes))]
+        for worker in self.workers:
+            self._spawn(worker)
+        threading.Thread(target=self._collect_results, daemon=True).start()
+        threading.Thread(target=self._watch_workers, daemon=True).start()
+        atexit.register(self.close)
+
+    def _spawn(self, worker):
+        worker.requests = self._ctx.Queue()
+        worker.ready = False
+        worker.model_state = 'loading'
+        worker.model_error = None
+        worker.process = self._ctx.Process(
+            target=inference_process_main,
+            args=(worker.worker_id, worker.shm.name, worker.slot_bytes, worker.requests,
+                  self._results, self.threads, worker.slots),
+            daemon=True
+        )
+        worker.process.start()
+
+    def _alive(self):
+        return [w for w in self.workers if w.process is not None and w.process.is_alive()]
+
+    def _assign(self, camera):
+        """Pick the worker for a camera, None means any worker"""
+        alive = self._alive()
+        alive = [w for w in alive if w.ready] or alive or self.workers
+        if camera is None:
+            self._round_robin = (self._round_robin + 1) % len(alive)
+            return alive[self._round_robin]
+        worker_id = self.pins.get(camera, self.assignments.get(camera))
+        if worker_id is not None and any(w.worker_id == worker_id for w in alive):
+            self.assignments[camera] = worker_id
+            return self.workers[worker_id]
+        loads = {w.worker_id: 0 for w in alive}
+        for assigned in self.assignments.values():
+            if assigned in loads:
+                loads[assigned] += 1
+        worker_id = min(loads, key=loads.get)
+        self.assignments[camera] = worker_id
+        return self.workers[worker_id]
+
+    def submit(self, frame, camera=None, timeout=5):
+        """Copy a BGR frame into a worker's shared memory, returns a Future of the prediction"""
+        with self._lock:
+            worker = self._assign(camera)
+        if frame.nbytes > worker.slot_bytes:
+            scale = (worker.slot_bytes / frame.nbytes) ** 0.5
+            frame = cv2.resize(frame, (int(frame.shape[1] * scale), int(frame.shape[0] * scale)))
+        try:
+            slot = worker.free_slots.get(timeout=timeout)
+        except queue.Empty:
+            raise RuntimeError(f"Inference worker {worker.worker_id} is busy")
+        np.copyto(worker.slot_view(slot, frame.shape), frame)
+        future = concurrent.futures.Future()
+        with self._lock:
+            request_id = self._next_request
+            self._next_request += 1
+            self._pending[request_id] = (worker.worker_id, slot, future)
+        worker.requests.put((request_id, slot, frame.shape))
+        return future
+
+    def _collect_results(self):
+        while not self._closed:
+            try:
+                worker_id, request_id, prediction, error = self._results.get(timeout=1)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            worker = self.workers[worker_id]
+            if request_id is None:
+                # Model status update: (worker_id, None, state, error)
+                worker.model_state = prediction
+                worker.model_error = error
+                worker.ready = prediction == 'ready'
+                continue
+            with self._lock:
+                entry = self._pending.pop(request_id, None)
+            if entry is None:
+                continue  # already failed when the worker died
+            _, slot, future = entry
+            worker.free_slots.put(slot)
+            worker.completed += 1
+            if error:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(prediction)
+
+    def _watch_workers(self):
+        while not self._closed:
+            time.sleep(1)
+            for worker in self.workers:
+                if self._closed or worker.process.is_alive():
+                    continue
+                log.warning('inference_worker_died', "⚠️ Inference worker died, restarting",
+                            worker_id=worker.worker_id, exit_code=worker.process.exitcode)
+                with self._lock:
+                    lost = [(rid, e) for rid, e in self._pending.items() if e[0] == worker.worker_id]
+                    for request_id, _ in lost:
+                        del self._pending[request_id]
+                    # Move its cameras to the surviving workers
+                    for camera in [c for c, w in self.assignments.items() if w == worker.worker_id]:
+                        del self.assignments[camera]
+                for _, (_, slot, future) in lost:
+                    worker.free_slots.put(slot)
+                    future.set_exception(RuntimeError(f"Inference worker {worker.worker_id} died"))
+                worker.restarts += 1
+                self._spawn(worker)
+                self.rebalance()
+
+    def rebalance(self):
+        """Even out unpinned cameras across live workers"""
+        with self._lock:
+            alive = [w.worker_id for w in self._alive()]
+            if not alive:
+                return
+            per_worker = {worker_id: [] for worker_id in alive}
+            for camera, worker_id in self.assignments.items():
+                if camera not in self.pins and worker_id in per_worker:
+                    per_worker[worker_id].append(camera)
+            while True:
+                busiest = max(per_worker, key=lambda w: len(per_worker[w]))
+                idlest = min(per_worker, key=lambda w: len(per_worker[w]))
+                if len(per_worker[busiest]) - len(per_worker[idlest]) <= 1:
+                    break
+                camera = per_worker[busiest].pop()
+                per_worker[idlest].append(camera)
+                self.assignments[camera] = idlest
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for worker in self.workers:
+            try:
+                worker.requests.put(None)
+                worker.process.join(timeout=2)
+            except Exception:
+                pass
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.shm.close()
+            worker.shm.unlink()
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+            assignments = dict(self.assignments)
+        return {
+            'processes': len(self.workers),
+            'threads_per_process': self.threads,
+            'pending': pending,
+            'workers': [
+                {
+                    'worker_id': w.worker_id,
+                    'pid': w.process.pid,
+                    'alive': w.process.is_alive(),
+                    'ready': w.ready,
+                    'model_state': w.model_state,
+                    'model_error': w.model_error,
+                    'restarts': w.restarts,
+                    'completed': w.completed,
+                    'cameras': [f'{uid}/{index}' for (uid, index), wid in assignments.items() if wid == w.worker_id]
+                }
+                for w in self.workers
+            ]
+        }
+
+class ProcessDetector(Detector):
+    """Run preprocessing and the model in worker processes to escape the GIL
+
+    The pool starts on first use (or at app startup) rather than at import,
+    because spawned workers re-import the launching script.
+    """
+    name = 'process'
+
+    def __init__(self):
+        super().__init__()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessInferencePool()
+            return self._pool
+
+    def ready(self):
+        return any(w.ready for w in self.pool.workers)
+
+    def _detect(self, frame, camera):
+        return self.pool.submit(frame, camera).result()
+
+    def stats(self):
+        stats = super().stats()
+        stats['pool'] = self.pool.stats()
+        return stats
+
+@app.on_event("startup")
+def start_inference_processes():
+    if isinstance(detector, ProcessDetector):
+        detector.pool
+
+def model_ready():
+    """Whether the model that serves /predict is loaded, in this process or the workers"""
+    if isinstance(detector, ProcessDetector):
+        return detector.ready()
+    return model_manager.model is not None
+
+def model_status():
+    """Model state (idle, loading, ready or failed) with load details for /status"""
+    if isinstance(detector, ProcessDetector):
+        states = [w.model_state for w in detector.pool.workers]
+        if 'ready' in states:
+            state = 'ready'
+        elif states and all(s == 'failed' for s in states):
+            state = 'failed'
+        else:
+            state = 'loading'
+        return {
+            'state': state,
+            'workers': {w.worker_id: {'state': w.model_state, 'error': w.model_error} for w in detector.pool.workers}
+        }
+    return model_manager.stats()
+
+def create_detector(backend=DETECTOR_BACKEND):
+    if backend == 'remote':
+        return RemoteDetector()
+    if backend == 'process':
+        return ProcessDetector()
+    if backend != 'local':
+        log.warning('config', f"⚠️ Unknown DETECTOR_BACKEND '{backend}', using local")
+    return LocalDetector()
+
+detector = create_detector()
 
 # ========== User & Camera Data ==========
 USERS_FILE = 'users.json'
 CAMERAS_FILE = 'user_cameras.json'
+DATABASE_FILE = os.environ.get('DATABASE_FILE', 'dooyoo.db')
+
+class DataStore:
+    """In-memory index of users and cameras with write-through to SQLite (WAL)
+
+    Reads are served from memory. Every mutation is committed in its own
+    transaction before the in-memory index is updated, under one lock.
+    """
+
+    def __init__(self, path=DATABASE_FILE):
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, data TEXT NOT NULL)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS cameras (id TEXT PRIMARY KEY, user_id TEXT NOT NULL, data TEXT NOT NULL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_cameras_user ON cameras (user_id)')
+        self._migrate_json()
+        self.users = {
+            username: json.loads(data)
+            for username, data in self._conn.execute('SELECT username, data FROM users')
+        }
+        self.cameras = {}  # {user_id: [camera_info]} in insertion order
+        for user_id, data in self._conn.execute('SELECT user_id, data FROM cameras ORDER BY rowid'):
+            self.cameras.setdefault(user_id, []).append(json.loads(data))
+
+    def _migrate_json(self):
+        """Import the legacy users.json / user_cameras.json files into an empty database"""
+        if os.path.exists(USERS_FILE) and not self._conn.execute('SELECT 1 FROM users LIMIT 1').fetchone():
+            with open(USERS_FILE, 'r', encoding='utf-8') as f:
+                legacy_users = json.load(f)
+            with self._conn:
+                self._conn.executemany(
+                    'INSERT INTO users (username, data) VALUES (?, ?)',
+                    [(name, json.dumps(info, ensure_ascii=False)) for name, info in legacy_users.items()]
+                )
+            log.info('migration', f"✅ Imported {len(legacy_users)} users from {USERS_FILE}")
+        if os.path.exists(CAMERAS_FILE) and not self._conn.execute('SELECT 1 FROM cameras LIMIT 1').fetchone():
+            with open(CAMERAS_FILE, 'r', encoding='utf-8') as f:
+                legacy_cameras = json.load(f)
+            rows = []
+            for user_id, user_cameras in legacy_cameras.items():
+                for camera_info in user_cameras:
+                    camera_info = dict(camera_info, id=camera_info.get('id') or uuid.uuid4().hex)
+                    rows.append((camera_info['id'], user_id, json.dumps(camera_info, ensure_ascii=False)))
+            with self._conn:
+                self._conn.executemany('INSERT INTO cameras (id, user_id, data) VALUES (?, ?, ?)', rows)
+            log.info('migration', f"✅ Imported {len(rows)} cameras from {CAMERAS_FILE}")
+
+    # Users
+    def get_user(self, username):
+        user = self.users.get(username)
+        return dict(user) if user else None
+
+    def add_user(self, username, info):
+        """Create a user, returns False if the username is taken"""
+        with self._lock:
+            if username in self.users:
+                return False
+            with self._conn:
+                self._conn.execute(
+                    'INSERT INTO users (username, data) VALUES (?, ?)',
+                    (username, json.dumps(info, ensure_ascii=False))
+                )
+            self.users[username] = dict(info)
+            return True
+
+    # Cameras
+    def list_cameras(self, user_id):
+        return [dict(c) for c in self.cameras.get(user_id, [])]
+
+    def find_camera(self, user_id, camera_index=None, camera_id=None):
+        """Look up a camera by stable id or list index, returns (index, camera) or (None, None)"""
+        user_cameras = self.cameras.get(user_id, [])
+        for index, camera_info in enumerate(user_cameras):
+            if camera_id is not None and camera_info.get('id') == camera_id:
+                return index, dict(camera_info)
+        if camera_id is None and isinstance(camera_index, int) and 0 <= camera_index < len(user_cameras):
+            return camera_index, dict(user_cameras[camera_index])
+        return None, None
+
+    def add_camera(self, user_id, camera_info):
+        camera_info = dict(camera_info, id=uuid.uuid4().hex)
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    'INSERT INTO cameras (id, user_id, data) VALUES (?, ?, ?)',
+                    (camera_info['id'], user_id, json.dumps(camera_info, ensure_ascii=False))
+                )
+            self.cameras.setdefault(user_id, []).append(camera_info)
+        return dict(camera_info)
+
+    def update_camera(self, user_id, camera_id, **fields):
+        with self._lock:
+            index, camera_info = self.find_camera(user_id, camera_id=camera_id)
+            if camera_info is None:
+                return None
+            camera_info.update(fields)
+            with self._conn:
+                self._conn.execute(
+                    'UPDATE cameras SET data = ? WHERE id = ?',
+                    (json.dumps(camera_info, ensure_ascii=False), camera_id)
+                )
+            self.cameras[user_id][index] = camera_info
+        return dict(camera_info)
 
-# Load/save users
-if not os.path.exists(USERS_FILE):
-    with open(USERS_FILE, 'w', encoding='utf-8') as f:
-        json.dump({}, f)
-if not os.path.exists(CAMERAS_FILE):
-    with open(CAMERAS_FILE, 'w', encoding='utf-8') as f:
-        json.dump({}, f)
+    def remove_camera(self, user_id, camera_id):
+        with self._lock:
+            index, camera_info = self.find_camera(user_id, camera_id=camera_id)
+            if camera_info is None:
+                return None
+            with self._conn:
+                self._conn.execute('DELETE FROM cameras WHERE id = ?', (camera_id,))
+            self.cameras[user_id].pop(index)
+        return camera_info
 
-def load_users():
-    with open(USERS_FILE, 'r', encoding='utf-8') as f:
-        return json.load(f)
+store = DataStore()
 
-def save_users(users):
-    with open(USERS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
+# ========== Footage & Accident Index ==========
+FOOTAGE_FOLDER = 'footages'
+ACCIDENT_CLIPS_FOLDER = 'accident_clips'
+# <user>_<camera>_<YYYYmmdd_HHMMSS_mmm>[_n] segments, or the older <user>_<camera>_<HH-MM-dd_mm_yy> files
+RECORDING_NAME_RE = re.compile(
+    r'^(?P<user>[^_]+)_(?P<camera>.*)_(\d{8}_\d{6}_\d{3}(_\d+)?|\d{2}-\d{2}-\d{2}_\d{2}_\d{2})\.(avi|mp4)$'
+)
+ACCIDENT_NAME_RE = re.compile(r'^accident_(?P<user>[^_]+)_(?P<camera>.*)_\d{8}_\d{6}\.avi$')
+
+class MediaIndex:
+    """Persistent index of recordings and accident clips in the SQLite database
+
+    Rows are written when a clip or recording is finalized and listed with
+    keyset pagination on (created, id), so a page costs O(page size).
+    """
+
+    COLUMNS = ('id', 'kind', 'user_id', 'camera_name', 'filename', 'filepath',
+               'created', 'accident_time', 'confidence', 'duration', 'size', 'thumbnail', 'camera_id')
+
+    def __init__(self, path=DATABASE_FILE):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS media ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, user_id TEXT NOT NULL, '
+                'camera_name TEXT, filename TEXT NOT NULL, filepath TEXT NOT NULL, created REAL NOT NULL, '
+                'accident_time TEXT, confidence REAL, duration REAL, size INTEGER, thumbnail TEXT, '
+                'camera_id TEXT, UNIQUE (kind, filename))'
+            )
+            columns = {row[1] for row in self._conn.execute('PRAGMA table_info(media)')}
+            if 'thumbnail' not in columns:
+                self._conn.execute('ALTER TABLE media ADD COLUMN thumbnail TEXT')
+            if 'camera_id' not in columns:
+                self._conn.execute('ALTER TABLE media ADD COLUMN camera_id TEXT')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_media_list ON media (user_id, kind, created DESC, id DESC)')
+
+    def add(self, kind, user_id, filename, filepath, camera_name=None, created=None,
+            accident_time=None, confidence=None, duration=None, size=None, thumbnail=None, camera_id=None):
+        if created is None:
+            created = time.time()
+        if size is None and os.path.exists(filepath):
+            size = os.path.getsize(filepath)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO media (kind, user_id, camera_name, filename, filepath, created, '
+                'accident_time, confidence, duration, size, thumbnail, camera_id) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (kind, user_id, camera_name, filename, filepath, created,
+                 accident_time, confidence, duration, size, thumbnail, camera_id)
+            )
+
+    def set_thumbnail(self, kind, filename, thumbnail):
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE media SET thumbnail = ? WHERE kind = ? AND filename = ?',
+                               (thumbnail, kind, filename))
+
+    def get(self, kind, filename):
+        with self._lock:
+            row = self._conn.execute(
+                f'SELECT {", ".join(self.COLUMNS)} FROM media WHERE kind = ? AND filename = ?',
+                (kind, filename)
+            ).fetchone()
+        return dict(zip(self.COLUMNS, row)) if row else None
+
+    def remove(self, kind, filename):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM media WHERE kind = ? AND filename = ?', (kind, filename))
 
-def load_cameras():
-    with open(CAMERAS_FILE, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    def recordings_by_camera(self):
+        """All recordings grouped by (user_id, camera_id, camera_name), oldest first, for retention
 
-def save_cameras(cameras):
-    with open(CAMERAS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(cameras, f, ensure_ascii=False, indent=2)
+        Rows have a camera_id (and camera_name None in the key, so a renamed
+        camera keeps one group) unless they were indexed without one: older
+        rows and files found by reconcile() are grouped by name.
+        """
+        groups = {}
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT {", ".join(self.COLUMNS)} FROM media WHERE kind = ? ORDER BY created, id', ('recording',)
+            ).fetchall()
+        for row in rows:
+            row = dict(zip(self.COLUMNS, row))
+            key = (row['user_id'], row['camera_id'], None if row['camera_id'] else row['camera_name'])
+            groups.setdefault(key, []).append(row)
+        return groups
 
-users = load_users()
+    def query(self, user_id, kind, camera=None, since=None, until=None,
+              min_confidence=None, cursor=None, limit=100):
+        """Newest-first page of media rows, returns (rows, next_cursor)"""
+        sql = f'SELECT {", ".join(self.COLUMNS)} FROM media WHERE user_id = ? AND kind = ?'
+        params = [user_id, kind]
+        if camera:
+            sql += ' AND camera_name = ?'
+            params.append(camera)
+        if since is not None:
+            sql += ' AND created >= ?'
+            params.append(since)
+        if until is not None:
+            sql += ' AND created < ?'
+            params.append(until)
+        if min_confidence is not None:
+            sql += ' AND confidence >= ?'
+            params.append(min_confidence)
+        if cursor:
+            try:
+                cursor_created, cursor_id = cursor.split('_')
+                cursor_created, cursor_id = float(cursor_created), int(cursor_id)
+            except ValueError:
+                raise ValueError('Invalid cursor')
+            sql += ' AND (created < ? OR (created = ? AND id < ?))'
+            params += [cursor_created, cursor_created, cursor_id]
+        sql += ' ORDER BY created DESC, id DESC LIMIT ?'
+        params.append(limit + 1)
+        with self._lock:
+            rows = [dict(zip(self.COLUMNS, row)) for row in self._conn.execute(sql, params)]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = f"{rows[-1]['created']!r}_{rows[-1]['id']}"
+        return rows, next_cursor
+
+    def reconcile(self):
+        """Rebuild the index from the footage and accident clip folders on disk"""
+        added = removed = 0
+        for kind, folder, pattern in (('recording', FOOTAGE_FOLDER, RECORDING_NAME_RE),
+                                      ('accident', ACCIDENT_CLIPS_FOLDER, ACCIDENT_NAME_RE)):
+            with self._lock:
+                known = {
+                    filename for (filename,) in
+                    self._conn.execute('SELECT filename FROM media WHERE kind = ?', (kind,))
+                }
+            on_disk = set()
+            if os.path.isdir(folder):
+                for entry in os.scandir(folder):
+                    if not entry.is_file() or not entry.name.endswith(('.avi', '.mp4')):
+                        continue
+                    on_disk.add(entry.name)
+                    if entry.name in known:
+                        continue
+                    match = pattern.match(entry.name)
+                    if match:
+                        user_id, camera_name = match.group('user'), match.group('camera')
+                    else:
+                        user_id, camera_name = entry.name.split('_', 1)[0], None
+                    stat = entry.stat()
+                    self.add(kind, user_id, entry.name, os.path.join(folder, entry.name),
+                             camera_name=camera_name, created=stat.st_ctime, size=stat.st_size)
+                    added += 1
+            missing = known - on_disk
+            if missing:
+                with self._lock, self._conn:
+                    self._conn.executemany(
+                        'DELETE FROM media WHERE kind = ? AND filename = ?',
+                        [(kind, filename) for filename in missing]
+                    )
+                removed += len(missing)
+        log.info('media_index_reconciled', "✅ Media index reconciled", added=added, removed=removed)
+
+media_index = MediaIndex()
+threading.Thread(target=media_index.reconcile, daemon=True).start()
 
 # ========== WebSocket Notification ==========
-ws_clients = set()
-user_ws = {}  # {user_id: websocket}
+ALERT_QUEUE_SIZE = int(os.environ.get('ALERT_QUEUE_SIZE', '16'))  # per connection, oldest dropped when full
+ALERT_SEND_TIMEOUT = float(os.environ.get('ALERT_SEND_TIMEOUT', '10'))
+ALERT_HEARTBEAT_SECONDS = float(os.environ.get('ALERT_HEARTBEAT_SECONDS', '30'))
+ALERT_DEDUPE_SECONDS = float(os.environ.get('ALERT_DEDUPE_SECONDS', '30'))
+HEARTBEAT_MESSAGE = json.dumps({'type': 'heartbeat'})
+
+class AlertConnection:
+    """One alert WebSocket; the send queue only exists while messages are pending"""
+    __slots__ = ('user_id', 'websocket', 'format', 'queue', 'sending', 'closed')
+
+    def __init__(self, user_id, websocket, format='json'):
+        self.user_id = user_id
+        self.websocket = websocket
+        self.format = format  # json, or text for clients that expect the plain message
+        self.queue = None
+        self.sending = False
+        self.closed = False
+
+class AlertHub:
+    """Fan alerts out to every WebSocket of a user
+
+    publish() may be called from any thread; delivery happens on the server
+    event loop. Each connection has a bounded queue drained by a short-lived
+    task, so idle connections cost no task. Connections whose sends fail or
+    time out (heartbeats included) are evicted. Repeated fall alerts for the
+    same camera within ALERT_DEDUPE_SECONDS are coalesced into the next one.
+    """
+
+    def __init__(self):
+        self.connections = {}  # {user_id: set(AlertConnection)}
+        self.loop = None
+        self._recent = {}  # {(user_id, camera_id): [last_sent, suppressed]}
+        self._recent_lock = threading.Lock()
+        self.sent = 0
+        self.dropped = 0
+        self.evicted = 0
+        self.coalesced = 0
+
+    def bind(self, loop):
+        if self.loop is None:
+            self.loop = loop
+            loop.create_task(self._heartbeat())
+
+    def connect(self, user_id, websocket, format='json'):
+        self.bind(asyncio.get_running_loop())
+        connection = AlertConnection(user_id, websocket, format)
+        self.connections.setdefault(user_id, set()).add(connection)
+        return connection
+
+    def disconnect(self, connection):
+        connection.closed = True
+        connection.queue = None
+        user_connections = self.connections.get(connection.user_id)
+        if user_connections is not None:
+            user_connections.discard(connection)
+            if not user_connections:
+                del self.connections[connection.user_id]
+
+    def publish(self, user_id, alert):
+        """Queue an alert dict for all of a user's connections, safe to call from any thread"""
+        if alert.get('type') != 'fall':
+            return self._schedule(user_id, alert)
+        key = (user_id, alert.get('camera_id'))
+        now = time.time()
+        with self._recent_lock:
+            recent = self._recent.get(key)
+            if recent is not None and now - recent[0] < ALERT_DEDUPE_SECONDS:
+                recent[1] += 1
+                self.coalesced += 1
+                return False
+            if recent is not None and recent[1]:
+                alert = dict(alert, coalesced=recent[1])
+            # Only an alert that reached the loop starts a window, a dropped one must not swallow the next
+            scheduled = self._schedule(user_id, alert)
+            if scheduled:
+                self._recent[key] = [now, 0]
+        metrics.inc('fall_alerts', camera_label(key))
+        return scheduled
+
+    def _schedule(self, user_id, alert):
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return False
+        try:
+            loop.call_soon_threadsafe(self._dispatch, user_id, alert)
+        except RuntimeError:
+            return False  # closed since the check
+        return True
+
+    def _dispatch(self, user_id, alert):
+        message = json.dumps(alert)  # serialized once for every connection
+        for connection in list(self.connections.get(user_id, ())):
+            if connection.format == 'json':
+                self._enqueue(connection, message)
+            elif alert.get('type') == 'fall':
+                self._enqueue(connection, alert.get('message', ''))
+
+    def _enqueue(self, connection, message):
+        if connection.closed:
+            return
+        if connection.queue is None:
+            connection.queue = deque(maxlen=ALERT_QUEUE_SIZE)
+        if len(connection.queue) == ALERT_QUEUE_SIZE:
+            self.dropped += 1
+        connection.queue.append(message)
+        if not connection.sending:
+            connection.sending = True
+            self.loop.create_task(self._drain(connection))
+
+    async def _drain(self, connection):
+        try:
+            while connection.queue:
+                message = connection.queue.popleft()
+                with metrics.time('alert_send'):
+                    await asyncio.wait_for(connection.websocket.send_text(message), ALERT_SEND_TIMEOUT)
+                self.sent += 1
+            connection.queue = None
+        except Exception:
+            await self._evict(connection)
+        finally:
+            connection.sending = False
+
+    async def _evict(self, connection):
+        if connection.closed:
+            return
+        self.evicted += 1
+        self.disconnect(connection)
+        try:
+            await connection.websocket.close()
+        except Exception:
+            pass
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(ALERT_HEARTBEAT_SECONDS)
+            for user_connections in list(self.connections.values()):
+                for connection in list(user_connections):
+                    # Plain-text clients show every message, so they only get alerts
+                    if connection.format == 'json':
+                        self._enqueue(connection, HEARTBEAT_MESSAGE)
+            now = time.time()
+            with self._recent_lock:
+                for key in [k for k, (sent, _) in self._recent.items() if now - sent >= ALERT_DEDUPE_SECONDS]:
+                    del self._recent[key]
+
+    def stats(self):
+        return {
+            'users': len(self.connections),
+            'connections': sum(len(c) for c in list(self.connections.values())),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'evicted': self.evicted,
+            'coalesced': self.coalesced
+        }
+
+alert_hub = AlertHub()
+
+@app.on_event("startup")
+async def start_alert_hub():
+    alert_hub.bind(asyncio.get_running_loop())
 
 @app.websocket("/ws/alert/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: str):
+async def websocket_endpoint(websocket: WebSocket, user_id: str, format: str = 'json'):
     await websocket.accept()
-    user_ws[user_id] = websocket
+    connection = alert_hub.connect(user_id, websocket, 'text' if format == 'text' else 'json')
     try:
         while True:
-            await websocket.receive_text()
-    except:
-        user_ws.pop(user_id, None)
+            await websocket.receive_text()  # clients may send pings, nothing to answer
+    except Exception:
+        pass
+    finally:
+        alert_hub.disconnect(connection)
 
-async def send_alert_to_user(user_id, msg):
-    ws = user_ws.get(user_id)
-    if ws:
-        await ws.send_text(msg)
+def fall_alert(user_id, camera_name, message, camera_id=None, confidence=None, accident_time=None,
+               clip_filename=None, source='monitor', track=None, tracks=None):
+    """Structured fall alert for alert_hub.publish()
+
+    camera_index is the camera's current position in the user's list, for
+    older clients. track is the state of the person track that fell, tracks
+    the state of every track on the camera at that moment.
+    """
+    accident_time = accident_time or datetime.now()
+    alert = {
+        'type': 'fall',
+        'message': message,
+        'user_id': user_id,
+        'camera_name': camera_name,
+        'camera_id': camera_id,
+        'camera_index': store.find_camera(user_id, camera_id=camera_id)[0],
+        'confidence': confidence,
+        'timestamp': accident_time.isoformat(),
+        'source': source
+    }
+    if track is not None:
+        alert['track'] = track
+        alert['tracks'] = tracks or [track]
+    if clip_filename:
+        # The clip is encoded after the post-roll, a clip_ready alert follows
+        alert['clip'] = {'filename': clip_filename, 'url': f'/accident-video-file/{clip_filename}', 'status': 'pending'}
+    return alert
 
 # ========== User Auth ==========
 @app.post('/register')
@@ -122,64 +1141,313 @@ async def register(data: dict):
     password = data.get('password')
     if not username or not email or not password:
         raise HTTPException(status_code=400, detail='Missing fields')
-    if username in users:
-        raise HTTPException(status_code=400, detail='Username already exists')
     user_uuid = str(uuid.uuid4())
-    users[username] = {'uuid': user_uuid, 'email': email, 'password': password}
-    save_users(users)
+    if not store.add_user(username, {'uuid': user_uuid, 'email': email, 'password': password}):
+        raise HTTPException(status_code=400, detail='Username already exists')
     return {'success': True, 'uuid': user_uuid}
 
 @app.post('/login')
 async def login(data: dict):
     username = data.get('username')
     password = data.get('password')
-    user = users.get(username)
+    user = store.get_user(username)
     if not user or user['password'] != password:
         raise HTTPException(status_code=401, detail='Invalid credentials')
     return {'success': True, 'uuid': user['uuid']}
 
 # ========== AI Fall Detection Endpoint ==========
+PREDICT_WORKERS = int(os.environ.get('PREDICT_WORKERS', '4'))
+PREDICT_MAX_PENDING = int(os.environ.get('PREDICT_MAX_PENDING', '64'))  # images queued or running
+PREDICT_BATCH_MAX_IMAGES = int(os.environ.get('PREDICT_BATCH_MAX_IMAGES', '64'))
+PREDICT_RETRY_AFTER = 1
+
+class PredictExecutor:
+    """Bounded thread pool that decodes and runs /predict requests off the event loop
+
+    Admission is counted in images: while max_pending images are queued or
+    running, new requests are rejected right away (429) instead of making
+    every caller wait longer. A batch bigger than max_pending is only
+    admitted when nothing else is pending.
+    """
+
+    def __init__(self, workers=PREDICT_WORKERS, max_pending=PREDICT_MAX_PENDING):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers,
+                                                               thread_name_prefix='predict')
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.accepted = 0
+        self.rejected = 0
+
+    def submit(self, fn, *args, weight=1):
+        """Run fn(*args) on the pool, returns a Future or None when overloaded"""
+        with self._lock:
+            if self.pending and self.pending + weight > self.max_pending:
+                self.rejected += 1
+                return None
+            self.pending += weight
+            self.accepted += 1
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self._release(weight))
+        return future
+
+    def _release(self, weight):
+        with self._lock:
+            self.pending -= weight
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'pending_images': self.pending,
+                'max_pending_images': self.max_pending,
+                'accepted': self.accepted,
+                'rejected': self.rejected
+            }
+
+predict_executor = PredictExecutor()
+
+def decode_image(data):
+    """Decode uploaded image bytes to a BGR frame, None if they are not an image"""
+    frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if frame is not None:
+        return frame
+    try:
+        image = Image.open(io.BytesIO(data)).convert('RGB')  # formats OpenCV can't read
+    except Exception:
+        return None
+    return cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+
+def predict_frames(frames):
+    """Predictions for BGR frames (None entries are reported as undecodable), in input order
+
+    All frames are queued before waiting so they share micro-batches.
+    """
+    futures = []
+    for frame in frames:
+        if frame is None:
+            futures.append(ValueError('Cannot decode image'))
+            continue
+        try:
+            if isinstance(detector, ProcessDetector):
+                futures.append(detector.pool.submit(frame))
+            else:
+                futures.append(inference_scheduler.submit(frame))
+        except Exception as e:
+            futures.append(e)
+    results = []
+    for frame, future in zip(frames, futures):
+        if isinstance(future, Exception):
+            results.append({'error': str(future)})
+            continue
+        try:
+            result = future.result()
+            results.append(result if isinstance(detector, ProcessDetector) else prediction_from_output(result, frame.shape))
+        except Exception as e:
+            results.append({'error': str(e)})
+    return results
+
+def predict_images(images):
+    """Decode image bytes and predict, runs on the predict executor"""
+    frames = []
+    for data in images:
+        with metrics.time('decode'):
+            frames.append(decode_image(data))
+    return predict_frames(frames)
+
+def predict_array(array, channels='bgr'):
+    """Predict an (H, W, 3) or (N, H, W, 3) uint8 array, runs on the predict executor"""
+    frames = array[None] if array.ndim == 3 else array
+    if channels == 'rgb':
+        frames = frames[..., ::-1]
+    return predict_frames([np.ascontiguousarray(frame) for frame in frames])
+
+def check_model_ready():
+    if not model_ready():
+        if model_status()['state'] in ('idle', 'loading'):
+            raise HTTPException(status_code=503, detail="Model is loading")
+        raise HTTPException(status_code=500, detail="Model is not ready")
+
+async def run_predict(fn, *args, weight=1):
+    future = predict_executor.submit(fn, *args, weight=weight)
+    if future is None:
+        raise HTTPException(status_code=429, detail="Too many prediction requests, retry later",
+                            headers={'Retry-After': str(PREDICT_RETRY_AFTER)})
+    return await asyncio.wrap_future(future)
+
 @app.post("/predict")
 async def predict(file: UploadFile = File(...)):
-    if model is None:
-        raise HTTPException(status_code=500, detail="Model is not ready")
+    check_model_ready()
     image_bytes = await file.read()
-    image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-    tensor = transform_image(image).unsqueeze(0)
-    with torch.no_grad():
-        output = model(tensor)
-        pred = output.argmax().item()
-        confidence = torch.softmax(output, dim=1).max().item()
-        is_fall = pred == 1
-    return {
-        "fall_detected": is_fall,
-        "confidence": round(confidence, 3),
-        "prediction": "fall" if is_fall else "normal"
-    }
+    result = (await run_predict(predict_images, [image_bytes]))[0]
+    if 'error' in result:
+        status_code = 400 if result['error'] == 'Cannot decode image' else 500
+        raise HTTPException(status_code=status_code, detail=result['error'])
+    return result
+
+@app.post("/predict/batch")
+async def predict_batch(request: Request, channels: str = 'bgr'):
+    """Predict many images in one call
+
+    Send multipart form data with one or more 'files' parts, or a NumPy
+    .npy body (Content-Type: application/x-npy) holding a uint8 array of
+    shape (N, H, W, 3) or (H, W, 3) in BGR order (channels=rgb for RGB).
+    Results come back per image in input order; undecodable images get an
+    'error' entry instead of failing the whole batch.
+    """
+    if channels not in ('bgr', 'rgb'):
+        raise HTTPException(status_code=400, detail="channels must be 'bgr' or 'rgb'")
+    check_model_ready()
+    content_type = request.headers.get('content-type', '')
+    if content_type.startswith('multipart/form-data'):
+        form = await request.form()
+        uploads = [part for part in form.getlist('files') if hasattr(part, 'read')]
+        if not uploads:
+            raise HTTPException(status_code=400, detail="No 'files' in the form")
+        if len(uploads) > PREDICT_BATCH_MAX_IMAGES:
+            raise HTTPException(status_code=413, detail=f"At most {PREDICT_BATCH_MAX_IMAGES} images per batch")
+        images = [await part.read() for part in uploads]
+        results = await run_predict(predict_images, images, weight=len(images))
+    elif content_type.startswith(('application/x-npy', 'application/octet-stream')):
+        try:
+            array = np.load(io.BytesIO(await request.body()), allow_pickle=False)
+        except Exception:
+            raise HTTPException(status_code=400, detail="Body is not a .npy array")
+        if array.dtype != np.uint8 or array.ndim not in (3, 4) or array.shape[-1] != 3:
+            raise HTTPException(status_code=400, detail="Expected a uint8 array of shape (N, H, W, 3) or (H, W, 3)")
+        count = 1 if array.ndim == 3 else array.shape[0]
+        if count > PREDICT_BATCH_MAX_IMAGES:
+            raise HTTPException(status_code=413, detail=f"At most {PREDICT_BATCH_MAX_IMAGES} images per batch")
+        results = await run_predict(predict_array, array, channels, weight=count)
+    else:
+        raise HTTPException(status_code=415, detail="Send multipart 'files' or an application/x-npy array")
+    return {"results": results, "count": len(results)}
 
 @app.get("/test-model")
 def test_model():
-    if model is None:
-        return {"status": "error", "message": "Model is not ready"}
-    return {"status": "success", "message": "Model is ready"}
+    state = model_status()['state']
+    if not model_ready():
+        message = "Model is loading" if state in ('idle', 'loading') else "Model is not ready"
+        return {"status": "error", "message": message, "state": state}
+    return {"status": "success", "message": "Model is ready", "state": state}
+
+@app.post("/model/reload")
+def reload_model():
+    """Reload the model file now instead of waiting for the file watcher"""
+    if isinstance(detector, ProcessDetector):
+        raise HTTPException(status_code=400, detail="Inference workers reload when the model file changes")
+    if not model_manager.load():
+        raise HTTPException(status_code=500, detail=f"Model reload failed: {model_manager.error}")
+    return {"success": True, "model": model_manager.stats()}
 
 @app.get('/status')
 def get_status():
     return {
-        "model_loaded": model is not None,
-        "active_websockets": len(user_ws)
+        "model_loaded": model_ready(),
+        "model": model_status(),
+        "active_websockets": alert_hub.stats()['connections'],
+        "alerts": alert_hub.stats(),
+        "inference": inference_scheduler.stats(),
+        "predict": predict_executor.stats(),
+        "captures": capture_hub.stats(),
+        "relay": relay_store.stats(),
+        "detector": detector.stats(),
+        "monitor_memory": frame_buffer_stats(),
+        "clip_writer": clip_writer.stats(),
+        "motion": motion_gate_stats(),
+        "tracking": fall_tracker_stats(),
+        "sampling": sampling_scheduler.stats(),
+        "media": media_transcoder.stats(),
+        "thumbnails": thumbnail_cache.stats(),
+        "recordings": recording_manager.stats(),
+        "retention": recording_manager.retention_stats(),
+        "streams": broadcast_hub.stats(),
+        "onvif": onvif_directory.stats(),
+        "logging": {"level": LOG_LEVEL, "format": LOG_FORMAT, "suppressed": log.suppressed},
+        "profiles": [session.report(0) for session in profiler_sessions.values()]
     }
 
+def _gauge_lines(name, kind, help_text, samples):
+    """Prometheus lines for [(labels_dict, value)]"""
+    lines = [f'# HELP dooyoo_{name} {help_text}', f'# TYPE dooyoo_{name} {kind}']
+    for labels, value in samples:
+        label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+        lines.append(f'dooyoo_{name}{{{label_text}}} {float(value):g}' if label_text else f'dooyoo_{name} {float(value):g}')
+    return lines
+
+@app.get('/metrics')
+def get_metrics():
+    """Prometheus text exposition: stage latency histograms plus frame, queue and connection gauges"""
+    captures = capture_hub.stats()
+    monitors = monitor_supervisor.stats()
+    recorders = recording_manager.stats()
+    inference = inference_scheduler.stats()
+    clips = clip_writer.stats()
+    predict_stats = predict_executor.stats()
+    alerts = alert_hub.stats()
+    relay = relay_store.stats()
+
+    def cam(row):
+        return {'camera': camera_label((row['user_id'], row['camera_id']))}
+
+    lines = metrics.render()
+    lines += _gauge_lines('model_ready', 'gauge', 'Whether the model is loaded', [({}, model_ready())])
+    lines += _gauge_lines('capture_frames_total', 'counter', 'Frames decoded per camera',
+                          [(cam(c), c['frames']) for c in captures])
+    lines += _gauge_lines('capture_reconnects_total', 'counter', 'Camera stream reconnects',
+                          [(cam(c), c['reconnects']) for c in captures])
+    lines += _gauge_lines('capture_open', 'gauge', 'Whether the camera stream is connected',
+                          [(cam(c), c['is_open']) for c in captures])
+    lines += _gauge_lines('capture_consumers', 'gauge', 'Monitors, recorders and streams sharing a capture',
+                          [(cam(c), c['consumers']) for c in captures])
+    lines += _gauge_lines('monitor_fps', 'gauge', 'Frames per second examined by the monitor',
+                          [(cam(w), w['fps']) for w in monitors])
+    lines += _gauge_lines('monitor_restarts_total', 'counter', 'Monitoring worker restarts',
+                          [(cam(w), w['restarts']) for w in monitors])
+    lines += _gauge_lines('record_frames_dropped_total', 'counter', 'Frames dropped because the encoder fell behind',
+                          [(cam(r), r['frames_dropped']) for r in recorders])
+    lines += _gauge_lines('record_queue_depth', 'gauge', 'Frames waiting for the segment encoder',
+                          [(cam(r), r['queue_depth']) for r in recorders])
+    lines += _gauge_lines('record_encoder_lag_seconds', 'gauge', 'Capture time between queued and encoded frames',
+                          [(cam(r), r['encoder_lag_seconds']) for r in recorders])
+    lines += _gauge_lines('stream_viewers', 'gauge', 'MJPEG viewers per camera',
+                          [(cam(b), b['viewers'])
+                           for b in broadcast_hub.stats()])
+    lines += _gauge_lines('relay_frames_dropped_total', 'counter', 'Relay frames dropped over RELAY_MAX_FPS',
+                          [({'camera': f"{c['user_id']}/{c['camera_name']}"}, c['dropped']) for c in relay['cameras']])
+    lines += _gauge_lines('inference_queue_depth', 'gauge', 'Frames waiting for the inference scheduler',
+                          [({}, inference['queue_depth'])])
+    lines += _gauge_lines('inference_batches_total', 'counter', 'Inference batches run', [({}, inference['total_batches'])])
+    lines += _gauge_lines('clip_queue_depth', 'gauge', 'Accident clips waiting to be encoded', [({}, clips['queue_depth'])])
+    lines += _gauge_lines('clips_dropped_total', 'counter', 'Accident clips dropped on a full queue', [({}, clips['dropped'])])
+    lines += _gauge_lines('predict_pending_images', 'gauge', 'Images queued or running on the predict executor',
+                          [({}, predict_stats['pending_images'])])
+    lines += _gauge_lines('predict_rejected_total', 'counter', 'Predict requests rejected with 429',
+                          [({}, predict_stats['rejected'])])
+    lines += _gauge_lines('alert_connections', 'gauge', 'Open alert WebSockets', [({}, alerts['connections'])])
+    lines += _gauge_lines('alerts_dropped_total', 'counter', 'Alerts dropped from full connection queues',
+                          [({}, alerts['dropped'])])
+    lines += _gauge_lines('log_suppressed_total', 'counter', 'Log messages suppressed by rate limiting',
+                          [({}, log.suppressed)])
+    return Response('\n'.join(lines) + '\n', media_type='text/plain; version=0.0.4')
+
 # ========== Camera Management Endpoints ==========
-relay_frames = {}  # {user_id: {camera_name: frame_bytes}}
+def find_camera_ref(user_id, camera_ref):
+    """Camera by stable id, or by list index for older clients; None if there is no such camera"""
+    _, camera = store.find_camera(user_id, camera_id=str(camera_ref))
+    if camera is None and str(camera_ref).isdigit():
+        _, camera = store.find_camera(user_id, int(camera_ref))
+    return camera
 
-@app.post('/relay/frame/{user_id}/{camera_name}')
-async def relay_frame(user_id: str, camera_name: str, file: UploadFile = File(...)):
-    frame_bytes = await file.read()
-    if user_id not in relay_frames:
-        relay_frames[user_id] = {}
-    relay_frames[user_id][camera_name] = frame_bytes
-    return {"success": True}
+def forget_camera_metrics(key):
+    """Drop the metric series of a (user_id, camera_id) once the camera is no longer in the store
+
+    Also called as its threads wind down, they may record a last sample
+    after the camera was removed.
+    """
+    if store.find_camera(key[0], camera_id=key[1])[1] is None:
+        metrics.forget(camera_label(key))
 
 @app.post('/cctv/add-camera')
 async def add_camera(data: dict):
@@ -189,9 +1457,6 @@ async def add_camera(data: dict):
     relay = data.get('relay', False)
     if not user_id or not camera_name or (not rtsp_url and not relay):
         raise HTTPException(status_code=400, detail='Missing required fields')
-    cameras = load_cameras()
-    if user_id not in cameras:
-        cameras[user_id] = []
     camera_info = {
         'name': camera_name,
         'relay': relay,
@@ -199,8 +1464,7 @@ async def add_camera(data: dict):
     }
     if not relay:
         camera_info['rtsp_url'] = rtsp_url
-    cameras[user_id].append(camera_info)
-    save_cameras(cameras)
+    camera_info = store.add_camera(user_id, camera_info)
     return {
         'success': True,
         'message': f'Camera "{camera_name}" added successfully',
@@ -210,23 +1474,22 @@ async def add_camera(data: dict):
 @app.patch('/cctv/edit-camera')
 async def edit_camera(data: dict):
     user_id = data.get('userId')
-    camera_index = data.get('cameraIndex')
-    new_name = data.get('cameraName')
-    new_rtsp_url = data.get('rtspUrl')
-    cameras = load_cameras()
-    if user_id not in cameras or camera_index >= len(cameras[user_id]):
+    _, camera = store.find_camera(user_id, data.get('cameraIndex'), data.get('cameraId'))
+    if camera is None:
         raise HTTPException(status_code=404, detail='Camera not found')
-    if new_name:
-        cameras[user_id][camera_index]['name'] = new_name
-    if new_rtsp_url:
-        cameras[user_id][camera_index]['rtsp_url'] = new_rtsp_url
-    save_cameras(cameras)
-    return {'success': True, 'camera': cameras[user_id][camera_index]}
+    changes = {}
+    if data.get('cameraName'):
+        changes['name'] = data['cameraName']
+    if data.get('rtspUrl'):
+        changes['rtsp_url'] = data['rtspUrl']
+    if isinstance(data.get('motion'), dict):
+        changes['motion'] = data['motion']
+    camera = store.update_camera(user_id, camera['id'], **changes)
+    return {'success': True, 'camera': camera}
 
 @app.get('/cctv/cameras/{user_id}')
 async def get_cameras(user_id: str):
-    cameras = load_cameras()
-    user_cameras = cameras.get(user_id, [])
+    user_cameras = store.list_cameras(user_id)
     return {
         'success': True,
         'cameras': user_cameras,
@@ -234,397 +1497,3062 @@ async def get_cameras(user_id: str):
     }
 
 @app.delete('/cctv/remove-camera')
-async def remove_camera(user_id: str, camera_index: int):
-    cameras = load_cameras()
-    if user_id not in cameras or camera_index >= len(cameras[user_id]):
+async def remove_camera(user_id: str, camera_index: Optional[int] = None, camera_id: Optional[str] = None):
+    _, camera = store.find_camera(user_id, camera_index, camera_id)
+    if camera is None:
         raise HTTPException(status_code=404, detail='Camera not found')
-    removed_camera = cameras[user_id].pop(camera_index)
-    save_cameras(cameras)
+    removed_camera = store.remove_camera(user_id, camera['id'])
+    # Stop whatever still runs for it, so nothing keeps alerting under a removed camera
+    monitor_supervisor.stop(user_id, camera['id'])
+    recording_manager.stop(user_id, camera['id'])
+    broadcast_hub.close(user_id, camera['id'])
+    session = profiler_sessions.pop((user_id, camera['id']), None)
+    if session is not None:
+        session.stop()
+    forget_camera_metrics((user_id, camera['id']))
     return {
         'success': True,
         'message': f'Camera "{removed_camera["name"]}" removed successfully',
         'removed_camera': removed_camera
     }
 
-AI_API_URL = os.environ.get('AI_API_URL', 'http://localhost:8000')
-
-monitoring_threads = {}  # {user_id: {camera_index: thread}}
-accident_videos = {}  # {user_id: [accident_video_data]}
-
-def save_accident_clip(user_id, camera_name, frames_buffer, accident_time):
-    """Save accident video clip (±5 seconds around incident)"""
-    try:
-        os.makedirs('accident_clips', exist_ok=True)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'accident_{user_id}_{camera_name}_{timestamp}.avi'
-        filepath = f'accident_clips/{filename}'
-        
-        # Save video clip
-        fourcc = cv2.VideoWriter_fourcc(*'XVID')
-        out = cv2.VideoWriter(filepath, fourcc, 20.0, (640, 480))
-        
-        for frame in frames_buffer:
-            out.write(frame)
-        out.release()
-        
-        # Store accident video info
-        if user_id not in accident_videos:
-            accident_videos[user_id] = []
-        
-        accident_info = {
-            'filename': filename,
-            'filepath': filepath,
-            'camera_name': camera_name,
-            'accident_time': accident_time,
-            'created': int(time.time()),
-            'duration': len(frames_buffer) / 20.0  # assuming 20 FPS
-        }
-        accident_videos[user_id].append(accident_info)
-        
-        print(f"✅ Accident clip saved: {filepath}")
-        return accident_info
-    except Exception as e:
-        print(f"❌ Error saving accident clip: {e}")
-        return None
+# ========== Shared Camera Capture ==========
+MAX_CAPTURE_DECODERS = int(os.environ.get('MAX_CAPTURE_DECODERS', '64'))
+RECONNECT_BACKOFF_BASE = float(os.environ.get('RECONNECT_BACKOFF_BASE', '1'))
+RECONNECT_BACKOFF_MAX = float(os.environ.get('RECONNECT_BACKOFF_MAX', '60'))
 
-def continuous_monitor_camera(user_id, camera_index, camera_info):
-    """Continuously monitor camera for fall detection"""
-    camera_name = camera_info['name']
-    rtsp_url = camera_info.get('rtsp_url', '')
-    
-    print(f"🔍 Starting continuous monitoring for {camera_name} (User: {user_id})")
-    
-    # Frame buffer for accident clips (±5 seconds = ~100 frames at 10 FPS)
-    frames_buffer = []
-    buffer_size = 100
-    
-    try:
-        if rtsp_url.startswith('rtsp://'):
-            video = cv2.VideoCapture(rtsp_url)
-            video.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-        else:
-            video = cv2.VideoCapture(int(rtsp_url) if rtsp_url.isdigit() else 0)
-        
-        if not video.isOpened():
-            print(f"❌ Cannot open camera: {camera_name}")
-            return
-        
-        video.set(3, 640)
-        video.set(4, 480)
-        
-        frame_count = 0
-        check_interval = 10  # Check every 10 frames for better performance
-        
-        while True:
-            ret, frame = video.read()
-            if not ret:
-                print(f"⚠️ Lost connection to camera: {camera_name}")
-                time.sleep(5)  # Wait before retry
-                continue
-            
-            # Add frame to buffer
-            frames_buffer.append(frame.copy())
-            if len(frames_buffer) > buffer_size:
-                frames_buffer.pop(0)
-            
-            # Check for fall detection
-            if frame_count % check_interval == 0 and model is not None:
-                try:
-                    # Convert frame to PIL Image
-                    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    pil_image = Image.fromarray(frame_rgb)
-                    
-                    # Transform and predict
-                    input_tensor = transform_image(pil_image).unsqueeze(0)
-                    with torch.no_grad():
-                        outputs = model(input_tensor)
-                        _, predicted = torch.max(outputs, 1)
-                        confidence = torch.nn.functional.softmax(outputs, dim=1)[0]
-                        
-                        # If fall detected (class 1) with high confidence
-                        if predicted.item() == 1 and confidence[1].item() > 0.7:
-                            accident_time = datetime.now()
-                            print(f"🚨 FALL DETECTED! Camera: {camera_name}, User: {user_id}, Confidence: {confidence[1].item():.2f}")
-                            
-                            # Save accident clip
-                            accident_info = save_accident_clip(user_id, camera_name, frames_buffer.copy(), accident_time)
-                            
-                            # Send alert to user
-                            alert_message = f"🚨 Fall detected in {camera_name} at {accident_time.strftime('%H:%M:%S')}!"
-                            asyncio.run(send_alert_to_user(user_id, alert_message))
-                            
-                            # Wait before next detection to avoid spam
-                            time.sleep(10)
-                            
-                except Exception as e:
-                    print(f"❌ Error in fall detection: {e}")
-            
-            frame_count += 1
-            time.sleep(0.1)  # 10 FPS monitoring
-            
-    except Exception as e:
-        print(f"❌ Error in continuous monitoring: {e}")
-    finally:
-        if 'video' in locals():
-            video.release()
-        print(f"🔚 Stopped monitoring camera: {camera_name}")
+class CaptureLimitError(RuntimeError):
+    pass
 
-def record_camera(camera_info, user_id):
-    camera_name = camera_info['name']
-    rtsp_url = camera_info['rtsp_url']
-    print(f"Starting recording for: {camera_name}")
-    print(f"RTSP URL: {rtsp_url}")
-    os.makedirs('footages', exist_ok=True)
-    if rtsp_url.startswith('rtsp://'):
+def open_video_capture(rtsp_url):
+    """Open a cv2.VideoCapture for an RTSP/HTTP URL, a video file or a local device index"""
+    if '://' in rtsp_url or os.path.isfile(rtsp_url):
         video = cv2.VideoCapture(rtsp_url)
         video.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-        video.set(cv2.CAP_PROP_FPS, 10)
     else:
         video = cv2.VideoCapture(int(rtsp_url) if rtsp_url.isdigit() else 0)
-    if not video.isOpened():
-        print(f"Cannot open camera: {camera_name}")
-        return
-    video.set(3, 640)
-    video.set(4, 480)
-    date_time = time.strftime(f"{camera_name}_%H-%M-%d_%m_%y")
-    output_path = f'footages/{user_id}_{date_time}.avi'
-    output = cv2.VideoWriter(output_path, 0, 20.0, (640, 480))
-    print(f"Recording to: {output_path}")
-    frame_count = 0
-    max_frames = 3000
-    notify_interval = 30
-    while video.isOpened() and frame_count < max_frames:
-        ret, frame = video.read()
-        if not ret:
-            break
-        output.write(frame)
-        # Fall detection & notification
-        if frame_count % notify_interval == 0:
-            try:
-                _, buffer = cv2.imencode('.jpg', frame)
-                frame_bytes = buffer.tobytes()
-                files = {'file': ('frame.jpg', frame_bytes, 'image/jpeg')}
-                response = requests.post(f"{AI_API_URL}/predict", files=files, timeout=5)
-                if response.status_code == 200:
-                    result = response.json()
-                    if result.get("fall_detected"):
-                        print(f"[ALERT] Fall detected for user {user_id}")
-                        asyncio.run(send_alert_to_user(user_id, "Fall detected!"))
-            except Exception as e:
-                print(f"[notify_fall] Error: {e}")
-        frame_count += 1
-        time.sleep(0.05)
-    video.release()
-    output.release()
-    print(f"Recording finished: {output_path}")
+    if video.isOpened():
+        video.set(3, 640)
+        video.set(4, 480)
+    return video
+
+class CameraCapture:
+    """Decode one camera stream on a reader thread and publish the latest frame"""
+
+    def __init__(self, key, rtsp_url):
+        self.key = key  # (user_id, camera_id)
+        self.rtsp_url = rtsp_url
+        self.consumers = 0
+        self.is_open = False
+        self.frame = None
+        self.seq = 0
+        self.frame_time = 0.0
+        self.reconnects = 0
+        self.opened = threading.Event()
+        self._stop = threading.Event()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def wait_opened(self, timeout=15):
+        """Block until the first open attempt finishes, returns whether it succeeded"""
+        self.opened.wait(timeout)
+        return self.is_open
+
+    def read(self, last_seq=0, timeout=5):
+        """Wait for a frame newer than last_seq, returns (seq, frame) or (last_seq, None)
+
+        Frames are shared between consumers and must not be modified in place.
+        """
+        return self.read_timed(last_seq, timeout)[:2]
+
+    def read_timed(self, last_seq=0, timeout=5):
+        """Like read() but also returns the frame's capture time: (seq, frame, frame_time)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq != last_seq or self._stop.is_set(), timeout)
+            if self.seq == last_seq or self.frame is None:
+                return last_seq, None, None
+            return self.seq, self.frame, self.frame_time
+
+    def _run(self):
+        video = None
+        backoff = RECONNECT_BACKOFF_BASE
+        label = camera_label(self.key)
+        try:
+            while not self._stop.is_set():
+                if video is None:
+                    video = open_video_capture(self.rtsp_url)
+                    self.is_open = video.isOpened()
+                    self.opened.set()
+                    if not self.is_open:
+                        video.release()
+                        video = None
+                        self._stop.wait(backoff)
+                        backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+                        continue
+                with metrics.time('capture_read', label):
+                    ret, frame = video.read()
+                if not ret:
+                    log.warning('capture_lost', f"⚠️ Lost connection to camera stream, reconnecting in {backoff:.0f}s",
+                                user_id=self.key[0], camera=self.key[1], backoff=round(backoff, 1))
+                    video.release()
+                    video = None
+                    self.is_open = False
+                    self.reconnects += 1
+                    self._stop.wait(backoff)  # Wait before reconnecting
+                    backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+                    continue
+                backoff = RECONNECT_BACKOFF_BASE
+                with self._cond:
+                    self.frame = frame
+                    self.seq += 1
+                    self.frame_time = time.time()
+                    self._cond.notify_all()
+        finally:
+            if video is not None:
+                video.release()
+            self.is_open = False
+            self.opened.set()
+            with self._cond:
+                self._cond.notify_all()
+            log.info('capture_closed', "🔚 Closed camera stream", user_id=self.key[0], camera=self.key[1])
+            forget_camera_metrics(self.key)
+
+class CaptureHub:
+    """Reference-counted registry of CameraCapture keyed by (user_id, camera_id)"""
+
+    def __init__(self):
+        self._captures = {}
+        self._lock = threading.Lock()
+
+    def has_capacity(self, user_id, camera_id, rtsp_url):
+        """Whether acquire() would succeed without exceeding MAX_CAPTURE_DECODERS"""
+        with self._lock:
+            capture = self._captures.get((user_id, camera_id))
+            if capture is not None and capture.rtsp_url == rtsp_url:
+                return True
+            return len(self._captures) < MAX_CAPTURE_DECODERS
+
+    def acquire(self, user_id, camera_id, rtsp_url):
+        key = (user_id, camera_id)
+        with self._lock:
+            capture = self._captures.get(key)
+            if capture is None or capture.rtsp_url != rtsp_url:
+                if len(self._captures) >= MAX_CAPTURE_DECODERS:
+                    raise CaptureLimitError(f'Decoder limit reached ({MAX_CAPTURE_DECODERS} cameras)')
+                # A changed URL gets a fresh capture, the old one closes with its last consumer
+                if rtsp_url.startswith(RELAY_URL_PREFIX):
+                    capture = RelayCapture(key, rtsp_url)
+                else:
+                    capture = CameraCapture(key, rtsp_url)
+                self._captures[key] = capture
+                capture.start()
+            capture.consumers += 1
+        return capture
+
+    def release(self, capture):
+        with self._lock:
+            capture.consumers -= 1
+            if capture.consumers > 0:
+                return
+            if self._captures.get(capture.key) is capture:
+                del self._captures[capture.key]
+        capture.stop()
+
+    def stats(self):
+        with self._lock:
+            captures = list(self._captures.values())
+        return [
+            {
+                'user_id': c.key[0],
+                'camera_id': c.key[1],
+                'consumers': c.consumers,
+                'is_open': c.is_open,
+                'frames': c.seq,
+                'reconnects': c.reconnects
+            }
+            for c in captures
+        ]
+
+    def threads(self, key):
+        """[(role, thread)] working on a camera, for the sampling profiler"""
+        with self._lock:
+            capture = self._captures.get(key)
+        thread = getattr(capture, '_thread', None)  # relay captures have no reader thread
+        return [('capture', thread)] if thread is not None else []
+
+capture_hub = CaptureHub()
+
+# ========== Relay Ingest ==========
+RELAY_URL_PREFIX = 'relay://'
+RELAY_HISTORY_FRAMES = int(os.environ.get('RELAY_HISTORY_FRAMES', '30'))  # short JPEG history per camera
+RELAY_MAX_CAMERA_BYTES = int(os.environ.get('RELAY_MAX_CAMERA_BYTES', str(8 * 1024 ** 2)))
+RELAY_MAX_TOTAL_BYTES = int(os.environ.get('RELAY_MAX_TOTAL_BYTES', str(256 * 1024 ** 2)))
+RELAY_MAX_FRAME_BYTES = int(os.environ.get('RELAY_MAX_FRAME_BYTES', str(2 * 1024 ** 2)))
+RELAY_MAX_FPS = float(os.environ.get('RELAY_MAX_FPS', '15'))
+RELAY_STALE_SECONDS = float(os.environ.get('RELAY_STALE_SECONDS', '5'))  # no frames this long = disconnected
+RELAY_IDLE_TIMEOUT = float(os.environ.get('RELAY_IDLE_TIMEOUT', '120'))  # idle feeds are dropped after this
+
+def relay_url(user_id, camera_name):
+    return f'{RELAY_URL_PREFIX}{user_id}/{camera_name}'
+
+def camera_source(user_id, camera_info):
+    """Capture source of a camera: its RTSP URL, or its relay feed for pushed cameras"""
+    if camera_info.get('relay'):
+        return relay_url(user_id, camera_info['name'])
+    return camera_info.get('rtsp_url', '')
+
+class RelayFeed:
+    """Latest frame and short JPEG history of one camera pushed by an edge device"""
+
+    def __init__(self, key, lock):
+        self.key = key  # (user_id, camera_name)
+        self.history = deque()  # [(frame_time, jpeg_bytes)], oldest first, newest is the live frame
+        self.history_bytes = 0
+        self.seq = 0
+        self.frame_time = 0.0
+        self.last_active = time.time()
+        self.received = 0
+        self.dropped = 0  # over RELAY_MAX_FPS
+        self.rejected = 0  # not a JPEG or too large
+        self.connections = 0  # open push channels
+        self.readers = 0  # captures reading this feed
+        self.pacer = FramePacer(RELAY_MAX_FPS) if RELAY_MAX_FPS > 0 else None
+        self.cond = threading.Condition(lock)
+        self._decoded = (0, None)  # (seq, BGR frame), decoded once for all readers
+
+    @property
+    def live(self):
+        return self.seq > 0 and time.time() - self.frame_time < RELAY_STALE_SECONDS
+
+    def latest(self):
+        """(seq, frame_time, jpeg_bytes) of the newest frame; call with the store lock held"""
+        if not self.history:
+            return self.seq, None, None
+        frame_time, data = self.history[-1]
+        return self.seq, frame_time, data
+
+    def decode(self, seq, data):
+        cached_seq, frame = self._decoded
+        if cached_seq == seq:
+            return frame
+        frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        self._decoded = (seq, frame)
+        return frame
+
+class RelayStore:
+    """Bounded store of relay camera feeds
+
+    Each feed keeps at most RELAY_HISTORY_FRAMES JPEG frames and
+    RELAY_MAX_CAMERA_BYTES; when all feeds together exceed
+    RELAY_MAX_TOTAL_BYTES the oldest history of the largest feeds goes
+    first (the newest frame of a camera is always kept). Feeds without
+    frames, push channels or readers for RELAY_IDLE_TIMEOUT are dropped.
+    """
+
+    def __init__(self):
+        self._feeds = {}  # {(user_id, camera_name): RelayFeed}
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.evicted_frames = 0
+        self.evicted_feeds = 0
+        threading.Thread(target=self._sweep_loop, daemon=True).start()
+
+    def feed(self, user_id, camera_name):
+        key = (user_id, camera_name)
+        with self._lock:
+            feed = self._feeds.get(key)
+            if feed is None:
+                feed = self._feeds[key] = RelayFeed(key, self._lock)
+            feed.last_active = time.time()
+            return feed
+
+    def push(self, feed, data, frame_time=None):
+        """Store one pushed JPEG frame, returns 'ok', 'dropped' or 'rejected'"""
+        frame_time = frame_time or time.time()
+        if len(data) > RELAY_MAX_FRAME_BYTES or not data.startswith(b'\xff\xd8'):
+            feed.rejected += 1
+            return 'rejected'
+        with self._lock:
+            feed.last_active = frame_time
+            if feed.pacer is not None and not feed.pacer.take(frame_time):
+                feed.dropped += 1
+                return 'dropped'
+            feed.history.append((frame_time, data))
+            feed.history_bytes += len(data)
+            self.total_bytes += len(data)
+            feed.seq += 1
+            feed.received += 1
+            feed.frame_time = frame_time
+            while len(feed.history) > 1 and (len(feed.history) > RELAY_HISTORY_FRAMES
+                                             or feed.history_bytes > RELAY_MAX_CAMERA_BYTES):
+                self._pop_oldest(feed)
+            if self.total_bytes > RELAY_MAX_TOTAL_BYTES:
+                self._trim_total()
+            feed.cond.notify_all()
+        return 'ok'
+
+    def _pop_oldest(self, feed):
+        _, data = feed.history.popleft()
+        feed.history_bytes -= len(data)
+        self.total_bytes -= len(data)
+
+    def _trim_total(self):
+        while self.total_bytes > RELAY_MAX_TOTAL_BYTES:
+            feed = max(self._feeds.values(), key=lambda f: f.history_bytes if len(f.history) > 1 else -1)
+            if len(feed.history) <= 1:
+                break
+            self._pop_oldest(feed)
+            self.evicted_frames += 1
+
+    def connect(self, feed):
+        with self._lock:
+            feed.connections += 1
+
+    def disconnect(self, feed):
+        with self._lock:
+            feed.connections -= 1
+            feed.last_active = time.time()
+
+    def attach(self, feed):
+        with self._lock:
+            feed.readers += 1
+
+    def detach(self, feed):
+        with self._lock:
+            feed.readers -= 1
+            feed.last_active = time.time()
+            feed.cond.notify_all()
+
+    def latest(self, user_id, camera_name):
+        """Newest JPEG of a camera, or None"""
+        with self._lock:
+            feed = self._feeds.get((user_id, camera_name))
+            return feed.latest()[2] if feed is not None else None
+
+    def sweep(self):
+        now = time.time()
+        with self._lock:
+            idle = [key for key, feed in self._feeds.items()
+                    if not feed.connections and not feed.readers and now - feed.last_active > RELAY_IDLE_TIMEOUT]
+            for key in idle:
+                feed = self._feeds.pop(key)
+                self.total_bytes -= feed.history_bytes
+                self.evicted_feeds += 1
+        return len(idle)
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(max(1.0, RELAY_IDLE_TIMEOUT / 4))
+            try:
+                self.sweep()
+            except Exception as e:
+                log.error('relay_sweep_failed', "❌ Relay sweep error", error=str(e))
+
+    def stats(self):
+        with self._lock:
+            feeds = list(self._feeds.values())
+            return {
+                'feeds': len(feeds),
+                'total_bytes': self.total_bytes,
+                'max_total_bytes': RELAY_MAX_TOTAL_BYTES,
+                'evicted_frames': self.evicted_frames,
+                'evicted_feeds': self.evicted_feeds,
+                'cameras': [
+                    {
+                        'user_id': f.key[0],
+                        'camera_name': f.key[1],
+                        'live': f.live,
+                        'connections': f.connections,
+                        'readers': f.readers,
+                        'history_frames': len(f.history),
+                        'history_bytes': f.history_bytes,
+                        'received': f.received,
+                        'dropped': f.dropped,
+                        'rejected': f.rejected
+                    }
+                    for f in feeds
+                ]
+            }
+
+relay_store = RelayStore()
+
+class RelayCapture:
+    """CameraCapture counterpart for relay cameras: reads pushed frames instead of a stream
+
+    Opening always succeeds; is_open reports whether the device is currently
+    pushing, so consumers see a relay that went quiet like a camera that is
+    reconnecting. Each frame is decoded once and shared between consumers.
+    """
+
+    def __init__(self, key, rtsp_url):
+        self.key = key  # (user_id, camera_id)
+        self.rtsp_url = rtsp_url
+        self.consumers = 0
+        self.reconnects = 0
+        user_id, _, camera_name = rtsp_url[len(RELAY_URL_PREFIX):].partition('/')
+        self.feed = relay_store.feed(user_id, camera_name)
+        self.opened = threading.Event()
+        self.opened.set()
+        self._stop = threading.Event()
+
+    @property
+    def is_open(self):
+        return self.feed.live
+
+    @property
+    def seq(self):
+        return self.feed.seq
+
+    def start(self):
+        relay_store.attach(self.feed)
+
+    def stop(self):
+        self._stop.set()
+        relay_store.detach(self.feed)
+
+    def wait_opened(self, timeout=15):
+        return True
+
+    def read(self, last_seq=0, timeout=5):
+        return self.read_timed(last_seq, timeout)[:2]
+
+    def read_timed(self, last_seq=0, timeout=5):
+        feed = self.feed
+        with feed.cond:
+            feed.cond.wait_for(lambda: feed.seq != last_seq or self._stop.is_set(), timeout)
+            seq, frame_time, data = feed.latest()
+        if seq == last_seq or data is None:
+            return last_seq, None, None
+        frame = feed.decode(seq, data)
+        if frame is None:
+            return last_seq, None, None
+        return seq, frame, frame_time
+
+def relay_camera(user_id, camera_name):
+    """The registered relay camera a device pushes to, or None"""
+    for camera_info in store.list_cameras(user_id):
+        if camera_info.get('relay') and camera_info.get('name') == camera_name:
+            return camera_info
+    return None
+
+@app.post('/relay/frame/{user_id}/{camera_name}')
+async def relay_frame(user_id: str, camera_name: str, file: UploadFile = File(...)):
+    """Push a single JPEG frame (prefer the /ws/relay channel for continuous streams)"""
+    if relay_camera(user_id, camera_name) is None:
+        raise HTTPException(status_code=404, detail='Relay camera not found')
+    frame_bytes = await file.read()
+    result = relay_store.push(relay_store.feed(user_id, camera_name), frame_bytes)
+    if result == 'rejected':
+        raise HTTPException(status_code=400, detail='Frame must be a JPEG image')
+    return {"success": True, "status": result}
+
+@app.websocket('/ws/relay/{user_id}/{camera_name}')
+async def relay_websocket(websocket: WebSocket, user_id: str, camera_name: str):
+    """Persistent push channel: every binary message is one JPEG frame
+
+    The server answers with an ack once per second ({type: 'ack', received,
+    dropped, rejected}) so a device can lower its frame rate when frames
+    are being dropped.
+    """
+    await websocket.accept()
+    if relay_camera(user_id, camera_name) is None:
+        await websocket.close(code=4404, reason='Relay camera not found')
+        return
+    feed = relay_store.feed(user_id, camera_name)
+    relay_store.connect(feed)
+    last_ack = time.time()
+    try:
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            data = message.get('bytes')
+            if data:
+                relay_store.push(feed, data)
+            now = time.time()
+            if now - last_ack >= 1.0:
+                last_ack = now
+                await websocket.send_json({'type': 'ack', 'received': feed.received,
+                                           'dropped': feed.dropped, 'rejected': feed.rejected})
+    except Exception:
+        pass
+    finally:
+        relay_store.disconnect(feed)
+
+@app.get('/relay/latest/{user_id}/{camera_name}')
+async def relay_latest(user_id: str, camera_name: str):
+    """Newest frame pushed by a relay camera"""
+    data = relay_store.latest(user_id, camera_name)
+    if data is None:
+        raise HTTPException(status_code=404, detail='No frames from this relay camera')
+    return Response(content=data, media_type='image/jpeg', headers={'Cache-Control': 'no-store'})
+
+# ========== Pre-incident Frame Buffer ==========
+FRAME_BUFFER_MODE = os.environ.get('FRAME_BUFFER_MODE', 'raw')  # raw | jpeg
+FRAME_BUFFER_JPEG_QUALITY = int(os.environ.get('FRAME_BUFFER_JPEG_QUALITY', '80'))
+
+class FrameRingBuffer:
+    """Fixed-size history of the most recent frames with O(1) writes
+
+    In raw mode frames live in one preallocated (N, H, W, 3) uint8 array, in
+    jpeg mode each slot holds the compressed bytes of a frame instead.
+    Iterating yields frames oldest first.
+    """
+
+    def __init__(self, capacity, mode=FRAME_BUFFER_MODE, jpeg_quality=FRAME_BUFFER_JPEG_QUALITY):
+        self.capacity = capacity
+        self.mode = mode if mode in ('raw', 'jpeg') else 'raw'
+        self.jpeg_quality = jpeg_quality
+        self.shape = None
+        self._frames = None  # raw: ndarray (N, H, W, 3), jpeg: [bytes]
+        self._times = np.zeros(capacity)  # capture time of each slot
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for part in self.ordered_views():
+            if self.mode == 'raw':
+                yield from part
+            else:
+                for data in part:
+                    yield cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+    def append(self, frame, frame_time=None):
+        with self._lock:
+            if self.shape is None:
+                self.shape = frame.shape
+                if self.mode == 'raw':
+                    self._frames = np.zeros((self.capacity,) + self.shape, dtype=np.uint8)
+                else:
+                    self._frames = [None] * self.capacity
+            if frame.shape != self.shape:
+                frame = cv2.resize(frame, (self.shape[1], self.shape[0]))
+            if self.mode == 'raw':
+                np.copyto(self._frames[self._next], frame)
+            else:
+                _, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+                self._frames[self._next] = jpeg.tobytes()
+            self._times[self._next] = time.time() if frame_time is None else frame_time
+            self._next = (self._next + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+
+    def ordered_views(self):
+        """Zero-copy (older, newer) slices of the buffer in chronological order"""
+        if self._count == 0:
+            return []
+        if self._count < self.capacity:
+            return [self._frames[:self._count]]
+        return [self._frames[self._next:], self._frames[:self._next]]
+
+    def snapshot(self):
+        """Copy of the buffered frames, safe to hand to another thread"""
+        with self._lock:
+            return self._copy()
+
+    def time_span(self):
+        """(oldest, newest) capture time of the buffered frames, None when empty"""
+        with self._lock:
+            return self._span()
+
+    def snapshot_with_span(self):
+        """(snapshot(), time_span()) taken under one lock, so the span matches the copied frames"""
+        with self._lock:
+            return self._copy(), self._span()
+
+    def _copy(self):
+        views = self.ordered_views()
+        if self.mode == 'raw':
+            if not views:
+                return np.zeros((0,) + (self.shape or (480, 640, 3)), dtype=np.uint8)
+            return np.concatenate(views)
+        return [data for part in views for data in part]
+
+    def _span(self):
+        if self._count == 0:
+            return None
+        oldest = self._times[0 if self._count < self.capacity else self._next]
+        return float(oldest), float(self._times[(self._next - 1) % self.capacity])
+
+    def memory_bytes(self):
+        if self._frames is None:
+            return 0
+        if self.mode == 'raw':
+            return self._frames.nbytes
+        return sum(len(data) for data in self._frames if data is not None)
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'frames': self._count,
+            'capacity': self.capacity,
+            'memory_bytes': self.memory_bytes()
+        }
+
+frame_buffers = {}  # {(user_id, camera_id): FrameRingBuffer}
+
+def frame_buffer_stats():
+    return [
+        dict(user_id=user_id, camera_id=camera_id, **buffer.stats())
+        for (user_id, camera_id), buffer in list(frame_buffers.items())
+    ]
+
+# ========== Motion Gating ==========
+MOTION_GATING = os.environ.get('MOTION_GATING', '1') == '1'
+MOTION_PIXEL_THRESHOLD = int(os.environ.get('MOTION_PIXEL_THRESHOLD', '25'))
+MOTION_MIN_AREA = float(os.environ.get('MOTION_MIN_AREA', '0.005'))  # fraction of ROI pixels
+MOTION_HOLD_SECONDS = float(os.environ.get('MOTION_HOLD_SECONDS', '3'))
+MOTION_BOOST_SECONDS = float(os.environ.get('MOTION_BOOST_SECONDS', '5'))
+MOTION_DOWNSCALE_WIDTH = 160
+
+class MotionGate:
+    """Cheap background-subtraction pre-filter deciding which frames reach the model
+
+    Per-camera settings come from camera_info['motion']: enabled,
+    pixel_threshold, min_area, hold_seconds, boost_seconds and roi, a list
+    of [x, y, w, h] rectangles as fractions of the frame.
+    """
+
+    def __init__(self, settings=None):
+        settings = settings or {}
+        self.enabled = settings.get('enabled', MOTION_GATING)
+        self.pixel_threshold = settings.get('pixel_threshold', MOTION_PIXEL_THRESHOLD)
+        self.min_area = settings.get('min_area', MOTION_MIN_AREA)
+        self.hold_seconds = settings.get('hold_seconds', MOTION_HOLD_SECONDS)
+        self.boost_seconds = settings.get('boost_seconds', MOTION_BOOST_SECONDS)
+        self.roi = settings.get('roi') or []
+        self.foreground = ForegroundModel(MOTION_DOWNSCALE_WIDTH, self.pixel_threshold)
+        self._mask = None
+        self.motion_score = 0.0
+        self.last_motion = 0.0
+        self.motion_started = 0.0
+        self.frames_seen = 0
+        self.frames_gated = 0
+        self.frames_inferred = 0
+
+    def _build_mask(self, shape):
+        if not self.roi:
+            return None
+        h, w = shape
+        mask = np.zeros(shape, dtype=bool)
+        for x, y, rw, rh in self.roi:
+            mask[int(y * h):int((y + rh) * h), int(x * w):int((x + rw) * w)] = True
+        return mask if mask.any() else None
+
+    def update(self, frame):
+        """Feed every captured frame, returns whether motion is currently active"""
+        self.frames_seen += 1
+        if not self.enabled:
+            return True
+        changed = self.foreground.apply(frame)
+        if changed is None:
+            # First frame counts as motion so a new camera gets checked right away
+            self._mask = self._build_mask(self.foreground.gray.shape)
+            self._mark_motion()
+            return True
+        if self._mask is not None:
+            self.motion_score = np.count_nonzero(changed & self._mask) / np.count_nonzero(self._mask)
+        else:
+            self.motion_score = np.count_nonzero(changed) / changed.size
+        if self.motion_score >= self.min_area:
+            self._mark_motion()
+        return self.active
+
+    def _mark_motion(self):
+        now = time.time()
+        if now - self.last_motion >= self.hold_seconds:
+            self.motion_started = now
+        self.last_motion = now
+
+    @property
+    def active(self):
+        return not self.enabled or time.time() - self.last_motion < self.hold_seconds
+
+    @property
+    def boosted(self):
+        """Sample faster for a short window after motion starts"""
+        return self.enabled and self.active and time.time() - self.motion_started < self.boost_seconds
+
+    def should_infer(self):
+        """Count a sampled frame as inferred or gated"""
+        if self.active:
+            self.frames_inferred += 1
+            return True
+        self.frames_gated += 1
+        return False
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'active': self.active,
+            'boosted': self.boosted,
+            'motion_score': round(float(self.motion_score), 4),
+            'frames_seen': self.frames_seen,
+            'frames_gated': self.frames_gated,
+            'frames_inferred': self.frames_inferred
+        }
+
+motion_gates = {}  # {(user_id, camera_id): MotionGate}
+
+def motion_gate_stats():
+    return [
+        dict(user_id=user_id, camera_id=camera_id, **gate.stats())
+        for (user_id, camera_id), gate in list(motion_gates.items())
+    ]
+
+# ========== Fall Tracking ==========
+# Falls are decided per person track from box geometry over a sliding window
+# (see fall_tracking.py) instead of from one frame's classifier score. With
+# TRACKING_ENABLED=0, or when a detector frame has no boxes at all (no
+# detection model and motion gating off), the frame-level rule applies.
+# Recorders and live streams of unmonitored cameras apply the same rule
+# through FallCheck.
+TRACKING_ENABLED = os.environ.get('TRACKING_ENABLED', '1') == '1'
+
+fall_trackers = {}  # {(user_id, camera_id): FallTracker}
+
+def fall_tracker_stats():
+    return [
+        dict(user_id=user_id, camera_id=camera_id, **tracker.stats())
+        for (user_id, camera_id), tracker in list(fall_trackers.items())
+    ]
+
+# ========== Adaptive Sampling ==========
+MONITOR_FPS = float(os.environ.get('MONITOR_FPS', '10'))
+RECORD_FPS = 20.0
+SAMPLING_MIN_INTERVAL = float(os.environ.get('SAMPLING_MIN_INTERVAL', '0.2'))  # alert tier, never degraded
+SAMPLING_ACTIVE_INTERVAL = float(os.environ.get('SAMPLING_ACTIVE_INTERVAL', '0.5'))
+SAMPLING_IDLE_INTERVAL = float(os.environ.get('SAMPLING_IDLE_INTERVAL', '2'))
+SAMPLING_IDLE_MAX_INTERVAL = float(os.environ.get('SAMPLING_IDLE_MAX_INTERVAL', '10'))
+SAMPLING_ALERT_CONFIDENCE = float(os.environ.get('SAMPLING_ALERT_CONFIDENCE', '0.4'))
+SAMPLING_ALERT_HOLD_SECONDS = float(os.environ.get('SAMPLING_ALERT_HOLD_SECONDS', '5'))
+DETECTION_LATENCY_SLO = float(os.environ.get('DETECTION_LATENCY_SLO', '2'))  # fall-to-alert, seconds
+SAMPLING_LATENCY_BUDGET = 0.5  # share of the SLO that frame-to-result latency may use
+
+class FramePacer:
+    """Pick frames by capture timestamp to hit a target rate instead of sleeping"""
+
+    def __init__(self, fps, max_gap=1.0):
+        self.interval = 1.0 / fps
+        self.max_gap = max_gap
+        self.next_time = None
+
+    def take(self, frame_time):
+        """Number of output slots this frame fills, 0 means skip it"""
+        if self.next_time is None or frame_time - self.next_time > self.max_gap:
+            # First frame or after a stall/reconnect: restart the clock
+            self.next_time = frame_time + self.interval
+            return 1
+        if frame_time < self.next_time:
+            return 0
+        slots = int((frame_time - self.next_time) / self.interval) + 1
+        self.next_time += slots * self.interval
+        return slots
+
+class CameraSampler:
+    """Inference sampling state of one camera"""
+
+    def __init__(self, key):
+        self.key = key
+        self.consumers = set()
+        self.last_sample = 0.0
+        self.alert_until = 0.0
+        self.last_confidence = 0.0
+        self.samples = 0
+        self.slo_misses = 0
+        self.latencies = deque(maxlen=100)
+
+class SamplingScheduler:
+    """Decide which frames of each camera go to the detector
+
+    Each camera gets a sampling interval from its tier: alert (a recent
+    suspicious score or motion onset), active (motion) or idle (no motion
+    or no motion information). Frame-to-result latency is compared with
+    the SLO budget every second; over budget the idle interval is stretched
+    first, then the active one, never past what the SLO allows. Alert
+    cameras keep SAMPLING_MIN_INTERVAL. Only one consumer per camera samples,
+    the monitor first, then the recorder, then the live stream.
+    """
+    CONSUMER_PRIORITY = {'monitor': 0, 'record': 1, 'stream': 2}
+
+    def __init__(self):
+        self._cameras = {}  # {(user_id, camera_id): CameraSampler}
+        self._lock = threading.Lock()
+        self._window = []  # frame-to-result latencies since the last rebalance
+        self.pressure = 1.0
+        self.latency_p95 = 0.0
+        self.intervals = {'alert': SAMPLING_MIN_INTERVAL, 'active': SAMPLING_ACTIVE_INTERVAL,
+                          'idle': SAMPLING_IDLE_INTERVAL}
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def register(self, key, consumer):
+        with self._lock:
+            self._cameras.setdefault(key, CameraSampler(key)).consumers.add(consumer)
+
+    def unregister(self, key, consumer):
+        with self._lock:
+            camera = self._cameras.get(key)
+            if camera is None:
+                return
+            camera.consumers.discard(consumer)
+            if not camera.consumers:
+                del self._cameras[key]
+
+    def _tier(self, camera, now):
+        gate = motion_gates.get(camera.key)
+        if now < camera.alert_until or (gate is not None and gate.boosted):
+            return 'alert'
+        if gate is not None and gate.active:
+            return 'active'
+        return 'idle'
+
+    def _owner(self, camera):
+        return min(camera.consumers, key=self.CONSUMER_PRIORITY.get)
+
+    def owns(self, key, consumer):
+        """Whether this consumer is the one sampling the camera"""
+        with self._lock:
+            camera = self._cameras.get(key)
+            return camera is not None and consumer == self._owner(camera)
+
+    def due(self, key, consumer, frame_time):
+        """Whether this consumer should run detection on the frame captured at frame_time"""
+        with self._lock:
+            camera = self._cameras.get(key)
+            if camera is None or consumer != self._owner(camera):
+                return False
+            # Interval is re-read every time so a tier change applies right away
+            if frame_time - camera.last_sample < self.intervals[self._tier(camera, time.time())]:
+                return False
+            camera.last_sample = frame_time
+            camera.samples += 1
+            return True
+
+    def record(self, key, frame_time, result=None):
+        """Report a finished detection for the frame captured at frame_time"""
+        now = time.time()
+        latency = now - frame_time
+        with self._lock:
+            self._window.append(latency)
+            camera = self._cameras.get(key)
+            if camera is None:
+                return
+            camera.latencies.append(latency)
+            if latency + self.intervals[self._tier(camera, now)] > DETECTION_LATENCY_SLO:
+                camera.slo_misses += 1
+            if result is not None:
+                camera.last_confidence = result.get('fall_confidence', 0.0)
+                if camera.last_confidence >= SAMPLING_ALERT_CONFIDENCE:
+                    camera.alert_until = now + SAMPLING_ALERT_HOLD_SECONDS
+
+    def _run(self):
+        while True:
+            time.sleep(1)
+            self.rebalance()
+
+    def rebalance(self):
+        """Adjust tier intervals from the last second's frame-to-result latency"""
+        with self._lock:
+            window, self._window = self._window, []
+            budget = DETECTION_LATENCY_SLO * SAMPLING_LATENCY_BUDGET
+            if window:
+                self.latency_p95 = float(np.percentile(window, 95))
+            if window and self.latency_p95 > budget:
+                self.pressure = min(self.pressure * 1.5, 100.0)
+            elif not window or self.latency_p95 < budget / 2:
+                self.pressure = max(1.0, self.pressure * 0.8)
+            # Stretch idle cameras first, whatever pressure is left goes to active ones
+            idle_scale = min(self.pressure, SAMPLING_IDLE_MAX_INTERVAL / SAMPLING_IDLE_INTERVAL)
+            active_limit = max(SAMPLING_MIN_INTERVAL, DETECTION_LATENCY_SLO - self.latency_p95)
+            self.intervals = {
+                'alert': SAMPLING_MIN_INTERVAL,
+                'active': min(SAMPLING_ACTIVE_INTERVAL * self.pressure / idle_scale, active_limit),
+                'idle': SAMPLING_IDLE_INTERVAL * idle_scale
+            }
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            cameras = []
+            for camera in self._cameras.values():
+                tier = self._tier(camera, now)
+                p95 = float(np.percentile(camera.latencies, 95)) if camera.latencies else None
+                cameras.append({
+                    'user_id': camera.key[0],
+                    'camera_id': camera.key[1],
+                    'sampler': min(camera.consumers, key=self.CONSUMER_PRIORITY.get),
+                    'tier': tier,
+                    'interval': round(self.intervals[tier], 3),
+                    'samples': camera.samples,
+                    'last_confidence': camera.last_confidence,
+                    'latency_p95': round(p95, 3) if p95 is not None else None,
+                    'worst_case_alert_seconds': round(self.intervals[tier] + p95, 3) if p95 is not None else None,
+                    'slo_misses': camera.slo_misses
+                })
+            return {
+                'slo_seconds': DETECTION_LATENCY_SLO,
+                'pressure': round(self.pressure, 2),
+                'latency_p95': round(self.latency_p95, 3),
+                'intervals': {tier: round(v, 3) for tier, v in self.intervals.items()},
+                'cameras': cameras
+            }
+
+sampling_scheduler = SamplingScheduler()
+
+def decode_clip_frame(frame):
+    """Clip frames are raw BGR arrays or JPEG bytes from a jpeg-mode buffer"""
+    if isinstance(frame, (bytes, bytearray)):
+        return cv2.imdecode(np.frombuffer(frame, np.uint8), cv2.IMREAD_COLOR)
+    return frame
+
+def accident_clip_filename(user_id, camera_name, accident_time):
+    return f"accident_{user_id}_{camera_name}_{accident_time.strftime('%Y%m%d_%H%M%S')}.avi"
+
+def save_accident_clip(user_id, camera_name, frames_buffer, accident_time, confidence=None, detection_index=None,
+                       fps=MONITOR_FPS):
+    """Save accident video clip (pre-roll from the buffer plus post-roll after the incident)
+
+    The frame at detection_index (the middle one by default) becomes the clip's preview.
+    fps is the rate the frames were sampled at, so the clip plays in real time.
+    """
+    try:
+        os.makedirs('accident_clips', exist_ok=True)
+        filename = accident_clip_filename(user_id, camera_name, accident_time)
+        filepath = f'accident_clips/{filename}'
+        
+        # Save video clip
+        fourcc = cv2.VideoWriter_fourcc(*'XVID')
+        out = None
+        frames_written = 0
+        for frame in frames_buffer:
+            frame = decode_clip_frame(frame)
+            if frame is None:
+                continue
+            if out is None:
+                size = (frame.shape[1], frame.shape[0])
+                out = cv2.VideoWriter(filepath, fourcc, fps, size)
+            elif (frame.shape[1], frame.shape[0]) != size:
+                frame = cv2.resize(frame, size)
+            out.write(frame)
+            frames_written += 1
+        if out is None:
+            log.warning('clip_empty', "⚠️ No frames to save for accident clip", user_id=user_id, camera_name=camera_name,
+                        path=filepath)
+            return None
+        out.release()
+        if detection_index is None:
+            detection_index = len(frames_buffer) // 2
+        thumbnail = thumbnail_cache.put(frames_buffer[min(detection_index, len(frames_buffer) - 1)])
+        
+        # Store accident video info
+        accident_info = {
+            'filename': filename,
+            'filepath': filepath,
+            'camera_name': camera_name,
+            'accident_time': accident_time.isoformat(),
+            'created': int(time.time()),
+            'duration': round(frames_written / fps, 2),
+            'confidence': confidence
+        }
+        media_index.add('accident', user_id, thumbnail=thumbnail, **accident_info)
+        media_transcoder.prefetch(filepath)
+        
+        log.info('clip_saved', "✅ Accident clip saved", user_id=user_id, camera_name=camera_name, path=filepath,
+                 frames=frames_written)
+        return accident_info
+    except Exception as e:
+        log.error('clip_failed', "❌ Error saving accident clip", user_id=user_id, camera_name=camera_name, error=str(e))
+        return None
+
+# ========== Accident Clip Writer ==========
+CLIP_POST_ROLL_FRAMES = int(os.environ.get('CLIP_POST_ROLL_FRAMES', '50'))  # ~5 s at MONITOR_FPS 10
+CLIP_WRITER_WORKERS = int(os.environ.get('CLIP_WRITER_WORKERS', '2'))
+CLIP_QUEUE_SIZE = int(os.environ.get('CLIP_QUEUE_SIZE', '8'))
+CLIP_QUEUE_POLICY = os.environ.get('CLIP_QUEUE_POLICY', 'drop')  # drop | block
+DETECTION_COOLDOWN = float(os.environ.get('DETECTION_COOLDOWN', '10'))
+
+class PendingClip:
+    """Pre-roll snapshot that keeps collecting post-roll frames from the live stream"""
+
+    def __init__(self, user_id, camera_name, pre_roll, accident_time, confidence=None,
+                 post_roll_frames=CLIP_POST_ROLL_FRAMES, camera_id=None, time_span=None):
+        self.user_id = user_id
+        self.camera_name = camera_name
+        self.camera_id = camera_id
+        self.accident_time = accident_time
+        self.confidence = confidence
+        self.frames = list(pre_roll)
+        self.detection_index = max(0, len(self.frames) - 1)  # newest pre-roll frame is the one detected on
+        self.post_roll_remaining = post_roll_frames
+        self.first_time, self.last_time = time_span or (None, None)  # capture times of the first and last frame
+
+    @property
+    def complete(self):
+        return self.post_roll_remaining <= 0
+
+    @property
+    def fps(self):
+        """Rate the frames were sampled at, from their capture times"""
+        if self.first_time is None or self.last_time <= self.first_time or len(self.frames) < 2:
+            return MONITOR_FPS
+        return (len(self.frames) - 1) / (self.last_time - self.first_time)
+
+    def add_frame(self, frame, frame_time=None):
+        # Frames from the capture hub are never modified, so keep a reference
+        self.frames.append(frame)
+        self.post_roll_remaining -= 1
+        self.last_time = time.time() if frame_time is None else frame_time
+        if self.first_time is None:
+            self.first_time = self.last_time
+
+class ClipWriterPool:
+    """Encode accident clips on background threads off the capture loop"""
+
+    def __init__(self, workers=CLIP_WRITER_WORKERS, queue_size=CLIP_QUEUE_SIZE, policy=CLIP_QUEUE_POLICY):
+        self.policy = policy
+        self._queue = queue.Queue(maxsize=queue_size)
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._run, daemon=True)
+            for _ in range(max(1, workers))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, clip):
+        """Queue a finished clip for encoding, returns False if it was dropped"""
+        try:
+            if self.policy == 'block':
+                self._queue.put(clip)
+            else:
+                self._queue.put_nowait(clip)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            log.warning('clip_dropped', "⚠️ Clip writer queue full, dropped clip", user_id=clip.user_id,
+                        camera_name=clip.camera_name)
+            return False
+
+    def _run(self):
+        while True:
+            clip = self._queue.get()
+            try:
+                with metrics.time('clip_write', camera_label((clip.user_id, clip.camera_id))):
+                    info = save_accident_clip(clip.user_id, clip.camera_name, clip.frames, clip.accident_time,
+                                              clip.confidence, clip.detection_index, clip.fps)
+                with self._lock:
+                    if info:
+                        self.written += 1
+                    else:
+                        self.failed += 1
+                if info:
+                    alert_hub.publish(clip.user_id, {
+                        'type': 'clip_ready',
+                        'message': f"Accident clip from {clip.camera_name} is ready",
+                        'camera_name': clip.camera_name,
+                        'clip': {'filename': info['filename'], 'url': f"/accident-video-file/{info['filename']}",
+                                 'status': 'ready', 'duration': info['duration']}
+                    })
+            finally:
+                clip.frames = None
+                self._queue.task_done()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'queue_size': self._queue.maxsize,
+                'policy': self.policy,
+                'written': self.written,
+                'failed': self.failed,
+                'dropped': self.dropped
+            }
+
+clip_writer = ClipWriterPool()
+
+class FallCheck:
+    """The monitor's fall rule for the recorder and live stream of a camera
+
+    These only sample a camera nobody monitors (see SamplingScheduler), and
+    then keep their own foreground model and FallTracker, registered in
+    fall_trackers like the monitor's. Detector frames, the frame-level
+    fallback and the alert cooldown follow continuous_monitor_camera.
+    """
+
+    def __init__(self, key, consumer):
+        self.key = key  # (user_id, camera_id)
+        self.consumer = consumer
+        self.foreground = ForegroundModel(MOTION_DOWNSCALE_WIDTH)
+        self.tracker = FallTracker() if TRACKING_ENABLED else None
+        self.cooldown_until = 0.0
+
+    def update(self, frame, frame_time):
+        """Feed one paced frame, returns (fall, tracks) when an alert is due, else None
+
+        fall is the state of the track that fell, or {'score': ...} from the
+        frame-level rule; tracks is every track's state, None without tracking.
+        Detector errors propagate to the caller.
+        """
+        if not sampling_scheduler.owns(self.key, self.consumer):
+            self.reset()  # the monitor or the recorder has the camera
+            return None
+        tracker = self.tracker
+        if tracker is not None:
+            fall_trackers.setdefault(self.key, tracker)
+            self.foreground.apply(frame)
+        detections = confidence = result = None
+        if (time.time() >= self.cooldown_until and detector.ready()
+                and (tracker is None or tracker.needs_detection(frame_time))
+                and sampling_scheduler.due(self.key, self.consumer, frame_time)):
+            result = detector.detect(frame, self.key)
+            sampling_scheduler.record(self.key, frame_time, result)
+            detections = result.get('persons')
+            if detections is None and tracker is not None and self.foreground.presence is not None:
+                detections = boxes_from_mask(self.foreground.presence)
+                confidence = result.get('fall_confidence')
+        fall = None
+        if tracker is not None:
+            with metrics.time('track', camera_label(self.key)):
+                fallen = tracker.update(frame_time, frame.shape, self.foreground.gray, detections, confidence)
+            if fallen and time.time() >= self.cooldown_until:
+                fall = fallen[0].state_dict(frame_time, tracker.frame_size)
+        if (fall is None and result is not None and detections is None
+                and result.get("fall_detected") and result.get("fall_confidence", 0) > 0.7):
+            fall = {'score': result['fall_confidence']}
+        if fall is None:
+            return None
+        self.cooldown_until = time.time() + DETECTION_COOLDOWN
+        return fall, tracker.states(frame_time) if tracker is not None else None
+
+    def reset(self):
+        """Drop tracks and foreground, they go stale while another consumer samples"""
+        if self.tracker is None:
+            return
+        if fall_trackers.get(self.key) is self.tracker:
+            del fall_trackers[self.key]
+        if self.tracker.frames:
+            self.tracker = FallTracker()
+            self.foreground = ForegroundModel(MOTION_DOWNSCALE_WIDTH)
+
+def continuous_monitor_camera(user_id, camera_info, worker=None):
+    """Continuously monitor camera for fall detection until worker.stop_event is set"""
+    worker = worker or MonitorWorker(user_id, camera_info)
+    camera_id = camera_info['id']
+    camera_name = camera_info['name']
+    rtsp_url = camera_source(user_id, camera_info)
+    
+    log.info('monitor_started', "🔍 Starting continuous monitoring", user_id=user_id, camera=camera_id,
+             camera_name=camera_name)
+    
+    # Pre-roll buffer for accident clips (~100 frames at 10 FPS)
+    buffer_size = 100
+    frames_buffer = FrameRingBuffer(buffer_size)
+    frame_buffers[(user_id, camera_id)] = frames_buffer
+    pending_clips = []  # [PendingClip] still collecting post-roll frames
+    motion_gate = MotionGate(camera_info.get('motion'))
+    motion_gates[(user_id, camera_id)] = motion_gate
+    tracker = FallTracker() if TRACKING_ENABLED else None
+    if tracker is not None:
+        fall_trackers[(user_id, camera_id)] = tracker
+    sampling_scheduler.register((user_id, camera_id), 'monitor')
+    label = camera_label((user_id, camera_id))
+    
+    capture = None
+    try:
+        capture = capture_hub.acquire(user_id, camera_id, rtsp_url)
+        if not capture.wait_opened():
+            log.error('camera_open_failed', "❌ Cannot open camera", user_id=user_id, camera=camera_id,
+                      camera_name=camera_name)
+            worker.last_error = 'Cannot open camera'
+            return
+        
+        pacer = FramePacer(MONITOR_FPS)  # 10 FPS monitoring, paced by capture time
+        seq = 0
+        cooldown_until = 0.0
+        worker.state = 'running'
+        
+        while not worker.stop_event.is_set():
+            seq, frame, frame_time = capture.read_timed(seq)
+            if frame is None:
+                if worker.state != 'reconnecting':
+                    log.warning('monitor_reconnecting', "⚠️ Lost connection to camera", user_id=user_id, camera=camera_id,
+                                camera_name=camera_name)
+                    worker.last_error = 'Lost connection to camera'
+                worker.state = 'reconnecting'
+                continue
+            worker.state = 'running'
+            if not pacer.take(frame_time):
+                continue
+            worker.on_frame()
+            
+            # Feed post-roll frames to clips still being collected
+            for clip in pending_clips:
+                clip.add_frame(frame, frame_time)
+            for clip in [c for c in pending_clips if c.complete]:
+                pending_clips.remove(clip)
+                clip_writer.submit(clip)
+            
+            # Add frame to buffer
+            frames_buffer.append(frame, frame_time)
+            with metrics.time('motion', label):
+                motion_gate.update(frame)
+            
+            # Run the detector when the sampling scheduler says this camera is due and the tracker
+            # needs fresh boxes (skipped during the post-alert cooldown and on static scenes)
+            detections = None
+            confidence = None
+            result = None
+            if (time.time() >= cooldown_until and detector.ready()
+                    and (tracker is None or tracker.needs_detection(frame_time))
+                    and sampling_scheduler.due((user_id, camera_id), 'monitor', frame_time)
+                    and motion_gate.should_infer()):
+                try:
+                    result = detector.detect(frame, (user_id, camera_id))
+                    sampling_scheduler.record((user_id, camera_id), frame_time, result)
+                    detections = result.get('persons')
+                    if detections is None and tracker is not None and motion_gate.foreground.presence is not None:
+                        # Frame classifier: people come from the foreground, its score is extra evidence
+                        detections = boxes_from_mask(motion_gate.foreground.presence)
+                        confidence = result.get('fall_confidence')
+                except Exception as e:
+                    log.error('detection_failed', "❌ Error in fall detection", user_id=user_id, camera=camera_id, error=str(e))
+                    worker.last_error = f'Fall detection: {e}'
+            
+            fall = None
+            if tracker is not None:
+                with metrics.time('track', label):
+                    fallen = tracker.update(frame_time, frame.shape, motion_gate.foreground.gray, detections, confidence)
+                if fallen and time.time() >= cooldown_until:
+                    fall = fallen[0].state_dict(frame_time, tracker.frame_size)
+            if (fall is None and result is not None and detections is None
+                    and result.get("fall_detected") and result.get("fall_confidence", 0) > 0.7):
+                # Frame-level rule: class 1 with high confidence
+                fall = {'score': result['fall_confidence']}
+            
+            if fall is not None:
+                accident_time = datetime.now()
+                log.warning('fall_detected', "🚨 FALL DETECTED!", user_id=user_id, camera=camera_id,
+                            camera_name=camera_name, confidence=round(fall['score'], 2), track=fall.get('track_id'))
+                
+                # Start accident clip, encoded in the background once post-roll is collected
+                pre_roll, time_span = frames_buffer.snapshot_with_span()
+                pending_clips.append(PendingClip(user_id, camera_name, pre_roll, accident_time,
+                                                 fall['score'], camera_id=camera_id, time_span=time_span))
+                
+                # Send alert to user
+                alert_message = f"🚨 Fall detected in {camera_name} at {accident_time.strftime('%H:%M:%S')}!"
+                alert_hub.publish(user_id, fall_alert(
+                    user_id, camera_name, alert_message, camera_id, fall['score'],
+                    accident_time, accident_clip_filename(user_id, camera_name, accident_time),
+                    track=fall if 'track_id' in fall else None,
+                    tracks=tracker.states(frame_time) if tracker is not None else None))
+                
+                # Don't re-trigger for the same incident
+                cooldown_until = time.time() + DETECTION_COOLDOWN
+            
+    except Exception as e:
+        log.error('monitor_failed', "❌ Error in continuous monitoring", user_id=user_id, camera=camera_id,
+                  error=str(e))
+        worker.last_error = str(e)
+    finally:
+        # Flush clips with whatever post-roll was collected
+        for clip in pending_clips:
+            clip_writer.submit(clip)
+        if capture is not None:
+            capture_hub.release(capture)
+        sampling_scheduler.unregister((user_id, camera_id), 'monitor')
+        if frame_buffers.get((user_id, camera_id)) is frames_buffer:
+            del frame_buffers[(user_id, camera_id)]
+        if motion_gates.get((user_id, camera_id)) is motion_gate:
+            del motion_gates[(user_id, camera_id)]
+        if tracker is not None and fall_trackers.get((user_id, camera_id)) is tracker:
+            del fall_trackers[(user_id, camera_id)]
+        forget_camera_metrics((user_id, camera_id))
+        log.info('monitor_stopped', "🔚 Stopped monitoring camera", user_id=user_id, camera=camera_id,
+                 camera_name=camera_name)
+
+# ========== Monitoring Supervisor ==========
+MAX_MONITOR_WORKERS = int(os.environ.get('MAX_MONITOR_WORKERS', '64'))
+MONITOR_RESTART_BACKOFF_BASE = float(os.environ.get('MONITOR_RESTART_BACKOFF_BASE', '2'))
+MONITOR_RESTART_BACKOFF_MAX = float(os.environ.get('MONITOR_RESTART_BACKOFF_MAX', '120'))
+
+class MonitorWorker:
+    """State of one camera's monitoring loop, shared with the supervisor"""
+
+    def __init__(self, user_id, camera_info):
+        self.user_id = user_id
+        self.camera_id = camera_info['id']
+        self.camera_info = camera_info
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.state = 'starting'  # starting | running | reconnecting | backoff | stopping | stopped
+        self.last_error = None
+        self.restarts = 0
+        self.frames = 0
+        self.fps = 0.0
+        self.started_at = time.time()
+        self._fps_frames = 0
+        self._fps_window_start = time.monotonic()
+
+    def on_frame(self):
+        self.frames += 1
+        self._fps_frames += 1
+        elapsed = time.monotonic() - self._fps_window_start
+        if elapsed >= 5:
+            self.fps = self._fps_frames / elapsed
+            self._fps_frames = 0
+            self._fps_window_start = time.monotonic()
+
+    @property
+    def alive(self):
+        return self.thread is not None and self.thread.is_alive() and not self.stop_event.is_set()
+
+    def stats(self):
+        return {
+            'user_id': self.user_id,
+            'camera_id': self.camera_id,
+            'camera_name': self.camera_info.get('name'),
+            'state': self.state,
+            'fps': round(self.fps, 2),
+            'frames': self.frames,
+            'restarts': self.restarts,
+            'last_error': self.last_error,
+            'started_at': self.started_at
+        }
+
+class MonitorSupervisor:
+    """Own the monitoring workers: idempotent start, real stop and restart with backoff"""
+
+    def __init__(self, max_workers=MAX_MONITOR_WORKERS):
+        self.max_workers = max_workers
+        self._workers = {}  # {(user_id, camera_id): MonitorWorker}
+        self._lock = threading.Lock()
+
+    def start(self, user_id, camera_info):
+        """Start monitoring a camera, returns (worker, started) or (None, False) at the cap"""
+        key = (user_id, camera_info['id'])
+        with self._lock:
+            worker = self._workers.get(key)
+            if worker is not None and worker.alive:
+                return worker, False
+            if len(self._workers) >= self.max_workers:
+                return None, False
+            worker = MonitorWorker(user_id, camera_info)
+            worker.thread = threading.Thread(target=self._run, args=(worker,), daemon=True)
+            self._workers[key] = worker
+        worker.thread.start()
+        return worker, True
+
+    def _run(self, worker):
+        backoff = MONITOR_RESTART_BACKOFF_BASE
+        try:
+            while not worker.stop_event.is_set():
+                started = time.monotonic()
+                try:
+                    continuous_monitor_camera(worker.user_id, worker.camera_info, worker)
+                except Exception as e:
+                    worker.last_error = str(e)
+                if worker.stop_event.is_set():
+                    break
+                # The loop only returns on its own when the camera failed, restart it
+                if time.monotonic() - started > MONITOR_RESTART_BACKOFF_MAX:
+                    backoff = MONITOR_RESTART_BACKOFF_BASE
+                worker.state = 'backoff'
+                worker.restarts += 1
+                log.warning('monitor_restarting', f"🔁 Restarting monitoring in {backoff:.0f}s", user_id=worker.user_id,
+                            camera=worker.camera_id, camera_name=worker.camera_info.get('name'))
+                worker.stop_event.wait(backoff)
+                backoff = min(backoff * 2, MONITOR_RESTART_BACKOFF_MAX)
+        finally:
+            worker.state = 'stopped'
+            with self._lock:
+                if self._workers.get((worker.user_id, worker.camera_id)) is worker:
+                    del self._workers[(worker.user_id, worker.camera_id)]
+
+    def stop(self, user_id, camera_id=None):
+        """Signal the user's workers (or one camera) to stop, returns how many were signalled"""
+        with self._lock:
+            workers = [
+                w for (uid, cid), w in self._workers.items()
+                if uid == user_id and (camera_id is None or cid == camera_id)
+            ]
+        for worker in workers:
+            worker.state = 'stopping'
+            worker.stop_event.set()
+        return len(workers)
+
+    def stats(self, user_id=None):
+        with self._lock:
+            workers = list(self._workers.values())
+        return [w.stats() for w in workers if user_id is None or w.user_id == user_id]
+
+    def threads(self, key):
+        with self._lock:
+            worker = self._workers.get(key)
+        return [('monitor', worker.thread)] if worker is not None and worker.thread is not None else []
+
+monitor_supervisor = MonitorSupervisor()
+
+# ========== Segmented Recording ==========
+RECORD_SEGMENT_SECONDS = float(os.environ.get('RECORD_SEGMENT_SECONDS', '60'))
+RECORD_FOURCC = os.environ.get('RECORD_FOURCC', 'XVID')
+RECORD_QUEUE_SECONDS = float(os.environ.get('RECORD_QUEUE_SECONDS', '2'))  # encoder backlog before frames are dropped
+RETENTION_MAX_AGE_DAYS = float(os.environ.get('RETENTION_MAX_AGE_DAYS', '7'))
+RETENTION_MAX_BYTES_PER_CAMERA = int(os.environ.get('RETENTION_MAX_BYTES_PER_CAMERA', str(10 * 1024 ** 3)))
+RETENTION_MAX_BYTES_PER_USER = int(os.environ.get('RETENTION_MAX_BYTES_PER_USER', '0'))  # 0 = no user-wide cap
+RETENTION_INTERVAL = float(os.environ.get('RETENTION_INTERVAL', '300'))
+
+def recording_segment_path(user_id, camera_name, start_time):
+    """footages/<user>_<camera>_<YYYYmmdd_HHMMSS_mmm>.avi, suffixed if the name is already taken"""
+    stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(start_time)) + f'_{int(start_time * 1000) % 1000:03d}'
+    base = os.path.join(FOOTAGE_FOLDER, f'{user_id}_{camera_name}_{stamp}')
+    path, suffix = f'{base}.avi', 1
+    while os.path.exists(path):
+        path = f'{base}_{suffix}.avi'
+        suffix += 1
+    return path
+
+class SegmentRecorder:
+    """Record one camera continuously into fixed-duration compressed segments
+
+    The capture thread paces frames to RECORD_FPS by capture time (skipping
+    frames from faster cameras, repeating for slower ones) and runs fall
+    detection when due; the writer thread encodes and rolls a new segment
+    every RECORD_SEGMENT_SECONDS worth of frames, so segments follow each
+    other without gaps. Each finished segment is indexed right away.
+    """
+
+    def __init__(self, user_id, camera_info, duration=None):
+        self.user_id = user_id
+        self.camera_id = camera_info['id']
+        self.camera_info = camera_info
+        self.camera_name = camera_info['name']
+        self.duration = duration  # seconds, None records until stopped
+        self.stop_event = threading.Event()
+        self.state = 'starting'  # starting | recording | reconnecting | stopped | failed
+        self.last_error = None
+        self.started_at = time.time()
+        self.segments = 0
+        self.bytes_written = 0
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.current_segment = None
+        self._poster_frame = None  # preview of the segment being written
+        self._queue = queue.Queue(maxsize=max(1, int(RECORD_FPS * RECORD_QUEUE_SECONDS)))
+        self._last_queued_time = None  # capture times of the newest queued and encoded frames
+        self._last_written_time = None
+        self._capture_thread = threading.Thread(target=self._capture, daemon=True)
+        self._writer_thread = threading.Thread(target=self._write, daemon=True)
+
+    def start(self):
+        self._writer_thread.start()
+        self._capture_thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    @property
+    def alive(self):
+        return self._writer_thread.is_alive()
+
+    def _capture(self):
+        key = (self.user_id, self.camera_id)
+        log.info('recording_started', "Starting recording", user_id=self.user_id, camera=self.camera_id,
+                 camera_name=self.camera_name)
+        try:
+            capture = capture_hub.acquire(self.user_id, self.camera_id,
+                                          camera_source(self.user_id, self.camera_info))
+        except CaptureLimitError as e:
+            log.error('recording_failed', "Cannot record camera", user_id=self.user_id, camera=self.camera_id,
+                      camera_name=self.camera_name, error=str(e))
+            self.state, self.last_error = 'failed', str(e)
+            self._queue.put(None)
+            return
+        pacer = FramePacer(RECORD_FPS)
+        fall_check = FallCheck(key, 'record')
+        sampling_scheduler.register(key, 'record')
+        try:
+            if not capture.wait_opened():
+                log.error('camera_open_failed', "Cannot open camera", user_id=self.user_id, camera=self.camera_id,
+                          camera_name=self.camera_name)
+                self.state, self.last_error = 'failed', 'Cannot open camera'
+                return
+            self.state = 'recording'
+            seq = 0
+            while not self.stop_event.is_set():
+                if self.duration is not None and time.time() - self.started_at >= self.duration:
+                    break
+                seq, frame, frame_time = capture.read_timed(seq, timeout=1)
+                if frame is None:
+                    if not capture.is_open:
+                        self.state = 'reconnecting'
+                    continue
+                self.state = 'recording'
+                slots = pacer.take(frame_time)
+                if slots:
+                    try:
+                        self._queue.put_nowait((frame, frame_time, slots))
+                        self._last_queued_time = frame_time
+                    except queue.Full:
+                        self.frames_dropped += slots  # encoder can't keep up, don't stall capture
+                if not slots:
+                    continue
+                # Fall detection & notification
+                try:
+                    alert = fall_check.update(frame, frame_time)
+                    if alert is not None:
+                        fall, tracks = alert
+                        log.warning('fall_detected', "[ALERT] Fall detected", user_id=self.user_id, camera=self.camera_id,
+                                    source='recording', confidence=round(fall['score'], 2), track=fall.get('track_id'))
+                        alert_hub.publish(self.user_id, fall_alert(
+                            self.user_id, self.camera_name, "Fall detected!", self.camera_id, fall['score'],
+                            source='recording', track=fall if 'track_id' in fall else None, tracks=tracks))
+                except Exception as e:
+                    log.error('detection_failed', "[notify_fall] Error", user_id=self.user_id, camera=self.camera_id,
+                              error=str(e))
+        finally:
+            fall_check.reset()
+            sampling_scheduler.unregister(key, 'record')
+            capture_hub.release(capture)
+            self._queue.put(None)
+
+    def _write(self):
+        os.makedirs(FOOTAGE_FOLDER, exist_ok=True)
+        label = camera_label((self.user_id, self.camera_id))
+        frames_per_segment = max(1, int(RECORD_FPS * RECORD_SEGMENT_SECONDS))
+        writer = None
+        segment_frames = 0
+        size = None
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                frame, frame_time, slots = item
+                for _ in range(slots):
+                    if writer is None:
+                        size = (frame.shape[1], frame.shape[0])
+                        self.current_segment = recording_segment_path(self.user_id, self.camera_name, frame_time)
+                        writer = cv2.VideoWriter(self.current_segment, cv2.VideoWriter_fourcc(*RECORD_FOURCC),
+                                                 RECORD_FPS, size)
+                        segment_frames = 0
+                        log.info('segment_started', "Recording to new segment", user_id=self.user_id,
+                                 camera=self.camera_id, path=self.current_segment)
+                    if segment_frames == 0 or segment_frames == frames_per_segment // 2:
+                        self._poster_frame = frame
+                    with metrics.time('record_write', label):
+                        writer.write(frame if (frame.shape[1], frame.shape[0]) == size else cv2.resize(frame, size))
+                    segment_frames += 1
+                    self.frames_written += 1
+                    if segment_frames >= frames_per_segment:
+                        self._finish_segment(writer, segment_frames)
+                        writer = None
+                self._last_written_time = frame_time
+        except Exception as e:
+            log.error('recording_failed', "❌ Recording writer error", user_id=self.user_id, camera=self.camera_id,
+                      camera_name=self.camera_name, error=str(e))
+            self.last_error = str(e)
+        finally:
+            if writer is not None:
+                self._finish_segment(writer, segment_frames)
+            if self.state != 'failed':
+                self.state = 'stopped'
+            forget_camera_metrics((self.user_id, self.camera_id))
+            log.info('recording_finished', "Recording finished", user_id=self.user_id, camera=self.camera_id,
+                     camera_name=self.camera_name, segments=self.segments)
+
+    def _finish_segment(self, writer, frames):
+        writer.release()
+        path, self.current_segment = self.current_segment, None
+        poster, self._poster_frame = self._poster_frame, None
+        if not os.path.exists(path):
+            return
+        size = os.path.getsize(path)
+        self.segments += 1
+        self.bytes_written += size
+        media_index.add('recording', self.user_id, os.path.basename(path), path,
+                        camera_name=self.camera_name, camera_id=self.camera_id, created=os.path.getctime(path),
+                        duration=frames / RECORD_FPS, size=size,
+                        thumbnail=thumbnail_cache.put(poster) if poster is not None else None)
+        media_transcoder.prefetch(path)
+
+    @property
+    def encoder_lag(self):
+        """Seconds between the newest queued frame and the newest encoded one"""
+        if self._last_queued_time is None:
+            return 0.0
+        return max(0.0, self._last_queued_time - (self._last_written_time or self.started_at))
+
+    def stats(self):
+        return {
+            'user_id': self.user_id,
+            'camera_id': self.camera_id,
+            'camera_name': self.camera_name,
+            'state': self.state,
+            'last_error': self.last_error,
+            'started_at': self.started_at,
+            'segments': self.segments,
+            'bytes_written': self.bytes_written,
+            'frames_written': self.frames_written,
+            'frames_dropped': self.frames_dropped,
+            'encoder_lag_seconds': round(self.encoder_lag, 3),
+            'queue_depth': self._queue.qsize(),
+            'current_segment': os.path.basename(self.current_segment) if self.current_segment else None
+        }
+
+class RecordingManager:
+    """Registry of running recorders plus the background retention pruner
+
+    Retention applies per camera (age and total bytes, overridable with
+    camera_info['retention'] = {'max_age_days', 'max_bytes'}) and then
+    per user (RETENTION_MAX_BYTES_PER_USER), deleting the oldest segments.
+    """
+
+    def __init__(self):
+        self.recorders = {}  # {(user_id, camera_id): SegmentRecorder}
+        self._lock = threading.Lock()
+        self.pruned_files = 0
+        self.pruned_bytes = 0
+        self.last_prune = None
+        threading.Thread(target=self._prune_loop, daemon=True).start()
+
+    def start(self, user_id, camera_info, duration=None):
+        """Start recording a camera, returns (recorder, started)"""
+        key = (user_id, camera_info['id'])
+        with self._lock:
+            recorder = self.recorders.get(key)
+            if recorder is not None and recorder.alive:
+                return recorder, False
+            recorder = SegmentRecorder(user_id, camera_info, duration)
+            self.recorders[key] = recorder
+        recorder.start()
+        return recorder, True
+
+    def stop(self, user_id, camera_id=None):
+        with self._lock:
+            recorders = [r for (uid, cid), r in self.recorders.items()
+                         if uid == user_id and (camera_id is None or cid == camera_id)]
+        for recorder in recorders:
+            recorder.stop()
+        return len(recorders)
+
+    def stats(self, user_id=None):
+        with self._lock:
+            recorders = list(self.recorders.values())
+        return [r.stats() for r in recorders if user_id is None or r.user_id == user_id]
+
+    def writing(self, path):
+        """Whether a recorder still has this segment open"""
+        path = os.path.abspath(path)
+        with self._lock:
+            segments = [r.current_segment for r in self.recorders.values()]
+        return any(segment and os.path.abspath(segment) == path for segment in segments)
+
+    def forget_finished(self):
+        """Drop recorders that have finished from the registry"""
+        with self._lock:
+            for key in [k for k, r in self.recorders.items() if not r.alive]:
+                del self.recorders[key]
+
+    def threads(self, key):
+        with self._lock:
+            recorder = self.recorders.get(key)
+        if recorder is None:
+            return []
+        return [('record_capture', recorder._capture_thread), ('record_writer', recorder._writer_thread)]
+
+    def _prune_loop(self):
+        while True:
+            time.sleep(RETENTION_INTERVAL)
+            self.forget_finished()
+            try:
+                self.prune()
+            except Exception as e:
+                log.error('retention_failed', "❌ Retention pruning failed", error=str(e))
+
+    def _retention(self, user_id, camera_id, camera_name=None):
+        """Retention override of a camera by id, by name for recordings indexed without one"""
+        for camera in store.list_cameras(user_id):
+            if (camera.get('id') == camera_id) if camera_id else (camera.get('name') == camera_name):
+                return camera.get('retention') or {}
+        return {}
+
+    def _delete(self, row):
+        try:
+            os.remove(row['filepath'])
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log.warning('retention_delete_failed', "⚠️ Cannot delete recording", path=row['filepath'], error=str(e))
+            return False
+        media_index.remove('recording', row['filename'])
+        self.pruned_files += 1
+        self.pruned_bytes += row['size'] or 0
+        return True
+
+    def prune(self):
+        """Delete recordings beyond the age and byte limits, returns the number of files removed"""
+        now = time.time()
+        removed = 0
+        per_user = {}  # {user_id: [rows kept]}
+        for (user_id, camera_id, camera_name), rows in media_index.recordings_by_camera().items():
+            retention = self._retention(user_id, camera_id, camera_name)
+            max_age = retention.get('max_age_days', RETENTION_MAX_AGE_DAYS) * 86400
+            max_bytes = retention.get('max_bytes', RETENTION_MAX_BYTES_PER_CAMERA)
+            total = sum(row['size'] or 0 for row in rows)
+            kept = []
+            for row in rows:  # oldest first
+                too_old = max_age and now - row['created'] > max_age
+                too_big = max_bytes and total > max_bytes
+                if (too_old or too_big) and self._delete(row):
+                    total -= row['size'] or 0
+                    removed += 1
+                else:
+                    kept.append(row)
+            per_user.setdefault(user_id, []).extend(kept)
+        if RETENTION_MAX_BYTES_PER_USER:
+            for user_id, rows in per_user.items():
+                total = sum(row['size'] or 0 for row in rows)
+                for row in sorted(rows, key=lambda r: r['created']):
+                    if total <= RETENTION_MAX_BYTES_PER_USER:
+                        break
+                    if self._delete(row):
+                        total -= row['size'] or 0
+                        removed += 1
+        self.last_prune = now
+        if removed:
+            log.info('retention_pruned', "🧹 Retention removed recording segments", removed=removed)
+        return removed
+
+    def retention_stats(self):
+        return {
+            'max_age_days': RETENTION_MAX_AGE_DAYS,
+            'max_bytes_per_camera': RETENTION_MAX_BYTES_PER_CAMERA,
+            'max_bytes_per_user': RETENTION_MAX_BYTES_PER_USER,
+            'pruned_files': self.pruned_files,
+            'pruned_bytes': self.pruned_bytes,
+            'last_prune': self.last_prune
+        }
+
+recording_manager = RecordingManager()
 
 @app.post('/cctv/start-recording')
-async def start_recording(data: dict, background_tasks: BackgroundTasks):
+async def start_recording(data: dict):
     user_id = data.get('userId')
-    camera_index = data.get('cameraIndex', 0)
-    cameras = load_cameras()
-    if user_id not in cameras or camera_index >= len(cameras[user_id]):
+    _, camera = store.find_camera(user_id, data.get('cameraIndex', 0), data.get('cameraId'))
+    if camera is None:
         raise HTTPException(status_code=404, detail='Camera not found')
-    camera = cameras[user_id][camera_index]
-    background_tasks.add_task(record_camera, camera, user_id)
+    duration = data.get('duration')
+    recorder, started = recording_manager.start(user_id, camera,
+                                                float(duration) if duration else None)
     return {
         'success': True,
-        'message': f'Started recording camera "{camera["name"]}"',
+        'message': f'Started recording camera "{camera["name"]}"' if started
+                   else f'Camera "{camera["name"]}" is already recording',
+        'already_running': not started,
         'camera': camera
     }
 
+@app.post('/cctv/stop-recording')
+async def stop_recording(data: dict):
+    user_id = data.get('userId')
+    camera_id = None
+    if data.get('cameraIndex') is not None or data.get('cameraId'):
+        _, camera = store.find_camera(user_id, data.get('cameraIndex'), data.get('cameraId'))
+        if camera is None:
+            raise HTTPException(status_code=404, detail='Camera not found')
+        camera_id = camera['id']
+    return {'success': True, 'stopped': recording_manager.stop(user_id, camera_id)}
+
+@app.get('/cctv/recording-status')
+async def recording_status(user_id: Optional[str] = None):
+    return {'recordings': recording_manager.stats(user_id), 'retention': recording_manager.retention_stats()}
+
 @app.get('/videos/{user_id}')
-async def list_videos(user_id: str):
-    folder = 'footages'
-    if not os.path.exists(folder):
-        return {"videos": []}
-    files = [
-        f for f in os.listdir(folder)
-        if f.startswith(user_id + "_") and (f.endswith('.mp4') or f.endswith('.avi'))
-    ]
+async def list_videos(user_id: str, camera: Optional[str] = None, since: Optional[float] = None,
+                      until: Optional[float] = None, cursor: Optional[str] = None, limit: int = 100):
+    try:
+        rows, next_cursor = media_index.query(user_id, 'recording', camera=camera, since=since, until=until,
+                                              cursor=cursor, limit=max(1, min(limit, 1000)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     videos = [
         {
-            "filename": f,
-            "url": f"/video-file/{f}",
-            "created": os.path.getctime(os.path.join(folder, f))
+            "filename": row['filename'],
+            "url": f"/video-file/{row['filename']}",
+            "created": row['created'],
+            "camera_name": row['camera_name'],
+            "duration": row['duration'],
+            "thumbnail_url": thumbnail_url('recording', row)
         }
-        for f in files
+        for row in rows
     ]
-    videos.sort(key=lambda x: -x["created"])
-    return {"videos": videos}
+    return {"videos": videos, "next_cursor": next_cursor}
 
-@app.get('/video-file/{filename}')
-async def get_video_file(filename: str):
-    folder = 'footages'
+# ========== Media Delivery ==========
+MEDIA_CACHE_FOLDER = os.environ.get('MEDIA_CACHE_FOLDER', 'media_cache')
+MEDIA_CACHE_MAX_BYTES = int(os.environ.get('MEDIA_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))
+MEDIA_TRANSCODE_WORKERS = int(os.environ.get('MEDIA_TRANSCODE_WORKERS', '1'))
+MEDIA_TRANSCODE_ON_WRITE = os.environ.get('MEDIA_TRANSCODE_ON_WRITE', '1') == '1'
+MEDIA_VIDEO_CODEC = os.environ.get('MEDIA_VIDEO_CODEC', 'libx264')
+FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY') or shutil.which('ffmpeg')
+MEDIA_CHUNK_SIZE = 256 * 1024
+MEDIA_TYPES = {
+    '.avi': 'video/x-msvideo',
+    '.mp4': 'video/mp4',
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.m4s': 'video/iso.segment',
+}
+HLS_ASSET_RE = re.compile(r'^(index\.m3u8|init\.mp4|seg_\d+\.m4s)$')
+
+def media_type_for(path):
+    return MEDIA_TYPES.get(os.path.splitext(path)[1].lower(), 'application/octet-stream')
+
+def _iter_file(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            data = f.read(min(MEDIA_CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+def _parse_range(header, size):
+    """Parse a single 'bytes=start-end' range, returns (start, end), None to ignore it, or raises ValueError"""
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None  # other units and multi-range requests get the whole file
+    start, _, end = spec.strip().partition('-')
+    if not start:
+        if not end:
+            raise ValueError(header)
+        length = int(end)  # suffix range: last N bytes
+        if length <= 0:
+            raise ValueError(header)
+        return max(0, size - length), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, end
+
+def ranged_file_response(request: Request, path, media_type=None, filename=None, cache_control='no-cache'):
+    """Serve a file with Range, ETag/Last-Modified and conditional request support"""
+    stat = os.stat(path)
+    etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Last-Modified': formatdate(stat.st_mtime, usegmt=True),
+        'Cache-Control': cache_control
+    }
+    if filename:
+        headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    media_type = media_type or media_type_for(path)
+
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match:
+        tags = [t.strip().removeprefix('W/') for t in if_none_match.split(',')]
+        if '*' in tags or etag in tags:
+            return Response(status_code=304, headers=headers)
+    elif request.headers.get('if-modified-since'):
+        try:
+            if int(stat.st_mtime) <= parsedate_to_datetime(request.headers['if-modified-since']).timestamp():
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+
+    range_header = request.headers.get('range')
+    if_range = request.headers.get('if-range')
+    if range_header and (not if_range or if_range == etag or if_range == headers['Last-Modified']):
+        try:
+            byte_range = _parse_range(range_header, stat.st_size)
+        except ValueError:
+            headers['Content-Range'] = f'bytes */{stat.st_size}'
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            headers['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+            headers['Content-Length'] = str(end - start + 1)
+            return StreamingResponse(_iter_file(path, start, end - start + 1), status_code=206,
+                                     media_type=media_type, headers=headers)
+    headers['Content-Length'] = str(stat.st_size)
+    return StreamingResponse(_iter_file(path, 0, stat.st_size), media_type=media_type, headers=headers)
+
+class MediaTranscoder:
+    """Remux/transcode AVI recordings to fragmented MP4 (H.264) and HLS with ffmpeg
+
+    Outputs are cached under MEDIA_CACHE_FOLDER keyed by the source path,
+    size and mtime, so a changed source gets a fresh conversion. The cache
+    is trimmed to MEDIA_CACHE_MAX_BYTES, least recently served first.
+    Without an ffmpeg binary the original files are served.
+    """
+
+    def __init__(self, cache_dir=MEDIA_CACHE_FOLDER, max_bytes=MEDIA_CACHE_MAX_BYTES,
+                 workers=MEDIA_TRANSCODE_WORKERS, ffmpeg=FFMPEG_BINARY):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ffmpeg = ffmpeg
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers))
+        self._jobs = {}  # {(key, fmt): Future}
+        self._lock = threading.Lock()
+        self.converted = 0
+        self.failed = 0
+        self.evicted = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def available(self):
+        return bool(self.ffmpeg)
+
+    def _key(self, source):
+        stat = os.stat(source)
+        digest = hashlib.sha1(f'{os.path.abspath(source)}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+        return digest.hexdigest()[:20]
+
+    def output_path(self, source, fmt):
+        key = self._key(source)
+        if fmt == 'hls':
+            return os.path.join(self.cache_dir, f'{key}_hls', 'index.m3u8')
+        return os.path.join(self.cache_dir, f'{key}.mp4')
+
+    def get(self, source, fmt):
+        """Cached output path for 'mp4' or 'hls', or None while it is (being) converted"""
+        output = self.output_path(source, fmt)
+        if os.path.exists(output):
+            os.utime(os.path.dirname(output) if fmt == 'hls' else output)  # LRU touch
+            return output
+        self.submit(source, fmt)
+        return None
+
+    def submit(self, source, fmt):
+        """Start converting in the background unless it is cached or already running"""
+        if not self.available:
+            return None
+        output = self.output_path(source, fmt)
+        job_key = (output, fmt)
+        with self._lock:
+            job = self._jobs.get(job_key)
+            if job is None and not os.path.exists(output):
+                job = self._executor.submit(self._convert, source, output, fmt)
+                self._jobs[job_key] = job
+                job.add_done_callback(lambda _: self._jobs.pop(job_key, None))
+            return job
+
+    def prefetch(self, source):
+        """Convert a freshly written file ahead of the first request"""
+        if MEDIA_TRANSCODE_ON_WRITE:
+            for fmt in ('mp4', 'hls'):
+                self.submit(source, fmt)
+
+    def _convert(self, source, output, fmt):
+        encode = [self.ffmpeg, '-y', '-v', 'error', '-i', source, '-an',
+                  '-c:v', MEDIA_VIDEO_CODEC, '-preset', 'veryfast', '-pix_fmt', 'yuv420p', '-g', '40']
+        if fmt == 'hls':
+            final_dir = os.path.dirname(output)
+            work_dir = f'{final_dir}.tmp'
+            shutil.rmtree(work_dir, ignore_errors=True)
+            os.makedirs(work_dir)
+            command = encode + ['-f', 'hls', '-hls_time', '2', '-hls_playlist_type', 'vod',
+                                '-hls_segment_type', 'fmp4', '-hls_fmp4_init_filename', 'init.mp4',
+                                '-hls_segment_filename', os.path.join(work_dir, 'seg_%05d.m4s'),
+                                os.path.join(work_dir, 'index.m3u8')]
+        else:
+            work_path = f'{output}.tmp'
+            command = encode + ['-movflags', '+frag_keyframe+empty_moov+default_base_moof', '-f', 'mp4', work_path]
+        try:
+            result = subprocess.run(command, capture_output=True, timeout=600)
+            if result.returncode != 0:
+                raise RuntimeError(result.stderr.decode(errors='replace').strip()[-300:])
+            if fmt == 'hls':
+                os.replace(work_dir, final_dir)
+            else:
+                os.replace(work_path, output)
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            log.error('transcode_failed', "❌ Cannot convert", path=source, format=fmt, error=str(e))
+            if fmt == 'hls':
+                shutil.rmtree(work_dir, ignore_errors=True)
+            elif os.path.exists(work_path):
+                os.remove(work_path)
+            return None
+        with self._lock:
+            self.converted += 1
+        log.info('transcoded', "✅ Converted", path=source, format=fmt)
+        self.trim()
+        return output
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.tmp'):
+                continue
+            if os.path.isdir(path):
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            else:
+                size = os.path.getsize(path)
+            entries.append((os.path.getmtime(path), size, path))
+        return entries
+
+    def trim(self):
+        """Evict least recently served outputs until the cache fits in max_bytes"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+            total -= size
+            with self._lock:
+                self.evicted += 1
+
+    def stats(self):
+        entries = self._entries()
+        with self._lock:
+            return {
+                'available': self.available,
+                'cached_outputs': len(entries),
+                'cache_bytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes,
+                'running_jobs': len(self._jobs),
+                'converted': self.converted,
+                'failed': self.failed,
+                'evicted': self.evicted
+            }
+
+media_transcoder = MediaTranscoder()
+
+def serve_media(request: Request, folder, filename, format='auto', kind_path='video-file'):
+    """Serve a recording or clip as original, fMP4 (format=mp4) or an HLS playlist (format=hls)
+
+    auto serves the fMP4 when it is cached and the original otherwise, and
+    queues the conversion. mp4 and hls answer 202 while still converting.
+    A segment still being recorded is never converted: auto serves it as
+    is, mp4 and hls answer 202 until the segment is finished.
+    """
     file_path = os.path.join(folder, filename)
-    if not os.path.exists(file_path):
+    if os.path.basename(filename) != filename or not os.path.isfile(file_path):
+        return None
+    if format == 'original' or not media_transcoder.available:
+        return ranged_file_response(request, file_path, filename=filename)
+    if recording_manager.writing(file_path):
+        if format == 'auto':
+            return ranged_file_response(request, file_path, filename=filename)
+        retry_after = str(int(RECORD_SEGMENT_SECONDS))
+        return JSONResponse({'status': 'recording', 'retry_after': int(RECORD_SEGMENT_SECONDS)}, status_code=202,
+                            headers={'Retry-After': retry_after})
+    if format == 'hls':
+        if media_transcoder.get(file_path, 'hls') is None:
+            return JSONResponse({'status': 'processing', 'retry_after': 2}, status_code=202, headers={'Retry-After': '2'})
+        return RedirectResponse(f'/{kind_path}/{filename}/hls/index.m3u8', status_code=307)
+    converted = media_transcoder.get(file_path, 'mp4')
+    if converted is not None:
+        return ranged_file_response(request, converted, media_type='video/mp4',
+                                    filename=os.path.splitext(filename)[0] + '.mp4')
+    if format == 'mp4':
+        return JSONResponse({'status': 'processing', 'retry_after': 2}, status_code=202, headers={'Retry-After': '2'})
+    return ranged_file_response(request, file_path, filename=filename)
+
+def serve_hls_asset(request: Request, folder, filename, asset):
+    file_path = os.path.join(folder, filename)
+    if os.path.basename(filename) != filename or not HLS_ASSET_RE.match(asset) or not os.path.isfile(file_path):
+        return None
+    playlist = media_transcoder.output_path(file_path, 'hls')
+    asset_path = os.path.join(os.path.dirname(playlist), asset)
+    if not os.path.isfile(asset_path):
+        return None
+    # Finished recordings never change, so segments can be cached hard; the playlist is revalidated
+    cache_control = 'no-cache' if asset == 'index.m3u8' else 'public, max-age=86400'
+    return ranged_file_response(request, asset_path, cache_control=cache_control)
+
+@app.get('/video-file/{filename}')
+async def get_video_file(filename: str, request: Request, format: str = 'auto'):
+    response = serve_media(request, FOOTAGE_FOLDER, filename, format)
+    if response is None:
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(file_path, media_type="video/mp4", filename=filename)
-
-def mjpeg_stream(rtsp_url, user_id):
-    import cv2
-    import time
-    notify_interval = 30  # ส่งไป AI ทุก 30 เฟรม (ประมาณ 3 วินาทีที่ 10fps)
-    cap = cv2.VideoCapture(rtsp_url)
-    if not cap.isOpened():
+    return response
+
+@app.get('/video-file/{filename}/hls/{asset}')
+async def get_video_hls(filename: str, asset: str, request: Request):
+    response = serve_hls_asset(request, FOOTAGE_FOLDER, filename, asset)
+    if response is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    return response
+
+# ========== Thumbnails ==========
+THUMBNAIL_FOLDER = os.environ.get('THUMBNAIL_FOLDER', 'thumbnails')
+THUMBNAIL_WIDTH = int(os.environ.get('THUMBNAIL_WIDTH', '160'))
+THUMBNAIL_QUALITY = int(os.environ.get('THUMBNAIL_QUALITY', '60'))
+THUMBNAIL_FORMAT = os.environ.get('THUMBNAIL_FORMAT', 'jpeg').lower()  # jpeg | webp
+THUMBNAIL_CACHE_MAX_BYTES = int(os.environ.get('THUMBNAIL_CACHE_MAX_BYTES', str(100 * 1024 ** 2)))
+THUMBNAIL_KINDS = {'recording': FOOTAGE_FOLDER, 'accident': ACCIDENT_CLIPS_FOLDER}
+
+class ThumbnailCache:
+    """Content-addressed store of small preview images for recordings and clips
+
+    Previews are downscaled to THUMBNAIL_WIDTH and encoded once when a clip
+    or segment is finalized. Files are named by the hash of their bytes, so
+    a URL carrying the digest never changes content and can be cached by
+    clients forever. The folder is trimmed to max_bytes, least recently
+    served first; an evicted preview is rebuilt from its video on demand.
+    """
+
+    def __init__(self, folder=THUMBNAIL_FOLDER, max_bytes=THUMBNAIL_CACHE_MAX_BYTES,
+                 width=THUMBNAIL_WIDTH, quality=THUMBNAIL_QUALITY, fmt=THUMBNAIL_FORMAT):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.width = width
+        if fmt == 'webp':
+            self.extension, self.media_type = '.webp', 'image/webp'
+            self._params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+        else:
+            self.extension, self.media_type = '.jpg', 'image/jpeg'
+            self._params = [cv2.IMWRITE_JPEG_QUALITY, quality, cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # {digest: size}, least recently used first
+        self.total_bytes = 0
+        self.created = 0
+        self.evicted = 0
+        os.makedirs(folder, exist_ok=True)
+        existing = []
+        for entry in os.scandir(folder):
+            if entry.is_file() and entry.name.endswith(self.extension):
+                stat = entry.stat()
+                existing.append((stat.st_mtime, entry.name[:-len(self.extension)], stat.st_size))
+        for _, digest, size in sorted(existing):
+            self._entries[digest] = size
+            self.total_bytes += size
+
+    def path(self, digest):
+        return os.path.join(self.folder, digest + self.extension)
+
+    def put(self, frame):
+        """Encode a BGR frame (or JPEG bytes) as a preview, returns its digest or None"""
+        frame = decode_clip_frame(frame)
+        if frame is None or frame.size == 0:
+            return None
+        height, width = frame.shape[:2]
+        if width > self.width:
+            frame = cv2.resize(frame, (self.width, max(1, round(height * self.width / width))),
+                               interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode(self.extension, frame, self._params)
+        if not ok:
+            return None
+        data = encoded.tobytes()
+        digest = hashlib.sha1(data).hexdigest()[:20]
+        path = self.path(digest)
+        with self._lock:
+            if digest in self._entries:
+                self._entries.move_to_end(digest)
+                return digest
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if digest not in self._entries:
+                self._entries[digest] = len(data)
+                self.total_bytes += len(data)
+                self.created += 1
+        self.trim()
+        return digest
+
+    def get(self, digest):
+        """Path of a cached preview, or None if it was evicted"""
+        path = self.path(digest)
+        with self._lock:
+            if digest not in self._entries:
+                return None
+            self._entries.move_to_end(digest)  # LRU touch
+        if not os.path.exists(path):
+            self._discard(digest)
+            return None
+        return path
+
+    def _discard(self, digest):
+        with self._lock:
+            size = self._entries.pop(digest, None)
+            if size is not None:
+                self.total_bytes -= size
+
+    def trim(self):
+        """Evict least recently served previews until the cache fits in max_bytes"""
         while True:
-            # ส่งเฟรม error
-            frame = np.zeros((480, 640, 3), dtype=np.uint8)
-            cv2.putText(frame, "Camera Connection Failed", (100, 200), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-            _, jpeg = cv2.imencode('.jpg', frame)
-            frame_bytes = jpeg.tobytes()
-            yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            time.sleep(1)
-    frame_count = 0
+            with self._lock:
+                if self.total_bytes <= self.max_bytes or not self._entries:
+                    return
+                digest, size = self._entries.popitem(last=False)
+                self.total_bytes -= size
+                self.evicted += 1
+            try:
+                os.remove(self.path(digest))
+            except OSError:
+                pass
+
+    def from_video(self, path):
+        """Preview from the middle frame of a video file, for rows without one"""
+        cap = cv2.VideoCapture(path)
+        try:
+            frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+            if frames > 1:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frames // 2)
+            ok, frame = cap.read()
+        finally:
+            cap.release()
+        return self.put(frame) if ok else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'format': self.extension[1:],
+                'width': self.width,
+                'cached': len(self._entries),
+                'cache_bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'created': self.created,
+                'evicted': self.evicted
+            }
+
+thumbnail_cache = ThumbnailCache()
+
+def thumbnail_url(kind, row):
+    """Versioned preview URL for an index row; the digest makes it immutable"""
+    url = f"/thumbnails/{kind}/{row['filename']}"
+    return f"{url}?v={row['thumbnail']}" if row.get('thumbnail') else url
+
+@app.get('/thumbnails/{kind}/{filename}')
+def get_thumbnail(kind: str, filename: str, request: Request, v: Optional[str] = None):
+    """Preview image of a recording or accident clip"""
+    if kind not in THUMBNAIL_KINDS or os.path.basename(filename) != filename:
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    row = media_index.get(kind, filename)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    digest = row['thumbnail']
+    path = thumbnail_cache.get(digest) if digest else None
+    if path is None:
+        video_path = os.path.join(THUMBNAIL_KINDS[kind], filename)
+        if not os.path.isfile(video_path):
+            raise HTTPException(status_code=404, detail="Thumbnail not found")
+        digest = thumbnail_cache.from_video(video_path)
+        if digest is None:
+            raise HTTPException(status_code=404, detail="Thumbnail not available")
+        media_index.set_thumbnail(kind, filename, digest)
+        path = thumbnail_cache.path(digest)
+    # Versioned URLs never change content; unversioned ones may once a preview is regenerated
+    headers = {
+        'ETag': f'"{digest}"',
+        'Cache-Control': 'public, max-age=31536000, immutable' if v == digest else 'public, max-age=300'
+    }
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match and headers['ETag'] in [t.strip().removeprefix('W/') for t in if_none_match.split(',')]:
+        return Response(status_code=304, headers=headers)
     try:
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            # ใส่ overlay ชื่อกล้อง/เวลา (optional)
-            t = time.ctime()
-            cv2.rectangle(frame, (5, 5), (255, 25), (255, 255, 255), cv2.FILLED)
-            cv2.putText(frame, t, (20, 20), cv2.FONT_HERSHEY_DUPLEX, 0.5, (5, 5, 5), 1)
-            # Fall detection ทุก notify_interval เฟรม
-            if frame_count % notify_interval == 0:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    return Response(content=data, media_type=thumbnail_cache.media_type, headers=headers)
+
+# ========== MJPEG Broadcaster ==========
+STREAM_MAX_FPS = float(os.environ.get('STREAM_MAX_FPS', '10'))
+STREAM_DEFAULT_QUALITY = int(os.environ.get('STREAM_DEFAULT_QUALITY', '80'))
+
+def _resolve_waiter(future):
+    if not future.done():
+        future.set_result(None)
+
+def connection_failed_frame():
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    cv2.putText(frame, "Camera Connection Failed", (100, 200), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+    return frame
+
+class MjpegBroadcaster:
+    """Encode each camera frame to JPEG once per quality tier and fan it out to async viewers
+
+    A tier is (width, quality); width None keeps the source resolution.
+    Viewers always receive the newest encoded frame, never a backlog.
+    """
+
+    def __init__(self, key, rtsp_url):
+        self.key = key  # (user_id, camera_id)
+        self.rtsp_url = rtsp_url
+        self.subscribers = 0
+        self.tiers = {}  # {(width, quality): subscriber_count}
+        self.latest = {}  # {(width, quality): (seq, jpeg_bytes)}
+        self.seq = 0
+        self.frames_encoded = 0
+        self._waiters = []  # [(loop, future)] of viewers waiting for the next frame
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def subscribe(self, width=None, quality=None):
+        tier = (width, quality or STREAM_DEFAULT_QUALITY)
+        with self._lock:
+            self.tiers[tier] = self.tiers.get(tier, 0) + 1
+        return tier
+
+    def unsubscribe(self, tier):
+        with self._lock:
+            self.tiers[tier] -= 1
+            if self.tiers[tier] <= 0:
+                del self.tiers[tier]
+                self.latest.pop(tier, None)
+
+    async def frames(self, tier):
+        """Yield the newest JPEG for a tier each time a new frame is published"""
+        loop = asyncio.get_running_loop()
+        last_seq = 0
+        while not self._stop.is_set():
+            with self._lock:
+                seq, data = self.latest.get(tier, (last_seq, None))
+                if data is None or seq == last_seq:
+                    waiter = loop.create_future()
+                    self._waiters.append((loop, waiter))
+                else:
+                    waiter = None
+            if waiter is None:
+                last_seq = seq
+                yield data
+                continue
+            try:
+                await asyncio.wait_for(waiter, timeout=1)
+            except asyncio.TimeoutError:
+                pass
+
+    def _encode(self, frame, tier):
+        width, quality = tier
+        if width and width < frame.shape[1]:
+            height = max(1, frame.shape[0] * width // frame.shape[1])
+            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        _, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return jpeg.tobytes()
+
+    def _publish(self, frame):
+        with self._lock:
+            tiers = list(self.tiers)
+        with metrics.time('jpeg_encode', camera_label(self.key)):
+            encoded = {tier: self._encode(frame, tier) for tier in tiers}
+        with self._lock:
+            self.seq += 1
+            self.frames_encoded += len(encoded)
+            for tier, data in encoded.items():
+                if tier in self.tiers:
+                    self.latest[tier] = (self.seq, data)
+            waiters, self._waiters = self._waiters, []
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve_waiter, waiter)
+            except RuntimeError:
+                pass  # viewer's loop already closed
+
+    def _run(self):
+        user_id, camera_id = self.key
+        pacer = FramePacer(STREAM_MAX_FPS)
+        try:
+            capture = capture_hub.acquire(user_id, camera_id, self.rtsp_url)
+        except CaptureLimitError as e:
+            log.error('stream_failed', "[live_stream] Cannot open camera", user_id=user_id, camera=camera_id, error=str(e))
+            while not self._stop.is_set():
+                self._publish(connection_failed_frame())
+                self._stop.wait(1)
+            return
+        fall_check = FallCheck(self.key, 'stream')
+        sampling_scheduler.register(self.key, 'stream')
+        try:
+            seq = 0
+            while not self._stop.is_set():
+                seq, frame, frame_time = capture.read_timed(seq, timeout=1)
+                if frame is None:
+                    if not capture.opened.is_set() or capture.is_open:
+                        continue
+                    # ส่งเฟรม error
+                    self._publish(connection_failed_frame())
+                    continue
+                if not pacer.take(frame_time):
+                    continue
+                # Fall detection (once per camera, not per viewer; skipped if monitored or recorded)
                 try:
-                    _, buffer = cv2.imencode('.jpg', frame)
-                    frame_bytes = buffer.tobytes()
-                    files = {'file': ('frame.jpg', frame_bytes, 'image/jpeg')}
-                    response = requests.post(f"{AI_API_URL}/predict", files=files, timeout=5)
-                    if response.status_code == 200:
-                        result = response.json()
-                        if result.get("fall_detected"):
-                            print(f"[ALERT] Fall detected for user {user_id} (live stream)")
-                            asyncio.run(send_alert_to_user(user_id, "Fall detected!"))
+                    alert = fall_check.update(frame, frame_time)
+                    if alert is not None:
+                        fall, tracks = alert
+                        log.warning('fall_detected', "[ALERT] Fall detected", user_id=user_id, camera=camera_id,
+                                    source='live_stream', confidence=round(fall['score'], 2), track=fall.get('track_id'))
+                        _, camera = store.find_camera(user_id, camera_id=camera_id)
+                        alert_hub.publish(user_id, fall_alert(
+                            user_id, camera['name'] if camera else None, "Fall detected!", camera_id, fall['score'],
+                            source='live_stream', track=fall if 'track_id' in fall else None, tracks=tracks))
                 except Exception as e:
-                    print(f"[live_fall] Error: {e}")
-            frame_count += 1
-            _, jpeg = cv2.imencode('.jpg', frame)
-            frame_bytes = jpeg.tobytes()
+                    log.error('detection_failed', "[live_fall] Error", user_id=user_id, camera=camera_id, error=str(e))
+                frame = frame.copy()  # shared with other consumers
+                # ใส่ overlay ชื่อกล้อง/เวลา (optional)
+                t = time.ctime()
+                cv2.rectangle(frame, (5, 5), (255, 25), (255, 255, 255), cv2.FILLED)
+                cv2.putText(frame, t, (20, 20), cv2.FONT_HERSHEY_DUPLEX, 0.5, (5, 5, 5), 1)
+                self._publish(frame)
+        finally:
+            fall_check.reset()
+            sampling_scheduler.unregister(self.key, 'stream')
+            capture_hub.release(capture)
+            forget_camera_metrics(self.key)
+            with self._lock:
+                waiters, self._waiters = self._waiters, []
+            for loop, waiter in waiters:
+                try:
+                    loop.call_soon_threadsafe(_resolve_waiter, waiter)
+                except RuntimeError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'user_id': self.key[0],
+                'camera_id': self.key[1],
+                'viewers': self.subscribers,
+                'tiers': [
+                    {'width': width, 'quality': quality, 'viewers': count}
+                    for (width, quality), count in self.tiers.items()
+                ],
+                'frames_encoded': self.frames_encoded
+            }
+
+class BroadcastHub:
+    """Reference-counted registry of MjpegBroadcaster keyed by (user_id, camera_id)"""
+
+    def __init__(self):
+        self._broadcasters = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, user_id, camera_id, rtsp_url):
+        key = (user_id, camera_id)
+        with self._lock:
+            broadcaster = self._broadcasters.get(key)
+            if broadcaster is None or broadcaster.rtsp_url != rtsp_url:
+                broadcaster = MjpegBroadcaster(key, rtsp_url)
+                self._broadcasters[key] = broadcaster
+                broadcaster.start()
+            broadcaster.subscribers += 1
+        return broadcaster
+
+    def release(self, broadcaster):
+        with self._lock:
+            broadcaster.subscribers -= 1
+            if broadcaster.subscribers > 0:
+                return
+            if self._broadcasters.get(broadcaster.key) is broadcaster:
+                del self._broadcasters[broadcaster.key]
+        broadcaster.stop()
+
+    def close(self, user_id, camera_id):
+        """Stop a camera's broadcaster, its viewers' streams end. Returns whether one was running"""
+        with self._lock:
+            broadcaster = self._broadcasters.pop((user_id, camera_id), None)
+        if broadcaster is None:
+            return False
+        broadcaster.stop()
+        return True
+
+    def stats(self):
+        with self._lock:
+            broadcasters = list(self._broadcasters.values())
+        return [b.stats() for b in broadcasters]
+
+    def threads(self, key):
+        with self._lock:
+            broadcaster = self._broadcasters.get(key)
+        return [('stream', broadcaster._thread)] if broadcaster is not None else []
+
+broadcast_hub = BroadcastHub()
+
+async def mjpeg_stream(rtsp_url, user_id, camera_id, width=None, quality=None):
+    broadcaster = broadcast_hub.acquire(user_id, camera_id, rtsp_url)
+    tier = broadcaster.subscribe(width, quality)
+    try:
+        async for frame_bytes in broadcaster.frames(tier):
             yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            time.sleep(0.1)  # 10 FPS
     finally:
-        cap.release()
+        broadcaster.unsubscribe(tier)
+        broadcast_hub.release(broadcaster)
+
+@app.get('/cctv/stream/{user_id}/{camera_ref}')
+async def stream_camera(user_id: str, camera_ref: str, width: Optional[int] = None, quality: Optional[int] = None):
+    """camera_ref is the camera id, or its list index for older clients"""
+    camera = find_camera_ref(user_id, camera_ref)
+    if camera is None:
+        raise HTTPException(status_code=404, detail='Camera not found')
+    rtsp_url = camera_source(user_id, camera)
+    if not rtsp_url:
+        raise HTTPException(status_code=400, detail='No RTSP URL for this camera')
+    if not capture_hub.has_capacity(user_id, camera['id'], rtsp_url):
+        raise HTTPException(status_code=503, detail='Too many cameras are being decoded')
+    if width is not None:
+        width = max(64, min(width, 1920))
+    if quality is not None:
+        quality = max(10, min(quality, 100))
+    return StreamingResponse(mjpeg_stream(rtsp_url, user_id, camera['id'], width, quality),
+                             media_type='multipart/x-mixed-replace; boundary=frame')
+
+# ========== ONVIF Discovery ==========
+ONVIF_DISCOVERY_ADDRESS = os.environ.get('ONVIF_DISCOVERY_ADDRESS', '239.255.255.250')
+ONVIF_DISCOVERY_PORT = int(os.environ.get('ONVIF_DISCOVERY_PORT', '3702'))
+ONVIF_SEARCH_SECONDS = float(os.environ.get('ONVIF_SEARCH_SECONDS', '3'))
+ONVIF_DISCOVERY_INTERVAL = float(os.environ.get('ONVIF_DISCOVERY_INTERVAL', '300'))
+ONVIF_DEVICE_TTL = float(os.environ.get('ONVIF_DEVICE_TTL', '900'))  # forget devices not seen for this long
+ONVIF_REPROBE_SECONDS = float(os.environ.get('ONVIF_REPROBE_SECONDS', '3600'))
+ONVIF_PROBE_WORKERS = int(os.environ.get('ONVIF_PROBE_WORKERS', '16'))
+ONVIF_PROBE_TIMEOUT = float(os.environ.get('ONVIF_PROBE_TIMEOUT', '2'))
+ONVIF_OPEN_TIMEOUT = float(os.environ.get('ONVIF_OPEN_TIMEOUT', '5'))
+ONVIF_RTSP_PORTS = [int(p) for p in os.environ.get('ONVIF_RTSP_PORTS', '554').split(',') if p.strip()]
+ONVIF_RTSP_PATHS = [p.strip().lstrip('/') for p in os.environ.get('ONVIF_RTSP_PATHS', ','.join([
+    'Streaming/Channels/101',                 # Hikvision
+    'cam/realmonitor?channel=1&subtype=0',    # Dahua, Amcrest
+    'h264Preview_01_main',                    # Reolink
+    'stream1',                                # TP-Link Tapo, Vigi
+    'axis-media/media.amp',                   # Axis
+    'videoMain',                              # Foscam
+    'live/ch00_0',
+    'onvif1',
+    'live.sdp',
+    '11',
+])).split(',') if p.strip()]
+ONVIF_RTSP_USERNAME = os.environ.get('ONVIF_RTSP_USERNAME', '')
+ONVIF_RTSP_PASSWORD = os.environ.get('ONVIF_RTSP_PASSWORD', '')
+
+ONVIF_PROBE_MESSAGE = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<e:Envelope xmlns:e="http://www.w3.org/2003/05/soap-envelope"'
+    ' xmlns:w="http://schemas.xmlsoap.org/ws/2004/08/addressing"'
+    ' xmlns:d="http://schemas.xmlsoap.org/ws/2005/04/discovery"'
+    ' xmlns:dn="http://www.onvif.org/ver10/network/wsdl">'
+    '<e:Header><w:MessageID>uuid:{message_id}</w:MessageID>'
+    '<w:To>urn:schemas-xmlsoap-org:ws:2005:04:discovery</w:To>'
+    '<w:Action>http://schemas.xmlsoap.org/ws/2005/04/discovery/Probe</w:Action></e:Header>'
+    '<e:Body><d:Probe><d:Types>dn:NetworkVideoTransmitter</d:Types></d:Probe></e:Body></e:Envelope>'
+)
+
+def _xml_texts(root, name):
+    return [(element.text or '').strip() for element in root.iter() if element.tag.rsplit('}', 1)[-1] == name]
+
+def parse_probe_matches(data, sender_ip, message_id=None):
+    """Devices from a WS-Discovery ProbeMatches reply: [{address, ip, xaddrs, name, hardware, scopes}]"""
+    import xml.etree.ElementTree as ET
+    try:
+        root = ET.fromstring(data)
+    except ET.ParseError:
+        return []
+    relates_to = _xml_texts(root, 'RelatesTo')
+    if message_id and relates_to and relates_to[0] != f'uuid:{message_id}':
+        return []
+    devices = []
+    for match in [e for e in root.iter() if e.tag.rsplit('}', 1)[-1] == 'ProbeMatch']:
+        addresses = _xml_texts(match, 'Address')
+        xaddrs = ' '.join(_xml_texts(match, 'XAddrs')).split()
+        scopes = ' '.join(_xml_texts(match, 'Scopes')).split()
+        ip = None
+        for xaddr in xaddrs:
+            ip = urllib.parse.urlsplit(xaddr).hostname
+            if ip:
+                break
+        ip = ip or sender_ip
+        scope_values = {}
+        for scope in scopes:
+            prefix = 'onvif://www.onvif.org/'
+            if scope.startswith(prefix) and '/' in scope[len(prefix):]:
+                kind, value = scope[len(prefix):].split('/', 1)
+                scope_values.setdefault(kind, urllib.parse.unquote(value))
+        devices.append({
+            'address': addresses[0] if addresses else f'ip:{ip}',
+            'ip': ip,
+            'xaddrs': xaddrs,
+            'name': scope_values.get('name') or ip,
+            'hardware': scope_values.get('hardware'),
+            'scopes': scopes
+        })
+    return devices
+
+def ws_discovery_search(seconds=ONVIF_SEARCH_SECONDS, on_device=None):
+    """Multicast a WS-Discovery Probe for ONVIF cameras and collect replies until the deadline"""
+    message_id = uuid.uuid4()
+    probe = ONVIF_PROBE_MESSAGE.format(message_id=message_id).encode()
+    found = {}
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 4)
+        sock.bind(('', 0))
+        deadline = time.monotonic() + seconds
+        # UDP is lossy, WS-Discovery clients send the probe more than once
+        resend_at = [time.monotonic(), time.monotonic() + 0.25]
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            while resend_at and resend_at[0] <= now:
+                resend_at.pop(0)
+                sock.sendto(probe, (ONVIF_DISCOVERY_ADDRESS, ONVIF_DISCOVERY_PORT))
+            wait = deadline - now if not resend_at else min(deadline, resend_at[0]) - now
+            sock.settimeout(max(0.01, wait))
+            try:
+                data, (sender_ip, _) = sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            for device in parse_probe_matches(data, sender_ip, message_id):
+                if device['address'] not in found:
+                    found[device['address']] = device
+                    if on_device is not None:
+                        on_device(device)
+    finally:
+        sock.close()
+    return list(found.values())
+
+def _rtsp_url(ip, port, path, username='', password=''):
+    credentials = ''
+    if username:
+        credentials = urllib.parse.quote(username, safe='') + ':' + urllib.parse.quote(password, safe='') + '@'
+    netloc = f'{ip}:{port}' if port != 554 else ip
+    return f'rtsp://{credentials}{netloc}/{path}'
+
+def _rtsp_authorization(challenge, url, username, password):
+    """Authorization header for a 401 WWW-Authenticate challenge (Basic or Digest)"""
+    scheme, _, params = challenge.partition(' ')
+    if scheme.lower() == 'basic':
+        return 'Basic ' + base64.b64encode(f'{username}:{password}'.encode()).decode()
+    fields = dict(re.findall(r'(\w+)="?([^",]*)"?', params))
+    ha1 = hashlib.md5(f"{username}:{fields.get('realm', '')}:{password}".encode()).hexdigest()
+    ha2 = hashlib.md5(f'DESCRIBE:{url}'.encode()).hexdigest()
+    response = hashlib.md5(f"{ha1}:{fields.get('nonce', '')}:{ha2}".encode()).hexdigest()
+    return (f'Digest username="{username}", realm="{fields.get("realm", "")}", '
+            f'nonce="{fields.get("nonce", "")}", uri="{url}", response="{response}"')
+
+def rtsp_describe(url, timeout=ONVIF_PROBE_TIMEOUT, authorization=None, cseq=1):
+    """Send one RTSP DESCRIBE and return (status, headers, body)"""
+    parsed = urllib.parse.urlsplit(url)
+    deadline = time.monotonic() + timeout
+    lines = [f'DESCRIBE {url} RTSP/1.0', f'CSeq: {cseq}', 'Accept: application/sdp', 'User-Agent: dooyoo']
+    if authorization:
+        lines.append(f'Authorization: {authorization}')
+    with socket.create_connection((parsed.hostname, parsed.port or 554), timeout=timeout) as sock:
+        sock.sendall(('\r\n'.join(lines) + '\r\n\r\n').encode())
+        data = b''
+        while b'\r\n\r\n' not in data:
+            sock.settimeout(max(0.01, deadline - time.monotonic()))
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+        head, _, body = data.partition(b'\r\n\r\n')
+        head_lines = head.decode('latin-1').split('\r\n')
+        parts = head_lines[0].split(' ', 2)
+        if len(parts) < 2 or not parts[0].startswith('RTSP/') or not parts[1].isdigit():
+            raise ValueError('Not an RTSP response')
+        headers = {}
+        for line in head_lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', '0') or 0)
+        while len(body) < length:
+            sock.settimeout(max(0.01, deadline - time.monotonic()))
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            body += chunk
+    return int(parts[1]), headers, body[:length].decode('utf-8', 'replace')
+
+def parse_sdp_video(sdp):
+    """(codec, width, height) of the first video stream in an SDP description"""
+    codec = width = height = None
+    in_video = False
+    for line in sdp.splitlines():
+        line = line.strip()
+        if line.startswith('m='):
+            if in_video:
+                break
+            in_video = line.startswith('m=video')
+        elif in_video and line.startswith('a=rtpmap:') and codec is None:
+            codec = line.split(' ', 1)[-1].split('/')[0].upper()
+        elif in_video and width is None:
+            size = (re.match(r'a=x-dimensions:\s*(\d+),\s*(\d+)', line)
+                    or re.match(r'a=framesize:\d+\s+(\d+)-(\d+)', line))
+            if size:
+                width, height = int(size.group(1)), int(size.group(2))
+    return codec, width, height
+
+def probe_rtsp_path(ip, port, path, username=ONVIF_RTSP_USERNAME, password=ONVIF_RTSP_PASSWORD):
+    """DESCRIBE one candidate stream; the path works when the camera answers 200 with an SDP"""
+    url = _rtsp_url(ip, port, path)
+    started = time.monotonic()
+    try:
+        status, headers, body = rtsp_describe(url)
+        if status == 401 and username and headers.get('www-authenticate'):
+            authorization = _rtsp_authorization(headers['www-authenticate'], url, username, password)
+            status, headers, body = rtsp_describe(url, authorization=authorization, cseq=2)
+    except (OSError, ValueError) as e:
+        return {'path': path, 'port': port, 'status': None, 'error': str(e)}
+    codec, width, height = parse_sdp_video(body) if status == 200 else (None, None, None)
+    return {
+        'path': path,
+        'port': port,
+        'status': status,
+        'describe_ms': round((time.monotonic() - started) * 1000, 1),
+        'codec': codec,
+        'width': width,
+        'height': height
+    }
+
+def probe_rtsp_open(url, timeout=ONVIF_OPEN_TIMEOUT):
+    """Open a stream the way the monitor does and time it up to the first decoded frame"""
+    started = time.monotonic()
+    video = cv2.VideoCapture(url, cv2.CAP_FFMPEG, [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(timeout * 1000),
+                                                   cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(timeout * 1000)])
+    try:
+        if not video.isOpened():
+            return {'opened': False}
+        open_ms = (time.monotonic() - started) * 1000
+        ret, frame = video.read()
+        result = {'opened': True, 'open_ms': round(open_ms, 1)}
+        if ret:
+            result.update(first_frame_ms=round((time.monotonic() - started) * 1000, 1),
+                          width=frame.shape[1], height=frame.shape[0])
+        fourcc = int(video.get(cv2.CAP_PROP_FOURCC))
+        if fourcc:
+            result['codec'] = ''.join(chr((fourcc >> (8 * i)) & 0xFF) for i in range(4)).strip().upper()
+        fps = video.get(cv2.CAP_PROP_FPS)
+        if fps and fps < 1000:
+            result['fps'] = round(fps, 2)
+        return result
+    finally:
+        video.release()
+
+class OnvifDirectory:
+    """Background ONVIF discovery with a TTL cache of devices and their verified RTSP streams
+
+    A scan multicasts a WS-Discovery probe, then checks the candidate RTSP
+    paths of each new or changed device on a bounded worker pool: TCP connect
+    on each port, DESCRIBE on every path of the open ports, then a real
+    open of the best answer to measure latency and resolution. Devices
+    are published as soon as they answer and updated as their probes finish.
+    """
+
+    def __init__(self):
+        self.devices = {}  # {address: device dict}
+        self.scans = 0
+        self.last_scan = None
+        self.last_error = None
+        self.scanning = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._idle = threading.Condition(self._lock)
+        self._thread = None
+        self._executor = None
+
+    @property
+    def started(self):
+        """Whether discovery has been used yet, see ensure_started()"""
+        return self._thread is not None
+
+    def ensure_started(self):
+        """Start scanning on first use, so servers that never discover send no multicast"""
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, ONVIF_PROBE_WORKERS),
+                                                                   thread_name_prefix='onvif-probe')
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+            return True
+
+    def refresh(self, wait=None):
+        """Request a scan now; with wait, block until it finishes (or the timeout)"""
+        started = self.ensure_started()
+        with self._lock:
+            # A scan already under way started before this request, wait for the next one
+            target = self.scans + (1 if self.scanning and not started else 0)
+            if not started:
+                self._wake.set()
+            if wait:
+                self._idle.wait_for(lambda: self.scans > target, timeout=wait)
+
+    def list(self):
+        with self._lock:
+            devices = [dict(device) for device in self.devices.values()]
+        return sorted(devices, key=lambda d: (d['ip'] or '', d['address']))
+
+    def _run(self):
+        while True:
+            try:
+                self.scan()
+            except Exception as e:
+                self.last_error = str(e)
+                log.error('onvif_scan_failed', f"❌ ONVIF discovery failed: {e}")
+            self._wake.wait(ONVIF_DISCOVERY_INTERVAL if ONVIF_DISCOVERY_INTERVAL > 0 else None)
+            self._wake.clear()
+
+    def _merge(self, found):
+        """Add or update a discovered device; returns it when its streams need probing"""
+        now = time.time()
+        with self._lock:
+            device = self.devices.get(found['address'])
+            if device is None:
+                device = self.devices[found['address']] = dict(found, first_seen=now, status='probing',
+                                                               rtsp_url=None, stream=None, probed_at=None)
+                log.info('onvif_device_found', f"📡 ONVIF camera found at {found['ip']}", ip=found['ip'],
+                         name=found['name'])
+            changed = device['ip'] != found['ip'] or device['xaddrs'] != found['xaddrs']
+            device.update(found, last_seen=now)
+            stale = device['probed_at'] is None or now - device['probed_at'] > ONVIF_REPROBE_SECONDS
+            if changed or stale:
+                device['status'] = 'probing'
+                return dict(device)
+        return None
+
+    def scan(self):
+        with self._lock:
+            self.scanning = True
+        try:
+            to_probe = []
+
+            def on_device(found):
+                device = self._merge(found)
+                if device is not None:
+                    to_probe.append(device)
+
+            ws_discovery_search(on_device=on_device)
+            self._probe(to_probe)
+            now = time.time()
+            with self._lock:
+                for address in [a for a, d in self.devices.items() if now - d['last_seen'] > ONVIF_DEVICE_TTL]:
+                    del self.devices[address]
+            self.last_error = None
+        finally:
+            with self._lock:
+                self.scanning = False
+                self.scans += 1
+                self.last_scan = time.time()
+                self._idle.notify_all()
+
+    def _probe(self, devices):
+        if not devices:
+            return
+        executor = self._executor
+        # Ports first, so closed ports cost one connect instead of one per path
+        port_checks = {executor.submit(self._port_open, d['ip'], port): (d['address'], port)
+                       for d in devices for port in ONVIF_RTSP_PORTS}
+        open_ports = {}
+        for future in concurrent.futures.as_completed(port_checks):
+            address, port = port_checks[future]
+            if future.result():
+                open_ports.setdefault(address, []).append(port)
+        describes = {}
+        for device in devices:
+            for port in sorted(open_ports.get(device['address'], []), key=ONVIF_RTSP_PORTS.index):
+                for rank, path in enumerate(ONVIF_RTSP_PATHS):
+                    future = executor.submit(probe_rtsp_path, device['ip'], port, path)
+                    describes[future] = (device['address'], (ONVIF_RTSP_PORTS.index(port), rank))
+        answers = {}
+        for future in concurrent.futures.as_completed(describes):
+            address, rank = describes[future]
+            answers.setdefault(address, []).append((rank, future.result()))
+        opens = {}
+        for device in devices:
+            ranked = [answer for _, answer in sorted(answers.get(device['address'], []), key=lambda a: a[0])]
+            best = (next((a for a in ranked if a['status'] == 200), None)
+                    or next((a for a in ranked if a['status'] == 401), None))
+            if best is None:
+                self._finish(device, 'no_port' if device['address'] not in open_ports else 'no_stream', None)
+            elif best['status'] == 401:
+                self._finish(device, 'auth_required', best)
+            else:
+                url = _rtsp_url(device['ip'], best['port'], best['path'], ONVIF_RTSP_USERNAME, ONVIF_RTSP_PASSWORD)
+                opens[executor.submit(probe_rtsp_open, url)] = (device, best)
+        for future in concurrent.futures.as_completed(opens):
+            device, best = opens[future]
+            try:
+                opened = future.result()
+            except Exception as e:
+                opened = {'opened': False, 'error': str(e)}
+            stream = dict(best)
+            stream.update({k: v for k, v in opened.items() if v is not None})
+            self._finish(device, 'ok' if opened.get('opened') else 'open_failed', stream)
+
+    @staticmethod
+    def _port_open(ip, port):
+        try:
+            with socket.create_connection((ip, port), timeout=ONVIF_PROBE_TIMEOUT):
+                return True
+        except OSError:
+            return False
+
+    def _finish(self, probed, status, stream):
+        with self._lock:
+            device = self.devices.get(probed['address'])
+            if device is None:
+                return
+            device['status'] = status
+            device['stream'] = stream
+            device['probed_at'] = time.time()
+            # Credentials are never part of the published URL
+            device['rtsp_url'] = (_rtsp_url(device['ip'], stream['port'], stream['path'])
+                                  if stream is not None else None)
+
+    def stats(self):
+        with self._lock:
+            statuses = {}
+            for device in self.devices.values():
+                statuses[device['status']] = statuses.get(device['status'], 0) + 1
+            return {
+                'started': self.started,
+                'scanning': self.scanning,
+                'scans': self.scans,
+                'last_scan': self.last_scan,
+                'last_error': self.last_error,
+                'devices': len(self.devices),
+                'statuses': statuses
+            }
+
+onvif_directory = OnvifDirectory()
 
 @app.get('/onvif/discover')
-def onvif_discover():
+def onvif_discover(refresh: bool = False, wait: float = 0):
     """
     ค้นหา ONVIF กล้องในวง LAN (server ต้องอยู่ในวงเดียวกับกล้อง)
-    คืนค่า: [{ip, xaddrs, name, rtsp_url}]
+    คืนค่าจาก cache ทันที: [{ip, xaddrs, name, rtsp_url, status, stream}]
+    refresh=true สั่งสแกนใหม่, wait=วินาทีที่รอให้สแกนเสร็จ
     """
-    try:
-        from wsdiscovery.discovery import ThreadedWSDiscovery as WSDiscovery
-    except ImportError:
-        return {"success": False, "error": "wsdiscovery library not installed. Please install with 'pip install wsdiscovery'"}
-    try:
-        wsd = WSDiscovery()
-        wsd.start()
-        services = wsd.searchServices()
-        result = []
-        for service in services:
-            xaddrs = service.getXAddrs()
-            ip = None
-            if xaddrs:
-                try:
-                    ip = xaddrs[0].split('/')[2].split(':')[0]
-                except Exception:
-                    ip = None
-            name = service.getEPR()
-            # เดา RTSP URL (มาตรฐาน ONVIF ส่วนใหญ่ใช้ 554)
-            rtsp_url = f"rtsp://{ip}:554/Streaming/Channels/101" if ip else None
-            result.append({
-                "ip": ip,
-                "xaddrs": xaddrs,
-                "name": name,
-                "rtsp_url": rtsp_url
-            })
-        wsd.stop()
-        return {"success": True, "devices": result}
-    except Exception as e:
-        return {"success": False, "error": str(e)}
-
-@app.get('/cctv/stream/{user_id}/{camera_index}')
-def stream_camera(user_id: str, camera_index: int):
-    cameras = load_cameras()
-    if user_id not in cameras or camera_index >= len(cameras[user_id]):
-        raise HTTPException(status_code=404, detail='Camera not found')
-    camera = cameras[user_id][camera_index]
-    rtsp_url = camera.get('rtsp_url')
-    if not rtsp_url:
-        raise HTTPException(status_code=400, detail='No RTSP URL for this camera')
-    return StreamingResponse(mjpeg_stream(rtsp_url, user_id), media_type='multipart/x-mixed-replace; boundary=frame')
+    first = not onvif_directory.started
+    if refresh or first:
+        # The first call has nothing cached yet, give the initial scan a moment
+        onvif_directory.refresh(wait=min(max(wait, 0), 60) or (ONVIF_SEARCH_SECONDS + 1 if first else None))
+    stats = onvif_directory.stats()
+    return {
+        "success": True,
+        "devices": onvif_directory.list(),
+        "scanning": stats['scanning'],
+        "last_scan": stats['last_scan'],
+        "error": stats['last_error']
+    }
 
 # ========== Accident Videos API ==========
 @app.get('/accident-videos/{user_id}')
-async def get_accident_videos(user_id: str):
-    """Get accident videos for a specific user"""
-    user_accidents = accident_videos.get(user_id, [])
+async def get_accident_videos(user_id: str, camera: Optional[str] = None, since: Optional[float] = None,
+                              until: Optional[float] = None, min_confidence: Optional[float] = None,
+                              cursor: Optional[str] = None, limit: int = 100):
+    """Get accident videos for a specific user, newest first"""
+    try:
+        rows, next_cursor = media_index.query(user_id, 'accident', camera=camera, since=since, until=until,
+                                              min_confidence=min_confidence, cursor=cursor,
+                                              limit=max(1, min(limit, 1000)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    user_accidents = [
+        {
+            'id': row['id'],
+            'filename': row['filename'],
+            'filepath': row['filepath'],
+            'camera_name': row['camera_name'],
+            'accident_time': row['accident_time'],
+            'created': row['created'],
+            'duration': row['duration'],
+            'confidence': row['confidence'],
+            'thumbnail_url': thumbnail_url('accident', row)
+        }
+        for row in rows
+    ]
     return {
         'success': True,
         'videos': user_accidents,
-        'count': len(user_accidents)
+        'count': len(user_accidents),
+        'next_cursor': next_cursor
     }
 
 @app.get('/accident-video-file/{filename}')
-async def get_accident_video_file(filename: str):
+async def get_accident_video_file(filename: str, request: Request, format: str = 'auto'):
     """Serve accident video file"""
-    folder = 'accident_clips'
-    file_path = os.path.join(folder, filename)
-    if not os.path.exists(file_path):
+    response = serve_media(request, ACCIDENT_CLIPS_FOLDER, filename, format, 'accident-video-file')
+    if response is None:
+        raise HTTPException(status_code=404, detail="Accident video not found")
+    return response
+
+@app.get('/accident-video-file/{filename}/hls/{asset}')
+async def get_accident_video_hls(filename: str, asset: str, request: Request):
+    response = serve_hls_asset(request, ACCIDENT_CLIPS_FOLDER, filename, asset)
+    if response is None:
         raise HTTPException(status_code=404, detail="Accident video not found")
-    return FileResponse(file_path, media_type="video/avi", filename=filename)
+    return response
 
 class MonitoringRequest(BaseModel):
-    selectedCameras: List[int] = []
+    selectedCameras: List[Union[int, str]] = []  # camera ids, or list indices from older clients
 
 @app.post('/start-monitoring/{user_id}')
 async def start_monitoring(user_id: str, request: MonitoringRequest, background_tasks: BackgroundTasks):
     """Start continuous monitoring for selected user cameras"""
-    cameras = load_cameras()
-    if user_id not in cameras:
+    user_cameras = store.list_cameras(user_id)
+    if not user_cameras:
         raise HTTPException(status_code=404, detail='No cameras found for user')
     
-    user_cameras = cameras[user_id]
     selected_cameras = request.selectedCameras
     
     # If no cameras selected, return error
     if not selected_cameras:
         raise HTTPException(status_code=400, detail='No cameras selected for monitoring')
     
-    if user_id not in monitoring_threads:
-        monitoring_threads[user_id] = {}
-    
     started_cameras = []
-    for camera_index in selected_cameras:
-        if camera_index >= len(user_cameras):
+    running_cameras = []
+    rejected_cameras = []
+    for camera_ref in selected_cameras:
+        camera_info = find_camera_ref(user_id, camera_ref)
+        if camera_info is None:
             continue
             
-        camera_info = user_cameras[camera_index]
-        if camera_info.get('rtsp_url') and not camera_info.get('relay'):
-            # Start monitoring thread for this camera
-            thread = threading.Thread(
-                target=continuous_monitor_camera,
-                args=(user_id, camera_index, camera_info),
-                daemon=True
-            )
-            thread.start()
-            monitoring_threads[user_id][camera_index] = thread
-            started_cameras.append(camera_info['name'])
+        if camera_source(user_id, camera_info):
+            # Start (or keep) the supervised monitoring worker for this camera
+            worker, started = monitor_supervisor.start(user_id, camera_info)
+            if started:
+                started_cameras.append(camera_info['name'])
+            elif worker is not None:
+                running_cameras.append(camera_info['name'])
+            else:
+                rejected_cameras.append(camera_info['name'])
     
     return {
         'success': True,
         'message': f'Started monitoring {len(started_cameras)} selected cameras',
-        'cameras': started_cameras
+        'cameras': started_cameras,
+        'already_running': running_cameras,
+        'rejected': rejected_cameras
     }
 
 @app.post('/stop-monitoring/{user_id}')
 async def stop_monitoring(user_id: str):
     """Stop continuous monitoring for user cameras"""
-    if user_id in monitoring_threads:
-        # Note: In a real implementation, you'd need a proper way to stop threads
-        # For now, we'll just clear the references
-        monitoring_threads[user_id] = {}
+    if monitor_supervisor.stop(user_id):
         return {
             'success': True,
             'message': 'Monitoring stopped for all cameras'
@@ -634,7 +4562,130 @@ async def stop_monitoring(user_id: str):
         'message': 'No active monitoring found for user'
     }
 
-# ========== Main ===========
-if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+@app.get('/monitoring/status')
+def monitoring_status(user_id: Optional[str] = None):
+    """State, FPS and last error of each monitoring worker"""
+    workers = monitor_supervisor.stats(user_id)
+    return {
+        'success': True,
+        'workers': workers,
+        'count': len(workers),
+        'max_workers': monitor_supervisor.max_workers
+    }
+
+# ========== Sampling Profiler ==========
+PROFILER_INTERVAL_MS = float(os.environ.get('PROFILER_INTERVAL_MS', '10'))
+PROFILER_MAX_SECONDS = float(os.environ.get('PROFILER_MAX_SECONDS', '300'))
+
+def camera_threads(key):
+    """[(role, thread)] of everything working on a camera right now"""
+    return (capture_hub.threads(key) + monitor_supervisor.threads(key)
+            + recording_manager.threads(key) + broadcast_hub.threads(key))
+
+class SamplingProfiler:
+    """Opt-in stack sampler for the threads of one camera
+
+    Every interval it reads the current stack of each of the camera's
+    threads and counts it in collapsed form ('role;file:function;...'),
+    which flame graph tools read directly. It only runs while a session
+    is active, so there is no cost when profiling is off.
+    """
+
+    def __init__(self, key, seconds, interval_ms=PROFILER_INTERVAL_MS):
+        self.key = key
+        self.seconds = min(seconds, PROFILER_MAX_SECONDS)
+        self.interval = max(1.0, interval_ms) / 1000.0
+        self.samples = 0
+        self.stacks = {}  # {collapsed_stack: count}
+        self.started_at = time.time()
+        self.finished_at = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        deadline = time.monotonic() + self.seconds
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            threads = camera_threads(self.key)
+            frames = sys._current_frames()
+            for role, thread in threads:
+                frame = frames.get(thread.ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                collapsed = ';'.join([role] + stack[::-1])
+                self.stacks[collapsed] = self.stacks.get(collapsed, 0) + 1
+            self.samples += 1
+            self._stop.wait(self.interval)
+        self.finished_at = time.time()
+
+    def collapsed(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in sorted(self.stacks.items(), key=lambda i: -i[1]))
+
+    def report(self, limit=30):
+        total = sum(self.stacks.values()) or 1
+        top = sorted(self.stacks.items(), key=lambda i: -i[1])[:limit]
+        return {
+            'user_id': self.key[0],
+            'camera_id': self.key[1],
+            'running': self.running,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'seconds': self.seconds,
+            'interval_ms': self.interval * 1000.0,
+            'samples': self.samples,
+            'top_stacks': [{'stack': stack, 'samples': count, 'percent': round(count * 100.0 / total, 1)}
+                           for stack, count in top]
+        }
+
+profiler_sessions = {}  # {(user_id, camera_id): SamplingProfiler}
+
+def _profile_key(user_id, camera_ref):
+    camera = find_camera_ref(user_id, camera_ref)
+    if camera is None:
+        raise HTTPException(status_code=404, detail='Camera not found')
+    return (user_id, camera['id'])
+
+@app.post('/debug/profile/{user_id}/{camera_ref}')
+def start_profiler(user_id: str, camera_ref: str, seconds: float = 30):
+    """Sample the stacks of one camera's threads for `seconds`"""
+    key = _profile_key(user_id, camera_ref)
+    if not camera_threads(key):
+        raise HTTPException(status_code=404, detail='Nothing is running for this camera')
+    session = profiler_sessions.get(key)
+    if session is not None and session.running:
+        return {'success': True, 'already_running': True, 'profile': session.report(0)}
+    session = profiler_sessions[key] = SamplingProfiler(key, max(1.0, seconds))
+    log.info('profiler_started', "Sampling profiler started", user_id=user_id, camera=key[1],
+             seconds=session.seconds)
+    return {'success': True, 'already_running': False, 'profile': session.report(0)}
+
+@app.get('/debug/profile/{user_id}/{camera_ref}')
+def get_profile(user_id: str, camera_ref: str, format: str = 'json', limit: int = 30):
+    """Profile so far; format=collapsed returns flame graph input"""
+    session = profiler_sessions.get(_profile_key(user_id, camera_ref))
+    if session is None:
+        raise HTTPException(status_code=404, detail='No profile for this camera')
+    if format == 'collapsed':
+        return Response(session.collapsed() + '\n', media_type='text/plain')
+    return session.report(max(1, limit))
+
+@app.delete('/debug/profile/{user_id}/{camera_ref}')
+def stop_profiler(user_id: str, camera_ref: str):
+    session = profiler_sessions.get(_profile_key(user_id, camera_ref))
+    if session is None:
+        raise HTTPException(status_code=404, detail='No profile for this camera')
+    session.stop()
+    return {'success': True, 'profile': session.report()}
+ 
\ No newline at end of file
@@ -109,7 +109,7 @@ export default function CCTV() {
           'Content-Type': 'application/json',
         },
         body: JSON.stringify({
-          selectedCameras: selectedCamerasForAI
+          selectedCameras: selectedCamerasForAI.map(index => cameras[index]?.id ?? index)
         })
       });
       
@@ -227,7 +227,7 @@ export default function CCTV() {
         {
           text: 'Delete', style: 'destructive', onPress: async () => {
             try {
-              const res = await fetch(`${API_ENDPOINTS.CCTV_REMOVE_CAMERA}?user_id=${userId}&camera_index=${index}`, {
+              const res = await fetch(`${API_ENDPOINTS.CCTV_REMOVE_CAMERA}?user_id=${userId}&camera_id=${cameras[index]?.id}`, {
                 method: 'DELETE',
               });
               const data = await res.json();
@@ -254,6 +254,7 @@ export default function CCTV() {
         body: JSON.stringify({
           userId: userId,
           cameraIndex: index,
+          cameraId: cameras[index]?.id,
           cameraName: newName,
           rtspUrl: newRtspUrl
         })
@@ -15,8 +15,9 @@ export default function CCTVLiveView() {
   const [selectedTime, setSelectedTime] = useState(0); // minutes in day (0-1439)
   const [currentTimeLabel, setCurrentTimeLabel] = useState('00:00');
 
-  const streamUrl = camera?.rtsp_url
-    ? `${API_ENDPOINTS.STREAM_CAMERA.replace(':userId', userId).replace(':cameraIndex', cameraIndex)}`
+  // Relay cameras have no rtsp_url, the server streams them by id too
+  const streamUrl = camera?.id || camera?.relay || camera?.rtsp_url
+    ? `${API_ENDPOINTS.STREAM_CAMERA.replace(':userId', userId).replace(':cameraId', camera?.id ?? cameraIndex)}`
     : null;
 
   // Function to convert minutes to HH:MM time
@@ -145,7 +145,8 @@ const Home = () => {
       const res = await fetch(`${API_ENDPOINTS.START_MONITORING}/${userId}`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ selectedCameras })
+        // Cameras are addressed by their stable id, indices shift when one is removed
+        body: JSON.stringify({ selectedCameras: selectedCameras.map(index => cameras[index]?.id ?? index) })
       });
       const data = await res.json();
       if (data.success) {
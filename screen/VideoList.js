@@ -8,6 +8,7 @@ import { fetchVideos } from '../api/videoApi';
 import { Ionicons } from '@expo/vector-icons';
 import { useNavigation } from '@react-navigation/native';
 import { API_ENDPOINTS, BASE_URL } from '../config';
+import { parseAlert } from '../utils/alerts';
 
 const { width } = Dimensions.get('window');
 
@@ -25,14 +26,19 @@ export default function VideoList() {
     if (!userId || !wsUrl) return;
     const ws = new WebSocket(wsUrl);
     ws.onmessage = (event) => {
-      Notifications.scheduleNotificationAsync({
-        content: {
-          title: "AI Fall Detection",
-          body: event.data,
-        },
-        trigger: null,
-      });
-      fetchVideos(userId).then(data => setVideos(data.videos));
+      const alert = parseAlert(event.data);
+      if (alert.type === 'fall') {
+        Notifications.scheduleNotificationAsync({
+          content: {
+            title: "AI Fall Detection",
+            body: alert.message,
+          },
+          trigger: null,
+        });
+      }
+      if (alert.type === 'fall' || alert.type === 'clip_ready') {
+        fetchVideos(userId).then(data => setVideos(data.videos));
+      }
     };
     return () => ws.close();
   }, [userId, setVideos, wsUrl]);
@@ -50,6 +56,9 @@ export default function VideoList() {
         source={{ uri: `${API_ENDPOINTS.GET_VIDEO_FILE}/${item.filename}` }}
         useNativeControls
         resizeMode="contain"
+        usePoster={!!item.thumbnail_url}
+        posterSource={item.thumbnail_url ? { uri: `${BASE_URL}${item.thumbnail_url}` } : undefined}
+        posterStyle={{ resizeMode: 'contain' }}
         style={styles.video}
       />
     </View>
@@ -0,0 +1,90 @@
+# structured_log.py - Structured, rate-limited logging shared by the API and the model worker processes
+# Importing it has no side effects; setup_logging() installs the stdout handler
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')  # text | json
+LOG_RATE_LIMIT = int(os.environ.get('LOG_RATE_LIMIT', '10'))  # messages per event and camera per window, 0 = no limit
+LOG_RATE_WINDOW = float(os.environ.get('LOG_RATE_WINDOW', '60'))
+
+class StructuredFormatter(logging.Formatter):
+    """One line per record: 'time level event message key=value ...' or a JSON object"""
+
+    def __init__(self, fmt='text'):
+        super().__init__()
+        self.json = fmt == 'json'
+
+    def format(self, record):
+        fields = getattr(record, 'fields', {})
+        event = getattr(record, 'event', record.name)
+        if self.json:
+            return json.dumps({'time': round(record.created, 3), 'level': record.levelname, 'event': event,
+                               'message': record.getMessage(), **fields}, ensure_ascii=False, default=str)
+        line = f"{self.formatTime(record)} {record.levelname:<7} {event} {record.getMessage()}"
+        if fields:
+            line += ' ' + ' '.join(f'{k}={v}' for k, v in fields.items() if v is not None)
+        return line
+
+class RateLimitedLogger:
+    """Structured logger that lets each (event, user, camera) through at most `limit` times per window
+
+    A reconnecting camera or failing model can't flood the log; the next
+    message after a quiet window reports how many were suppressed.
+    """
+
+    def __init__(self, name='dooyoo', limit=LOG_RATE_LIMIT, window=LOG_RATE_WINDOW):
+        self.logger = logging.getLogger(name)
+        self.limit = limit
+        self.window = window
+        self.suppressed = 0
+        self._windows = {}  # {(event, user_id, camera): [window_start, count, suppressed]}
+        self._lock = threading.Lock()
+
+    def log(self, level, event, message, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        if self.limit > 0:
+            key = (event, fields.get('user_id'), fields.get('camera'))
+            now = time.monotonic()
+            with self._lock:
+                state = self._windows.get(key)
+                if state is None or now - state[0] >= self.window:
+                    if state is not None and state[2]:
+                        fields['suppressed'] = state[2]
+                    state = self._windows[key] = [now, 0, 0]
+                if state[1] >= self.limit:
+                    state[2] += 1
+                    self.suppressed += 1
+                    return
+                state[1] += 1
+        self.logger.log(level, message, extra={'event': event, 'fields': fields})
+
+    def debug(self, event, message, **fields):
+        self.log(logging.DEBUG, event, message, **fields)
+
+    def info(self, event, message, **fields):
+        self.log(logging.INFO, event, message, **fields)
+
+    def warning(self, event, message, **fields):
+        self.log(logging.WARNING, event, message, **fields)
+
+    def error(self, event, message, **fields):
+        self.log(logging.ERROR, event, message, **fields)
+
+def setup_logging(name='dooyoo'):
+    """Send the logger's records to stdout in LOG_FORMAT, once per process"""
+    logger = logging.getLogger(name)
+    if any(isinstance(h.formatter, StructuredFormatter) for h in logger.handlers):
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(StructuredFormatter(LOG_FORMAT))
+    logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+log = RateLimitedLogger()
@@ -0,0 +1,13 @@
+// Alert WebSocket messages are JSON ({ type: 'fall' | 'clip_ready' | 'heartbeat', message, ... })
+// Older servers send the plain alert text, treat that as a fall alert
+export const parseAlert = (data) => {
+  try {
+    const alert = JSON.parse(data);
+    if (alert && typeof alert === 'object') {
+      return alert;
+    }
+  } catch (error) {
+    // plain text message
+  }
+  return { type: 'fall', message: data };
+};